@@ -0,0 +1,57 @@
+#!/bin/bash
+
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+# Runs once on the first boot of a slave cloned from a provisioned disk
+# template. The disk still carries the identity of the node it was taken
+# from: ask Nailgun which node id this MAC address got and use it, and
+# replace the SSH host keys and puppet certificates shared with the
+# template node.
+
+master_ip=${1}
+
+mac=$(cat /sys/class/net/eth0/address)
+url="http://${master_ip}:8000/api/nodes/agent/"
+
+node_id=''
+while [ -z "$node_id" ]
+do
+    nailgun-agent >/dev/null 2>&1
+    node_id=$(curl -s -X PUT -H 'Content-Type: application/json' \
+                   -d "{\"mac\": \"${mac}\", \"is_agent\": true}" "$url" | \
+              sed -n -e 's/.*"id": *\([0-9]\+\).*/\1/p')
+    [ -z "$node_id" ] && sleep 10
+done
+
+sed -i "s/^identity *=.*/identity = ${node_id}/g" /etc/mcollective/server.cfg
+hostname node-${node_id}
+sed -i "s/^HOSTNAME=.*/HOSTNAME=node-${node_id}/g" /etc/sysconfig/network 2>/dev/null
+[ -f /etc/hostname ] && echo node-${node_id} > /etc/hostname
+
+echo ${node_id} > /etc/nailgun_uid
+
+rm -f /etc/ssh/ssh_host_*key*
+for type in rsa dsa ecdsa
+do
+    ssh-keygen -q -t $type -N '' -f /etc/ssh/ssh_host_${type}_key >/dev/null 2>&1
+done
+service ssh restart 2>/dev/null || service sshd restart
+
+# puppet requests a new certificate for the new hostname on its next run
+rm -rf /var/lib/puppet/ssl
+
+service mcollective restart
@@ -0,0 +1,117 @@
+#!/bin/bash
+
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+# Runs once on the first boot of a master cloned from a template, moving it
+# from the addressing of the site the template was taken on to its own.
+# The new admin prefix is written to $done_file once everything has moved;
+# any failing step stops the script before that.
+
+set -e
+
+old_admin_prefix=${1} # e.g. 10.20.1.
+new_admin_prefix=${2}
+old_public_prefix=${3} # e.g. 172.16.1.
+new_public_prefix=${4}
+
+done_file=/root/reip-fuel-master.done
+rm -f $done_file
+
+escape() {
+    echo "$1" | sed -e 's/\./\\./g'
+}
+
+nailgun_sql() {
+    dockerctl shell postgres sudo -u postgres psql -d nailgun -tA -v ON_ERROR_STOP=1 -c "$1"
+}
+
+old_admin=$(escape $old_admin_prefix)
+new_admin=$(escape $new_admin_prefix)
+old_public=$(escape $old_public_prefix)
+
+echo "Moving Fuel Master from ${old_admin_prefix}0 to ${new_admin_prefix}0... "
+
+for file in /etc/sysconfig/network \
+            /etc/sysconfig/network-scripts/ifcfg-eth* \
+            /etc/hosts \
+            /etc/resolv.conf \
+            /etc/dnsmasq.upstream \
+            /etc/fuel/astute.yaml
+do
+    [ -f "$file" ] || continue
+    sed -i -e "s/\b${old_admin}/${new_admin_prefix}/g" \
+           -e "s/\b${old_public}/${new_public_prefix}/g" "$file"
+done
+
+service network restart
+
+# containers are recreated so that they pick up the new astute.yaml
+dockerctl destroy all
+dockerctl start all
+
+# the admin network lives in the Nailgun database, which the containers
+# keep, so its addresses and those handed out from it move separately
+admin_sql="
+UPDATE network_groups
+   SET cidr = regexp_replace(text(cidr), '^${old_admin}', '${new_admin_prefix}')::cidr,
+       gateway = regexp_replace(host(gateway), '^${old_admin}', '${new_admin_prefix}')::inet
+ WHERE name = 'fuelweb_admin';
+UPDATE ip_addr_ranges
+   SET first = regexp_replace(host(first), '^${old_admin}', '${new_admin_prefix}')::inet,
+       last = regexp_replace(host(last), '^${old_admin}', '${new_admin_prefix}')::inet
+ WHERE network_group_id IN (SELECT id FROM network_groups WHERE name = 'fuelweb_admin');
+UPDATE ip_addrs
+   SET ip_addr = regexp_replace(host(ip_addr::inet), '^${old_admin}', '${new_admin_prefix}')::inet
+ WHERE network IN (SELECT id FROM network_groups WHERE name = 'fuelweb_admin');
+UPDATE nodes
+   SET ip = regexp_replace(host(ip), '^${old_admin}', '${new_admin_prefix}')::inet
+ WHERE host(ip) ~ '^${old_admin}';
+"
+
+# postgres may take a while to accept connections after the restart
+for attempt in $(seq 30); do
+    nailgun_sql "$admin_sql" && break
+    sleep 10
+done
+
+stale=$(nailgun_sql "
+SELECT count(*)
+  FROM network_groups g JOIN ip_addr_ranges r ON r.network_group_id = g.id
+ WHERE g.name = 'fuelweb_admin'
+   AND NOT (text(g.cidr) ~ '^${new_admin}' AND host(r.first) ~ '^${new_admin}'
+            AND host(r.last) ~ '^${new_admin}');
+" | tr -d '[:space:]')
+
+if [ "$stale" != "0" ]; then
+    echo "Admin network of Nailgun still outside ${new_admin_prefix}0 (${stale:-no answer})" >&2
+    exit 1
+fi
+
+# cobbler regenerates its DHCP and PXE configuration from the new
+# addresses; it runs in its own container, which may still be starting
+synced=
+for attempt in $(seq 30); do
+    dockerctl shell cobbler cobbler sync && synced=yes && break
+    sleep 10
+done
+
+if [ -z "$synced" ]; then
+    echo "cobbler sync failed in the cobbler container" >&2
+    exit 1
+fi
+
+echo "${new_admin_prefix}" > $done_file
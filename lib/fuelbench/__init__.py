@@ -28,18 +28,30 @@ import stat
 import string
 import getpass
 import tempfile
+import threading
 import logging
+import yaml
 
 from fuelbench import config_manager
 from fuelbench import utils
 from fuelbench import remote_tasks
+from fuelbench import parallel
+from fuelbench import isocache
+from fuelbench import ssh
+from fuelbench import nailgun
+from fuelbench import capacity
+from fuelbench import trace
+from fuelbench import metrics
+from fuelbench.waiter import Waiter
+from fuelbench.deployment import Deployment
+from fuelbench.nodeindex import NodeIndex, NodeMatcher, make_mac
 from fuelbench.providers import KvmProvider
+from fuelbench.providers import MultiHostProvider
+from fuelbench.providers import events
 from fuelbench.settings import *
 from fuelbench.error import *
 
 from fabric.api import execute
-from fabric.context_managers import settings as fab_context
-from fabric.context_managers import hide
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +67,9 @@ class FuelBench(object):
 		self.iso_fuel_version = ''	
 		self.master_fuel_version = ''
 		self.disable_master_public = False
+		self.slaves_provisioned = False
+		self.nailgun = None
+		self.defined_slaves = list()
 		#self.__generate_network_settings(site)
 
 	def __generate_network_settings(self, site):
@@ -103,27 +118,62 @@ class FuelBench(object):
 	def __get_public_network(self):
 		return self.networks[self.public_net_id]
 	
+	def __get_master_ssh_address(self):
+		# host[:port] of a stand-in such as the simulator, if configured
+		return self.config.get('master_ssh_address') or self.master_ip
+
 	def __get_master_ssh_context(self, show_output=False):
 		config = self.config
+
+		# network settings only change on check_iso/check_master
+		if not hasattr(self, 'master_ip'):
+			self.__generate_network_settings(self.site)
+
+		return ssh.session(config['master_user'],
+						   config['master_pass'],
+						   self.__get_master_ssh_address(),
+						   show_output=show_output,
+						   keepalive=config.get('ssh_keepalive', SSH_KEEPALIVE),
+						   timeout=config.get('ssh_timeout', SSH_TIMEOUT))
+
+	def disconnect_master(self):
+		if hasattr(self, 'master_ip'):
+			ssh.disconnect('{0}@{1}'.format(self.config['master_user'], self.__get_master_ssh_address()))
 		
-		master_user = config['master_user']
-		master_pass = config['master_pass']
-		self.__generate_network_settings(self.site)
-		master_ip = self.master_ip
+		if self.nailgun is not None:
+			self.nailgun.close()
+	
+	@property
+	def node_index(self):
+		"""Index of the site's slaves, kept in its work directory."""
+		return NodeIndex(os.path.join(self.local_workdir, 'nodes.json'))
+	
+	def __use_api(self):
+		return self.config.get('fuel_transport', FUEL_TRANSPORT) == 'api'
+	
+	def get_nailgun_client(self):
+		if not hasattr(self, 'master_ip'):
+			self.__generate_network_settings(self.site)
 		
-		master_host = '{0}@{1}'.format(master_user, master_ip)
+		if self.nailgun is None or self.nailgun.host != self.master_ip:
+			self.nailgun = self.make_nailgun_client()
 		
-		if show_output:
-			hide_groups = ['warnings', 'running', 'user', 'exceptions', 'aborts']
-		else:
-			hide_groups = ['everything', 'aborts']
+		return self.nailgun
+	
+	def make_nailgun_client(self):
+		"""New client of the site's Nailgun, not shared with the one of
+		get_nailgun_client(), e.g. for a deployment's own thread."""
+		config = self.config
 		
-		return fab_context(hide(*hide_groups),
-					       user=master_user,
-				           password=master_pass,
-					       hosts=[master_host],
-					       disable_known_hosts=True,
-					       abort_exception=RemoteTaskError)
+		if not hasattr(self, 'master_ip'):
+			self.__generate_network_settings(self.site)
+		
+		return nailgun.NailgunClient(self.master_ip,
+									 port=config.get('nailgun_port', NAILGUN_PORT),
+									 keystone_port=config.get('keystone_port', KEYSTONE_PORT),
+									 user=config.get('fuel_user', FUEL_USER),
+									 password=config.get('fuel_pass', FUEL_PASS),
+									 timeout=config.get('nailgun_timeout', NAILGUN_TIMEOUT))
 		
 	def make_workspace(self):
 		if not os.path.exists(self.local_workdir):
@@ -131,6 +181,7 @@ class FuelBench(object):
 	
 	def check_iso(self):
 		self.iso_fuel_version = utils.retrieve_iso_version(self.base_iso)
+		metrics.set_labels(fuel_version=self.iso_fuel_version)
 				
 		fuel_version = self.iso_fuel_version
 		if fuel_version not in FUEL_META_INFO.keys():
@@ -140,6 +191,7 @@ class FuelBench(object):
 		
 	def check_master(self):
 		self.master_fuel_version = self.get_fuel_version()
+		metrics.set_labels(fuel_version=self.master_fuel_version)
 				
 		fuel_version = self.master_fuel_version
 		if fuel_version not in FUEL_META_INFO.keys():
@@ -220,7 +272,14 @@ class FuelBench(object):
 			else:
 				print("External Horizon Link: http://{0}:{1}/horizon/".format(host_ip, horiweb_lt7_port))
 
-	def create_master(self, **kwargs):
+	@trace.traced()
+	def create_master(self, slaves=None, release='ubuntu', slave_template=False, slave_options=None, **kwargs):
+		"""Install the Fuel master of this site.
+		
+		Steps run as a PhaseGraph so that independent ones overlap. If
+		slaves is given (see create_slaves()), their VMs are defined while
+		the master installs and can be booted later with start_slaves().
+		"""
 		site = self.site
 		provider = self.provider
 		
@@ -233,6 +292,7 @@ class FuelBench(object):
 		master_os = meta_info['master']['os']
 		
 		vm_install_wait = config['vm_install_wait']
+		iso_cache_size = config['iso_cache_size']
 		search_domain = config['search_domain']
 				
 		admin_net = self.__get_admin_network()
@@ -258,83 +318,257 @@ class FuelBench(object):
 		
 		disable_public = config['disable_public']
 		disable_snapshot = config['disable_snapshot']
+		use_template = config.get('use_template', False)
 		
-		iso_image = None
-
-		try:
-			print('Cleaning up... ', end='')
-			sys.stdout.flush()
-			provider.clean_vm_nodes(site)
-			provider.clean_networks(site)
-			print('OK')
-	
-			print('Creating virtual networks... ', end='')
-			sys.stdout.flush()
-			network_list = provider.create_networks(site, self.networks)
-			print('OK')
-	
-			print('Making the custom ISO image... ', end='')
-			sys.stdout.flush()
-			iso_image = utils.make_custom_iso_image(base_iso, site,
-													data_dir=IMAGE_DIR,
-													ipaddr=master_ip,
-													gateway=admin_gw,
-													dns=admin_gw,
-													netmask=admin_mask,
-													hostname=master_hostname)
-			print('OK')
-	
-			print('Installing Fuel Master node... ', end='')
-			sys.stdout.flush()
-			provider.install_vm_node(site, master_name,
-									vcpus=master_cpu, ram=master_ram,
-									iso_image=iso_image,
-									disk_size=master_disk,
-									networks=network_list,
-									os_variant=master_os,
-									wait=vm_install_wait,
-									delete_media=True)
-			print('OK')
-			
-			self.wait_for_product_vm(45*60)
-			
-			self.disable_master_public = disable_public
-			if not disable_public:
-				print('Enabling outbound network/internet access for the product VM... ', end='')
+		admin_prefix = config['admin_network_ip'].format(site, '')
+		public_prefix = config['public_network_ip'].format(site, '')
+		
+		template = None
+		if use_template:
+			template = self.get_master_template(fuel_version)
+			if template is None:
+				print('No template found for Fuel {0}, installing from ISO.'.format(fuel_version))
+		
+		print_lock = threading.Lock()
+		
+		def report(phase):
+			with print_lock:
+				status = 'OK' if phase.error is None else 'failed: {0}'.format(phase.error)
+				print('{0}... {1} ({2:.1f}s)'.format(phase.name, status, phase.elapsed))
 				sys.stdout.flush()
-				self.run_remote_script(ENABLE_VM_NETWORK_SCRIPT, 
-									public_net_id, public_ip, public_mask, 
-									public_gw, public_gw, search_domain,
-									public_cidr)
-				print('OK')
-			
-			print('Setting up Fuel Master VM... ', end='')
-			sys.stdout.flush()	
-			self.run_remote_script(SETUP_FUEL_SCRIPT)
-			print('OK')
+		
+		def clean():
+			provider.clean_site(site)
+			self.node_index.clear()
+			self.disconnect_master()
+		
+		def create_networks():
+			return provider.create_networks(site, self.networks)
+		
+		def make_iso():
+			# masters keep their ISO attached, so it must outlive eviction
+			return isocache.get_custom_iso_image(base_iso,
+												ipaddr=master_ip,
+												gateway=admin_gw,
+												dns=admin_gw,
+												netmask=admin_mask,
+												hostname=master_hostname,
+												max_size=iso_cache_size,
+												keep=provider.get_attached_media())
+		
+		def clone_disk():
+			host = provider.get_site_provider(site)
+			disk_path = host.create_overlay_volume('site{0}-{1}.img'.format(site, master_name),
+												   template['path'], master_disk)
+			utils.add_firstboot_script(disk_path, REIP_MASTER_SCRIPT,
+									   template['admin_prefix'], admin_prefix,
+									   template['public_prefix'], public_prefix)
+			return disk_path
+		
+		def install():
+			network_list = graph.phases['Creating virtual networks'].value
 			
-			if not disable_snapshot:
+			if template:
+				provider.install_vm_node(site, master_name,
+										vcpus=master_cpu, ram=master_ram,
+										boot='import',
+										disk_path=graph.phases['Cloning Fuel Master disk from template'].value,
+										networks=network_list,
+										os_variant=master_os)
+			else:
+				provider.install_vm_node(site, master_name,
+										vcpus=master_cpu, ram=master_ram,
+										iso_image=graph.phases['Making the custom ISO image'].value,
+										disk_size=master_disk,
+										networks=network_list,
+										os_variant=master_os,
+										wait=vm_install_wait)
+		
+		def define_slaves():
+			self.create_slaves(slaves, use_template=slave_template, start=False, **(slave_options or {}))
+		
+		# the ISO build does not touch the site, so it overlaps the teardown;
+		# slaves are defined shut off while the master installs
+		graph = parallel.PhaseGraph(callback=report)
+		graph.add('Cleaning up', clean)
+		graph.add('Creating virtual networks', create_networks, requires=['Cleaning up'])
+		
+		if template:
+			graph.add('Cloning Fuel Master disk from template', clone_disk, requires=['Cleaning up'])
+			install_requires = ['Creating virtual networks', 'Cloning Fuel Master disk from template']
+		else:
+			graph.add('Making the custom ISO image', make_iso)
+			install_requires = ['Creating virtual networks', 'Making the custom ISO image']
+		
+		graph.add('Installing Fuel Master node', install, requires=install_requires)
+		
+		if slaves:
+			self.current_release = release
+			graph.add('Defining slave nodes', define_slaves, requires=['Creating virtual networks'])
+		
+		graph.add('Waiting for the product VM',
+				  lambda: self.wait_for_product_vm(45*60, progress=self.__print_bootstrap_progress()),
+				  requires=['Installing Fuel Master node'])
+		last_phase = 'Waiting for the product VM'
+		
+		if template:
+			# the template's bootstrap log is complete before the clone has
+			# moved its Nailgun admin network to this site
+			graph.add('Waiting for the Fuel Master to move to the site',
+					  lambda: self.wait_for_master_reip(admin_prefix),
+					  requires=[last_phase])
+			last_phase = 'Waiting for the Fuel Master to move to the site'
+		
+		self.disable_master_public = disable_public
+		if not disable_public:
+			graph.add('Enabling outbound network access for the product VM',
+					  lambda: self.run_remote_script(ENABLE_VM_NETWORK_SCRIPT,
+													 public_net_id, public_ip, public_mask,
+													 public_gw, public_gw, search_domain,
+													 public_cidr),
+					  requires=[last_phase])
+			last_phase = 'Enabling outbound network access for the product VM'
+		
+		graph.add('Setting up Fuel Master VM', lambda: self.run_remote_script(SETUP_FUEL_SCRIPT),
+				  requires=[last_phase])
+		last_phase = 'Setting up Fuel Master VM'
+		
+		if not disable_snapshot:
+			def snapshot():
 				self.shutdown_master()
-				print('Creating snapshot for Fuel Master recovery... ', end='')
-				sys.stdout.flush()	
 				provider.create_vm_snapshot(site, master_name, 'fuel_recovery', 'snapshot for fuel recovery')
-				print('OK')
 				self.start_master()
-				self.wait_for_product_vm()			
+				self.wait_for_product_vm()
 			
+			graph.add('Creating snapshot for Fuel Master recovery', snapshot, requires=[last_phase])
+		
+		try:
+			graph.run()
 		finally:
-			if iso_image and os.path.exists(iso_image):
-				try:
-					os.remove(iso_image)
-				except Exception, e:
-					print(str(e))
-					print('Warning: ISO image {0} still exists!'.format(iso_image))
-					
-	def create_slave(self, **kwargs):
+			print(graph.report())
+		
+	def __get_template_info_file(self, name):
+		return os.path.join(TEMPLATE_DIR, name + '.yaml')
+	
+	def __load_template(self, name):
+		# templates are volumes on the host the site lives on
+		provider = self.provider.get_site_provider(self.site)
+		info_file = self.__get_template_info_file(name)
+		
+		if not os.path.exists(info_file):
+			return None
+		
+		with open(info_file, 'r') as fp:
+			info = yaml.safe_load(fp)
+		
+		# the volume may have been removed behind our back
+		if provider.get_volume_path(info['volume']) != info['path']:
+			return None
+		
+		return info
+	
+	def __save_template(self, name, volume, disk_path, **kwargs):
+		provider = self.provider.get_site_provider(self.site)
+		
+		if provider.get_volume_path(volume):
+			provider.delete_volume(volume)
+		
+		template_path = provider.create_volume_from(volume, disk_path)
+		
+		info = dict(kwargs)
+		info.update({'volume': volume,
+					'path': template_path,
+					'site': self.site,
+					'created': time.strftime('%Y-%m-%d %H:%M:%S')})
+		
+		if not os.path.exists(TEMPLATE_DIR):
+			os.makedirs(TEMPLATE_DIR)
+		
+		with open(self.__get_template_info_file(name), 'w') as fp:
+			yaml.dump(info, fp, default_flow_style=False)
+		
+		return info
+	
+	def get_master_template(self, fuel_version):
+		return self.__load_template('master-{0}'.format(fuel_version))
+	
+	def get_slave_template(self, role):
+		fuel_version = self.master_fuel_version or self.iso_fuel_version
+		name = 'slave-{0}-{1}-{2}-site{3}'.format(fuel_version, self.current_release, role, self.site)
+		return self.__load_template(name)
+	
+	@trace.traced()
+	def create_master_template(self):
+		"""Capture the master of this site as the template for its Fuel
+		version. New sites of that version can then be cloned from it by
+		create_master(use_template=True) instead of installing from ISO."""
 		site = self.site
 		provider = self.provider
+		config = self.config
 		
 		fuel_version = self.master_fuel_version
+		master_name = config['master_name']
+		volume = MASTER_TEMPLATE.format(fuel_version)
+		
+		self.shutdown_master()
+		
+		print('Creating Fuel Master template for Fuel {0}... '.format(fuel_version), end='')
+		sys.stdout.flush()
+		
+		disk_path = provider.get_vm_disk_path(site, master_name)
+		info = self.__save_template('master-{0}'.format(fuel_version), volume, disk_path,
+									fuel_version=fuel_version,
+									admin_prefix=config['admin_network_ip'].format(site, ''),
+									public_prefix=config['public_network_ip'].format(site, ''))
+		
+		print('OK')
+		
+		self.start_master()
+		self.wait_for_product_vm()
+		
+		return info
+	
+	@trace.traced()
+	def check_capacity(self, slaves=(), with_master=False, replace_site=False, **kwargs):
+		"""Check that the master (if with_master) and slaves fit on the host
+		before anything is created. slaves are create_slaves() specs.
+		Raises CapacityError."""
+		config = self.config.copy()
+		config.update(utils.filter_kwargs(kwargs))
+		
+		planned = list()
+		
+		if with_master:
+			planned.append({'vcpus': config['master_cpu'],
+							'ram': config['master_ram'],
+							'disk': config['master_disk']})
+		
+		for slave in slaves:
+			spec = config.copy()
+			spec.update(utils.filter_kwargs(slave))
+			planned.append({'vcpus': spec['slave_cpu'],
+							'ram': spec['slave_ram'],
+							'disk': spec['slave_disk'],
+							'slave': True})
+		
+		return capacity.check(self.provider, self.site, planned, config, replace_site=replace_site)
+	
+	def allocate_node_ids(self, count):
+		"""Reserve count unused slave node IDs on this site. Safe to call
+		from parallel threads and processes; cleaning slaves frees them."""
+		site = self.site
+		provider = self.provider
+		
+		# slaves created before the index existed are found once by name
+		return self.node_index.allocate(count, seed=lambda: provider.get_max_node_id(site))
+	
+	@trace.traced()
+	def create_slave(self, node_id=None, role=None, admission=None, template=None, start=True, **kwargs):
+		site = self.site
+		provider = self.provider
+		
+		# slaves may be defined before the master is up
+		fuel_version = self.master_fuel_version or self.iso_fuel_version
 		current_release = self.current_release
 		meta_info = FUEL_META_INFO[fuel_version]
 		slave_os = meta_info['releases'][current_release]['os']
@@ -346,34 +580,207 @@ class FuelBench(object):
 		slave_ram = config['slave_ram']
 		slave_disk = config['slave_disk']
 		
-		node_id = provider.get_max_node_id(site) + 1
+		if node_id is None:
+			node_id = self.allocate_node_ids(1)[0]
 		node_name = 'node-' + str(node_id)
 		
 		network_list = provider.get_networks(site)
 		
-		try:
-			print('Creating {0} on site {1}... '.format(node_name, site), end='')
-			sys.stdout.flush()
+		# the admin NIC comes first; Nailgun reports its MAC
+		macs = [make_mac(site, node_id, nic) for nic in range(len(network_list))]
+		self.node_index.add(macs[0], node_name, node_id=node_id, role=role,
+							cpu=slave_cpu, ram=slave_ram, disk=slave_disk)
+		
+		if template:
+			# already provisioned, boots from disk without PXE
+			host = provider.get_site_provider(site)
+			disk_path = host.create_overlay_volume('site{0}-{1}.img'.format(site, node_name),
+												   template['path'], slave_disk)
+			utils.add_firstboot_script(disk_path, REIDENTIFY_SLAVE_SCRIPT, self.master_ip)
+			provider.install_vm_node(site, node_name, slave_cpu, slave_ram,
+									boot='import',
+									disk_path=disk_path,
+									networks=network_list,
+									macs=macs,
+									os_variant=slave_os,
+									start=start)
+			return node_name
+		
+		if not start:
 			provider.install_vm_node(site, node_name, slave_cpu, slave_ram,
 									boot='pxe',
 									disk_size=slave_disk,
 									networks=network_list,
+									macs=macs,
+									os_variant=slave_os,
+									start=False)
+			return node_name
+		
+		if admission is None:
+			admission = parallel.AdmissionController()
+		
+		with admission.admit():
+			provider.install_vm_node(site, node_name, slave_cpu, slave_ram,
+									boot='pxe',
+									disk_size=slave_disk,
+									networks=network_list,
+									macs=macs,
 									os_variant=slave_os,
 									persistent_boot=True)
-			print('OK')			
-		finally:
-			pass
-							
+		
+		return node_name
+	
+	@trace.traced()
+	def create_slaves(self, slaves, use_template=False, start=True, **kwargs):
+		"""Create slave VMs concurrently.
+		
+		slaves is a list of kwargs dicts for create_slave(), each with an
+		optional 'role'. PXE boots are paced by an AdmissionController built
+		from the pxe_boot_* settings. With use_template, slaves whose role has
+		a provisioned disk template are cloned from it instead. With
+		start=False the VMs are only defined; see start_slaves().
+		"""
+		site = self.site
+		provider = self.provider
+		
+		config = self.config.copy()
+		config.update(utils.filter_kwargs(kwargs))
+		
+		workers = config['slave_create_workers']
+		admission = parallel.AdmissionController(concurrency=config['pxe_boot_concurrency'],
+												interval=config['pxe_boot_interval'],
+												window=config['pxe_boot_window'])
+		
+		if len(slaves) == 0:
+			return list()
+		
+		templates = dict()
+		jobs = list()
+		node_ids = self.allocate_node_ids(len(slaves))
+		
+		for node_id, slave in zip(node_ids, slaves):
+			job = dict(slave, node_id=node_id)
+			role = job.get('role')
+			
+			if use_template and role:
+				if role not in templates:
+					templates[role] = self.get_slave_template(role)
+				job['template'] = templates[role]
+			
+			jobs.append(job)
+		
+		# deploy_nodes() may skip provisioning only if no node needs it
+		self.slaves_provisioned = all(job.get('template') for job in jobs)
+		
+		print_lock = threading.Lock()
+		
+		def create(job):
+			return self.create_slave(admission=admission, start=start, **job)
+		
+		def report(result):
+			with print_lock:
+				node_name = 'node-' + str(result.item['node_id'])
+				status = 'OK' if result.ok else 'failed: {0}'.format(result.error)
+				action = 'Creating' if start else 'Defining'
+				print('{0} {1} on site {2}... {3} ({4:.1f}s)'.format(action, node_name, site, status, result.elapsed))
+				sys.stdout.flush()
+		
+		results = parallel.run_parallel(create, jobs, workers=workers, callback=report)
+		
+		failed = [r.item['node_id'] for r in results if not r.ok]
+		if failed:
+			# otherwise discover_slaves() waits for them and the IDs are lost
+			for node_id in failed:
+				self.__discard_slave(node_id)
+			
+			raise FuelBenchError('Failed to create slave nodes: {0}'.format(', '.join('node-' + str(node_id)
+																					   for node_id in failed)))
+		
+		if not start:
+			self.defined_slaves = [(r.value, not r.item.get('template')) for r in results]
+		
+		return [r.value for r in results]
+	
+	def __discard_slave(self, node_id):
+		"""Remove what a failed create_slave() left behind and free its
+		node ID. The ID stays reserved if the VM cannot be removed."""
+		site = self.site
+		provider = self.provider
+		node_name = 'node-' + str(node_id)
+		
+		try:
+			if 'site{0}-{1}'.format(site, node_name) in provider.get_vm_nodes(site):
+				if provider.check_vm_node_active(site, node_name):
+					provider.destroy_vm_node(site, node_name)
+				provider.delete_vm_node(site, node_name)
+			
+			# a disk created before the domain was defined
+			host = provider.get_site_provider(site)
+			volume = 'site{0}-{1}.img'.format(site, node_name)
+			if host.get_volume_path(volume) is not None:
+				host.delete_volume(volume)
+		except Exception as e:
+			logger.warn('Unable to remove %s of site %s: %s', node_name, site, e)
+			return
+		
+		self.node_index.remove(node_name)
+		self.node_index.release([node_id])
+	
+	@trace.traced()
+	def start_slaves(self, **kwargs):
+		"""Boot the slaves defined by create_slaves(start=False). PXE boots
+		are paced like in create_slaves()."""
+		site = self.site
+		provider = self.provider
+		
+		config = self.config.copy()
+		config.update(utils.filter_kwargs(kwargs))
+		
+		admission = parallel.AdmissionController(concurrency=config['pxe_boot_concurrency'],
+												interval=config['pxe_boot_interval'],
+												window=config['pxe_boot_window'])
+		print_lock = threading.Lock()
+		
+		def start(item):
+			node_name, pxe = item
+			if pxe:
+				with admission.admit():
+					provider.start_vm_node(site, node_name)
+			else:
+				provider.start_vm_node(site, node_name)
+			return node_name
+		
+		def report(result):
+			with print_lock:
+				status = 'OK' if result.ok else 'failed: {0}'.format(result.error)
+				print('Starting {0} on site {1}... {2} ({3:.1f}s)'.format(result.item[0], site, status, result.elapsed))
+				sys.stdout.flush()
+		
+		results = parallel.run_parallel(start, self.defined_slaves,
+										workers=config['slave_create_workers'],
+										callback=report)
+		
+		failed = [r.item[0] for r in results if not r.ok]
+		if failed:
+			raise FuelBenchError('Failed to start slave nodes: {0}'.format(', '.join(failed)))
+		
+		self.defined_slaves = list()
+		
+		return [r.value for r in results]
+		
+	@trace.traced()
 	def clean(self):
 		site = self.site
 		provider = self.provider
 
 		print('Cleaning up... ', end='')
 		sys.stdout.flush()
-		provider.clean_vm_nodes(site)
-		provider.clean_networks(site)
+		provider.clean_site(site)
+		self.node_index.clear()
+		self.disconnect_master()
 		print('OK')
 		
+	@trace.traced()
 	def clean_slaves(self):
 		site = self.site
 		provider = self.provider
@@ -381,11 +788,15 @@ class FuelBench(object):
 		print('Removing slave nodes... ', end='')
 		sys.stdout.flush()
 		provider.clean_slave_nodes(site)
+		self.node_index.clear()
 		print('OK')
 		
 	def get_all_fuel_nodes(self):
 		fuel_nodes = list()
 		
+		if self.__use_api():
+			return [node._asdict() for node in self.get_nailgun_client().get_nodes()]
+		
 		with self.__get_master_ssh_context():
 			results = execute(remote_tasks.get_all_fuel_nodes)
 			
@@ -404,6 +815,7 @@ class FuelBench(object):
 				
 		return pending_nodes			
 	
+	@trace.traced()
 	def create_fuel_env(self, name=None, release='ubuntu', deploy_mode='ha', network_mode='neutron-vlan'):
 		self.make_workspace()
 		
@@ -447,6 +859,9 @@ class FuelBench(object):
 	def get_fuel_env(self):
 		fuel_env = list()
 		
+		if self.__use_api():
+			return [cluster._asdict() for cluster in self.get_nailgun_client().get_clusters()]
+		
 		with self.__get_master_ssh_context():
 			results = execute(remote_tasks.get_all_fuel_env)
 			
@@ -456,6 +871,9 @@ class FuelBench(object):
 		return fuel_env
 	
 	def get_fuel_version(self):
+		if self.__use_api():
+			return self.get_nailgun_client().get_version()['release']
+		
 		with self.__get_master_ssh_context():
 			results = execute(remote_tasks.get_fuel_version)
 			
@@ -470,6 +888,7 @@ class FuelBench(object):
 				local_script=script,
 				args=args)
 	
+	@trace.traced()
 	def add_fuel_nodes(self, node_ids, roles):
 		self.make_workspace()
 		
@@ -486,20 +905,180 @@ class FuelBench(object):
 				node_ids=node_ids,
 				node_roles=roles)
 			
-			for node_id in node_ids:
-				execute(remote_tasks.configure_fuel_node,
-					node_id=node_id,
-					workdir=self.local_workdir,
-					env_id=env_id,
-					admin_gw=admin_gateway)
+			execute(remote_tasks.configure_fuel_nodes,
+				node_ids=node_ids,
+				env_id=env_id,
+				admin_gw=admin_gateway)
 			
 		print("Nodes {node_ids} with roles {node_roles} were added to environment {env_id}".format(env_id=env_id,
 																								node_ids=str(node_ids),
 																								node_roles=str(roles)))
 
+	@trace.traced()
+	def discover_slaves(self, timeout=60*15, assign_roles=True, progress=None):
+		"""Wait until every slave in the node index is discovered.
+		
+		Nodes are matched to their VMs by MAC address as they appear, and
+		with assign_roles each one is added to the environment with its
+		role in the same poll, without waiting for the others. progress
+		gets the number of slaves found so far. Returns a dict mapping
+		roles to node IDs.
+		"""
+		matcher = NodeMatcher(self.node_index.load())
+		node_groups = dict()
+		
+		def check():
+			found = dict()
+			for node, entry in matcher.match(self.get_pending_fuel_nodes()):
+				found.setdefault(entry['role'], list()).append(node['id'])
+			
+			for role, node_ids in sorted(found.items()):
+				logger.info('Discovered %s nodes %s', role, node_ids)
+				if assign_roles and role:
+					self.add_fuel_nodes(node_ids=node_ids, roles=[role])
+				node_groups.setdefault(role, list()).extend(node_ids)
+			
+			return len(matcher.matched)
+		
+		waiter = Waiter('discover_fuel_nodes', 'pending nodes', timeout=timeout,
+						initial=1, maximum=10, progress=progress)
+		waiter.wait(check, until=lambda count: matcher.complete)
+		
+		return node_groups
+	
+	@trace.traced()
+	def wait_for_fuel_nodes(self, node_ids, status, timeout=60*60):
+		print('Waiting for nodes {0} {1}... '.format(node_ids, status), end='')
+		sys.stdout.flush()
+		
+		def check():
+			nodes = dict((node['id'], node) for node in self.get_all_fuel_nodes())
+			
+			failed = [id for id in node_ids if id in nodes and nodes[id]['status'] == 'error']
+			if failed:
+				print('error')
+				raise FuelServerError('Nodes {0} went into error state'.format(failed))
+			
+			return tuple(nodes[id]['status'] if id in nodes else None for id in node_ids)
+		
+		waiter = Waiter('wait_for_fuel_nodes', 'nodes {0}'.format(status),
+						timeout=timeout, initial=5, maximum=30)
+		try:
+			waiter.wait(check, until=lambda statuses: all(s == status for s in statuses))
+		except WaitTimeoutError:
+			print('timeout')
+			raise
+		
+		print('OK')
+		return True
+	
+	@trace.traced()
+	def capture_slave_templates(self, node_groups):
+		"""Provision the nodes and save the disk of the first node of each
+		role as its template.
+		
+		node_groups is a list of (node_ids, role). Templates are bound to
+		this site because the provisioned OS points at this site's master.
+		"""
+		site = self.site
+		provider = self.provider
+		env_id = self.current_env_id
+		fuel_version = self.master_fuel_version
+		release = self.current_release
+		
+		node_ids = [id for ids, role in node_groups for id in ids]
+		if len(node_ids) == 0:
+			return
+		
+		print('Provisioning nodes {0}... '.format(node_ids), end='')
+		sys.stdout.flush()
+		with self.__get_master_ssh_context():
+			execute(remote_tasks.provision_fuel_nodes,
+				env_id=env_id,
+				node_ids=node_ids)
+		print('OK')
+		
+		self.wait_for_fuel_nodes(node_ids, 'provisioned')
+		
+		nodes = dict((node['id'], node) for node in self.get_all_fuel_nodes())
+		vm_macs = dict((mac, entry['vm']) for mac, entry in self.node_index.load().items())
+		
+		for ids, role in node_groups:
+			if len(ids) == 0:
+				continue
+			
+			vm_name = vm_macs[nodes[ids[0]]['mac'].lower()]
+			volume = SLAVE_TEMPLATE.format(fuel_version, release, role, site)
+			
+			print('Creating {0} template from {1}... '.format(role, vm_name), end='')
+			sys.stdout.flush()
+			
+			provider.shutdown_vm_node(site, vm_name)
+			event = provider.wait_vm_node_event(site, vm_name, [events.EVENT_STOPPED], timeout=5*60)
+			if event is None:
+				provider.destroy_vm_node(site, vm_name)
+			
+			disk_path = provider.get_vm_disk_path(site, vm_name)
+			self.__save_template('slave-{0}-{1}-{2}-site{3}'.format(fuel_version, release, role, site),
+								volume, disk_path,
+								fuel_version=fuel_version,
+								release=release,
+								role=role)
+			
+			provider.start_vm_node(site, vm_name)
+			print('OK')
+		
+	@trace.traced()
+	def deploy_nodes(self, node_ids):
+		"""Run only the deployment stage on already provisioned nodes.
+		
+		Slaves cloned from disk templates register with Nailgun in discover
+		state, so they are marked provisioned first. Nailgun does not deploy
+		nodes that it does not consider provisioned.
+		"""
+		env_id = self.current_env_id
+		
+		print('Deploying nodes {0}... '.format(node_ids), end='')
+		sys.stdout.flush()
+		
+		client = self.get_nailgun_client()
+		client.set_node_status(node_ids, 'provisioned')
+		
+		pending = sorted(node.id for node in client.get_nodes(env_id)
+						 if node.id in node_ids and node.status != 'provisioned')
+		if pending:
+			print('failed')
+			raise FuelServerError('Nodes {0} are not provisioned'.format(pending))
+		
+		with self.__get_master_ssh_context():
+			execute(remote_tasks.deploy_fuel_nodes,
+				env_id=env_id,
+				node_ids=node_ids)
+			
+		print('done')
+		
+	def start_deploy_changes(self, progress=None, abort_on_error=True, timeout=None):
+		"""Start deploying the pending changes and return a Deployment
+		handle following the task from a background thread.
+		
+		progress(deployment, node) is called whenever a node changes
+		status or progress. A node in error stops the deployment unless
+		abort_on_error is off. The deployment gets a Nailgun client of its
+		own, so disconnect_master() does not close it under the thread.
+		"""
+		return Deployment.start(self.make_nailgun_client(), self.current_env_id,
+								timeout=timeout,
+								abort_on_error=abort_on_error,
+								progress=progress,
+								name='site{0}'.format(self.site))
+	
+	@trace.traced()
 	def deploy_changes(self):
 		env_id = self.current_env_id
 		
+		if self.__use_api():
+			return self.__deploy_changes_api()
+		
 		print('Deploying changes to environment... ', end='')
 		sys.stdout.flush()
 		
@@ -508,59 +1087,125 @@ class FuelBench(object):
 				env_id=env_id)
 			
 		print('done')
-				
-	def wait_for_product_vm(self, timeout=5*60):
-		current = start = time.time()
-		is_operational = False
+	
+	def __deploy_changes_api(self):
+		print('Deploying changes to environment...')
+		
+		def progress(deployment, node):
+			if node.status == 'error':
+				print('  node-{0}: error ({1})'.format(node.id, node.error_type))
+			elif node.status in ('provisioning', 'deploying'):
+				print('  node-{0}: {1} {2}%'.format(node.id, node.status, node.progress or 0))
+			else:
+				print('  node-{0}: {1}'.format(node.id, node.status))
+			sys.stdout.flush()
+		
+		deployment = self.start_deploy_changes(progress=progress)
+		try:
+			deployment.wait()
+		except DeploymentError:
+			print('failed')
+			raise
+		
+		print('done')
 		
-		print('Waiting for product VM operational... ', end='')
+	def __print_bootstrap_progress(self, interval=30):
+		"""Progress callback for wait_for_product_vm that prints the latest
+		line of the bootstrap log at most every interval seconds."""
+		last = {'time': time.time()}
+		
+		def progress(line):
+			line = line.strip()
+			if line and time.time() - last['time'] >= interval:
+				last['time'] = time.time()
+				print('  {0}'.format(line))
+				sys.stdout.flush()
+		
+		return progress
+	
+	@trace.traced()
+	def wait_for_product_vm(self, timeout=5*60, progress=None):
+		"""Wait until the master finishes bootstrapping.
+
+		The bootstrap log is followed over one SSH channel, reopened with
+		backoff only while the master is unreachable. progress(line) is
+		called with each line of the log as it is written, and may print
+		it on a line of its own.
+		"""
+		print('Waiting for product VM operational... ', end='' if progress is None else '\n')
 		sys.stdout.flush()
-			
-		while (current - start) < timeout:
-			
+		
+		def on_line(line):
+			logger.debug('Bootstrap: %s', line)
+			if progress is not None:
+				progress(line)
+		
+		def check():
 			try:
 				with self.__get_master_ssh_context():
-					results = execute(remote_tasks.check_vm_operational)
+					results = execute(remote_tasks.watch_bootstrap_log,
+									  timeout=waiter.remaining(),
+									  progress=on_line)
 					
-				if len(results) > 0 and all(item == True for item in results.values()):
-					is_operational = True
-					break
+				return len(results) > 0 and all(item == True for item in results.values())
 			except RemoteTaskError as e:
 				logger.warn(e)
+				return False
+		
+		waiter = Waiter('wait_for_product_vm', 'product VM',
+						timeout=timeout, initial=2, maximum=10)
+		try:
+			waiter.wait(check)
+		except WaitTimeoutError:
+			print('timeout')
+			raise
+		
+		print('OK')
+		return True
+		
+	@trace.traced()
+	def wait_for_master_reip(self, admin_prefix, timeout=20*60):
+		"""Wait until a master cloned from a template reports that it has
+		moved to admin_prefix, its Nailgun admin network included."""
+		print('Waiting for Fuel Master re-addressing... ', end='')
+		sys.stdout.flush()
+		
+		def check():
+			try:
+				with self.__get_master_ssh_context():
+					results = execute(remote_tasks.get_master_reip_prefix)
 				
-			current = time.time()
-			time.sleep(5)
-			
-		if is_operational:
-			print('OK')
-			return True
-		else:
+				return len(results) > 0 and all(item == admin_prefix for item in results.values())
+			except RemoteTaskError as e:
+				logger.warn(e)
+				return False
+		
+		waiter = Waiter('wait_for_master_reip', 'master re-addressing',
+						timeout=timeout, initial=5, maximum=30)
+		try:
+			waiter.wait(check)
+		except WaitTimeoutError:
 			print('timeout')
-			raise FuelServerError('Wait for product VM timeout')
+			raise
 		
-	def wait_for_fuel_server(self, timeout=15*60):
-		current = start = time.time()
-		is_ready = False
+		print('OK')
+		return True
 		
+	@trace.traced()
+	def wait_for_fuel_server(self, timeout=15*60):
 		print('Waiting for Fuel server ready... ', end='')
 		sys.stdout.flush()
-			
-		while (current - start) < timeout:
-			
-			is_ready = self.is_fuel_server_ready()
-			
-			if is_ready:
-				break
-				
-			current = time.time()
-			time.sleep(20)
-			
-		if is_ready:
-			print('OK')
-			return True
-		else:
+		
+		waiter = Waiter('wait_for_fuel_server', 'fuel server',
+						timeout=timeout, initial=5, maximum=30)
+		try:
+			waiter.wait(self.is_fuel_server_ready)
+		except WaitTimeoutError:
 			print('timeout')
-			raise FuelServerError('Wait for fuel server timeout')
+			raise
+		
+		print('OK')
+		return True
 		
 	def is_fuel_server_ready(self):
 		is_ready = False
@@ -577,6 +1222,7 @@ class FuelBench(object):
 			
 		return is_ready
 		
+	@trace.traced()
 	def shutdown_master(self, timeout=5*60):
 		config = self.config
 		provider = self.provider
@@ -587,34 +1233,28 @@ class FuelBench(object):
 		if not provider.check_vm_node_active(site, master_name):
 			return
 		
-		print('Shutting down fuel master.', end='')
+		print('Shutting down fuel master... ', end='')
 		sys.stdout.flush()
 		
 		with self.__get_master_ssh_context():
 			execute(remote_tasks.power_off)
+		self.disconnect_master()
 			
-		current = start = time.time()
-		is_active = True
-		
-		while (current - start) < timeout:
-			print('.', end='')
-			sys.stdout.flush()
+		event = provider.wait_vm_node_event(site, master_name,
+											[events.EVENT_STOPPED, events.EVENT_CRASHED],
+											timeout=timeout)
 			
-			is_active = provider.check_vm_node_active(site, master_name)
-			
-			if is_active == False:
-				break
-				
-			current = time.time()
-			time.sleep(5)
-			
-		if is_active == False:
-			print(' OK')
+		if event == events.EVENT_STOPPED:
+			print('OK')
 			return True
+		elif event == events.EVENT_CRASHED:
+			print('crashed')
+			raise FuelServerError('Fuel master crashed during shutdown')
 		else:
-			print(' timeout')
+			print('timeout')
 			raise FuelServerError('Shutdown fuel master timeout')
 	
+	@trace.traced()
 	def start_master(self):
 		config = self.config
 		provider = self.provider
@@ -631,6 +1271,7 @@ class FuelBench(object):
 		
 		print('OK')		
 	
+	@trace.traced()
 	def restore_master(self):
 		config = self.config
 		provider = self.provider
@@ -647,7 +1288,12 @@ class FuelBench(object):
 def DefaultFuelBench(site, base_iso=None):
 	
 	config = config_manager.load()	
-	provider = KvmProvider()
+	uris = utils.make_list(config.get('libvirt_uris', LIBVIRT_URIS))
+	
+	if len(uris) > 1:
+		provider = MultiHostProvider(uris, config)
+	else:
+		provider = KvmProvider(uris[0], config)
 	
 	if base_iso is None:
 		return FuelBench(site, provider, config)
@@ -0,0 +1,177 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+"""Host capacity accounting.
+
+A site plan is checked against what the host offers times the overcommit
+ratios, minus what the other sites already hold. Sites that are being
+created by other fuelbench processes do not have all their domains yet,
+so each admitted plan is also recorded as a reservation that counts until
+its process exits. A reservation names the libvirt URI of its host and
+only counts against that host.
+"""
+
+import os
+import json
+import errno
+import logging
+from contextlib import contextmanager
+
+from fuelbench import utils
+from fuelbench.settings import *
+from fuelbench.error import *
+
+logger = logging.getLogger(__name__)
+
+RESOURCES = ('vcpus', 'ram', 'disk')
+
+
+def _pid_alive(pid):
+	try:
+		os.kill(pid, 0)
+	except OSError as e:
+		return e.errno == errno.EPERM
+	return True
+
+def _load_reservations(path):
+	try:
+		with open(path, 'r') as fp:
+			reservations = json.load(fp)
+	except (IOError, ValueError):
+		return dict()
+
+	return dict((int(site), item) for site, item in reservations.items()
+				if _pid_alive(item['pid']))
+
+def _save_reservations(path, reservations):
+	tmp_file = path + '.tmp'
+	with open(tmp_file, 'w') as fp:
+		json.dump(reservations, fp)
+	os.rename(tmp_file, path)
+
+@contextmanager
+def reservations(path=CAPACITY_RESERVATION_FILE):
+	"""Hold the reservation lock and yield the reservations of live
+	processes, {site: usage with pid and uri}. They are saved on exit
+	unless an exception is raised."""
+	directory = os.path.dirname(path)
+	if directory and not os.path.exists(directory):
+		os.makedirs(directory)
+
+	with utils.locked(path + '.lock'):
+		items = _load_reservations(path)
+		yield items
+		_save_reservations(path, items)
+
+def total(vms):
+	usage = {'vcpus': 0, 'ram': 0, 'disk': 0, 'nodes': 0}
+
+	for vm in vms:
+		for key in RESOURCES:
+			usage[key] += vm[key]
+		if vm.get('slave'):
+			usage['nodes'] += 1
+
+	return usage
+
+def _limits(host, config):
+	return {'vcpus': host['vcpus'] * config['cpu_overcommit'],
+			'ram': (host['ram'] - config['host_reserved_ram']) * config['ram_overcommit'],
+			'disk': host['disk'] * config['disk_overcommit']}
+
+def _used(site, uri, allocations, reservations):
+	"""Resources held on host uri by the sites other than site, and those
+	sites. A site counts with its domains or, while it is still being
+	created, with its reservation if that is larger. Reservations made
+	on other hosts are not counted."""
+	none = total([])
+	used = total([])
+	sites = set()
+
+	reserved_here = dict((other, item) for other, item in reservations.items()
+						 if item.get('uri', uri) == uri)
+
+	for other in set(allocations.keys()) | set(reserved_here.keys()):
+		if other == site:
+			continue
+
+		sites.add(other)
+		actual = allocations.get(other, none)
+		reserved = reserved_here.get(other, actual)
+		for key in RESOURCES:
+			used[key] += max(actual[key], reserved[key])
+
+	return used, sites
+
+def free(provider, site, config, reservations):
+	"""Resources the host of provider has left for site after overcommit."""
+	limits = _limits(provider.get_host_capacity(), config)
+	used, sites = _used(site, provider.uri, provider.get_site_allocations(), reservations)
+
+	return dict((key, limits[key] - used[key]) for key in RESOURCES)
+
+def check(provider, site, planned, config, replace_site=False,
+		  reservation_file=CAPACITY_RESERVATION_FILE):
+	"""Raise CapacityError if the planned VMs do not fit on the host.
+
+	planned is a list of dicts with vcpus, ram (MB), disk (GB) and slave.
+	With replace_site the site's current domains are not counted, as they
+	are removed before the new ones are created.
+	"""
+	with reservations(reservation_file) as items:
+		# only the host the site lives on matters; a provider spreading
+		# sites over several hosts places it now, seeing the reservations
+		provider = provider.get_site_provider(site, reservations=items)
+
+		host = provider.get_host_capacity()
+		allocations = provider.get_site_allocations()
+
+		plan = total(planned)
+		if not replace_site:
+			current = allocations.get(site, total([]))
+			for key in RESOURCES + ('nodes',):
+				plan[key] += current[key]
+
+		used, sites = _used(site, provider.uri, allocations, items)
+		sites.add(site)
+
+		limits = _limits(host, config)
+		units = {'vcpus': '', 'ram': ' MB', 'disk': ' GB'}
+
+		shortfalls = list()
+		for key in RESOURCES:
+			if used[key] + plan[key] > limits[key]:
+				shortfalls.append('{0}: need {1:.0f}{3}, {2:.0f}{3} left'.format(key, plan[key],
+																			   max(0, limits[key] - used[key]),
+																			   units[key]))
+
+		if len(sites) > config['site_limit']:
+			shortfalls.append('sites: {0} on the host, limit is {1}'.format(len(sites), config['site_limit']))
+
+		if plan['nodes'] > config['node_limit']:
+			shortfalls.append('nodes: {0} on site {1}, limit is {2}'.format(plan['nodes'], site, config['node_limit']))
+
+		if shortfalls:
+			raise CapacityError(site, shortfalls)
+
+		logger.info('Site %s admitted on %s: plan %s, other sites %s, limits %s',
+					site, provider.uri, plan, used, limits)
+
+		plan['pid'] = os.getpid()
+		plan['uri'] = provider.uri
+		items[site] = plan
+
+	return plan
@@ -28,9 +28,29 @@ def defaults():
 	config['max_site_id'] = settings.MAX_SITE_ID
 	config['site_limit'] = settings.SITE_LIMIT
 	config['node_limit'] = settings.NODE_LIMIT
+	config['cpu_overcommit'] = settings.CPU_OVERCOMMIT
+	config['ram_overcommit'] = settings.RAM_OVERCOMMIT
+	config['disk_overcommit'] = settings.DISK_OVERCOMMIT
+	config['host_reserved_ram'] = settings.HOST_RESERVED_RAM
 	config['admin_network_ip'] = settings.ADMIN_NETWORK_IP
 	config['public_network_ip'] = settings.PUBLIC_NETWORK_IP
 	config['vm_install_wait'] = settings.VM_INSTALL_WAIT
+	config['iso_cache_size'] = settings.ISO_CACHE_SIZE
+	config['teardown_workers'] = settings.TEARDOWN_WORKERS
+	config['libvirt_uris'] = settings.LIBVIRT_URIS
+	config['slave_create_workers'] = settings.SLAVE_CREATE_WORKERS
+	config['pxe_boot_concurrency'] = settings.PXE_BOOT_CONCURRENCY
+	config['pxe_boot_interval'] = settings.PXE_BOOT_INTERVAL
+	config['pxe_boot_window'] = settings.PXE_BOOT_WINDOW
+	config['ssh_keepalive'] = settings.SSH_KEEPALIVE
+	config['ssh_timeout'] = settings.SSH_TIMEOUT
+	config['master_ssh_address'] = settings.MASTER_SSH_ADDRESS
+	config['fuel_transport'] = settings.FUEL_TRANSPORT
+	config['nailgun_port'] = settings.NAILGUN_PORT
+	config['keystone_port'] = settings.KEYSTONE_PORT
+	config['nailgun_timeout'] = settings.NAILGUN_TIMEOUT
+	config['metrics_dir'] = settings.METRICS_DIR
+	config['metrics_port'] = settings.METRICS_PORT
 	config['storage_pool'] = settings.STORAGE_POOL
 	config['search_domain'] = settings.SEARCH_DOMAIN
 	config['master_name'] = settings.MASTER_NAME
@@ -40,6 +60,8 @@ def defaults():
 	config['master_hostname'] = settings.MASTER_HOSTNAME
 	config['master_user'] = settings.MASTER_USER
 	config['master_pass'] = settings.MASTER_PASS 
+	config['fuel_user'] = settings.FUEL_USER
+	config['fuel_pass'] = settings.FUEL_PASS
 	config['master_prompt'] = settings.MASTER_PROMPT
 	config['default_controller'] = settings.DEFAULT_CONTROLLER
 	config['default_compute'] = settings.DEFAULT_COMPUTE
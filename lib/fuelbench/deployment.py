@@ -0,0 +1,170 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+"""Tracking of running deployments through the Nailgun task API.
+
+A Deployment is started with Deployment.start() and followed from a
+daemon thread, so the caller is free to start more deployments, e.g. on
+other sites, and wait for them together with wait_all(). Every change of
+a node's status or progress is passed to the progress callback. When a
+node goes to error the deployment is stopped at once, or only flagged if
+abort_on_error is off, instead of running on until the task ends.
+"""
+
+import time
+import threading
+import logging
+
+from fuelbench import trace
+from fuelbench.waiter import Waiter
+from fuelbench.error import *
+
+logger = logging.getLogger(__name__)
+
+
+class Deployment(object):
+
+	def __init__(self, client, env_id, task, timeout=None, abort_on_error=True,
+				 progress=None, name=None):
+		self.client = client
+		self.env_id = env_id
+		self.task = task
+		self.abort_on_error = abort_on_error
+		self.progress = progress
+		self.name = name or 'env{0}'.format(env_id)
+
+		self.nodes = dict()
+		self.failed_nodes = list()
+		self.error = None
+
+		self._done = threading.Event()
+		self._thread = None
+		self._waiter = Waiter('deployment', 'deployment of {0}'.format(self.name),
+							  timeout=timeout, initial=2, maximum=15)
+
+	@classmethod
+	def start(cls, client, env_id, **kwargs):
+		"""Deploy the pending changes of env_id and follow the task. The
+		deployment closes client once it has finished."""
+		task = client.deploy_changes(env_id)
+		logger.info('Started deployment of environment %s, task %s', env_id, task.id)
+
+		deployment = cls(client, env_id, task, **kwargs)
+		deployment.follow()
+		return deployment
+
+	def follow(self):
+		self._thread = threading.Thread(target=self.__run, name='deploy-{0}'.format(self.name))
+		self._thread.daemon = True
+		self._thread.start()
+
+	@property
+	def finished(self):
+		return self._done.is_set()
+
+	@property
+	def ok(self):
+		return self.finished and self.error is None
+
+	def poll(self):
+		"""Fetch the task and node states once. Returns True when the
+		deployment has finished, successfully or not."""
+		try:
+			self.task = self.client.get_task(self.task.id)
+			nodes = self.client.get_nodes(self.env_id)
+		except NailgunError as e:
+			logger.warn(e)
+			return False
+
+		for node in nodes:
+			previous = self.nodes.get(node.id)
+			self.nodes[node.id] = node
+
+			if previous is None or (previous.status, previous.progress) != (node.status, node.progress):
+				trace.instant('node', cat='deployment', env=self.env_id, node=node.id,
+							  status=node.status, progress=node.progress)
+				if self.progress is not None:
+					self.progress(self, node)
+
+		failed = sorted(id for id, node in self.nodes.items() if node.status == 'error')
+		new_failures = sorted(set(failed) - set(self.failed_nodes))
+		if new_failures:
+			self.failed_nodes = failed
+			logger.error('Environment %s: nodes %s went into error state', self.env_id, new_failures)
+
+			if self.abort_on_error:
+				self.abort()
+				raise DeploymentError(self.env_id, 'nodes {0} went into error state'.format(failed), failed)
+
+		if self.task.status == 'ready':
+			return True
+		elif self.task.status == 'error':
+			raise DeploymentError(self.env_id, self.task.message or 'task failed', self.failed_nodes)
+
+		return False
+
+	def __run(self):
+		try:
+			with trace.span('deployment', env=self.env_id):
+				self._waiter.wait(self.poll)
+		except Exception as e:
+			self.error = e
+		finally:
+			self.client.close()
+			self._done.set()
+
+	def abort(self):
+		"""Stop the deployment on the master and stop following it."""
+		try:
+			self.client.stop_deployment(self.env_id)
+		except NailgunError as e:
+			logger.warn('Failed to stop deployment of environment %s: %s', self.env_id, e)
+
+		self._waiter.cancel()
+
+	def wait(self, timeout=None):
+		"""Block until the deployment finishes and raise its error, if any.
+		Returns False if timeout passes first."""
+		if timeout is None:
+			# waiting in slices keeps the main thread interruptible
+			while not self._done.wait(1):
+				pass
+		elif not self._done.wait(timeout):
+			return False
+
+		if self.error is not None:
+			raise self.error
+
+		return True
+
+
+def wait_all(deployments, timeout=None):
+	"""Wait for several deployments and return those that did not finish
+	successfully, including any still running when timeout passes."""
+	deadline = None if timeout is None else time.time() + timeout
+
+	for deployment in deployments:
+		# waiting in slices keeps the main thread interruptible
+		while not deployment.finished:
+			if deadline is None:
+				deployment._done.wait(1)
+			else:
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				deployment._done.wait(min(1, remaining))
+
+	return [deployment for deployment in deployments if not deployment.ok]
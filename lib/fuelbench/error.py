@@ -21,6 +21,57 @@ class CommandLineError(FuelBenchError):
     def __str__(self):
         return "Command '%s' returned non-zero exit status %d" % (self.cmd, self.returncode)
 
+
+class ProviderError(FuelBenchError):
+    def __init__(self, operation, target, cause=None):
+        self.operation = operation
+        self.target = target
+        self.cause = cause
+    def __str__(self):
+        if self.cause is None:
+            return "Failed to %s '%s'" % (self.operation, self.target)
+        return "Failed to %s '%s': %s" % (self.operation, self.target, self.cause)
+
+
+class NailgunError(FuelServerError):
+    def __init__(self, method, path, status=None, reason=None):
+        self.method = method
+        self.path = path
+        self.status = status
+        self.reason = reason
+    def __str__(self):
+        if self.status is None:
+            return "%s %s failed: %s" % (self.method, self.path, self.reason)
+        return "%s %s returned %d: %s" % (self.method, self.path, self.status, self.reason)
+
+class CapacityError(FuelBenchError):
+    def __init__(self, site, shortfalls):
+        self.site = site
+        self.shortfalls = shortfalls
+    def __str__(self):
+        return "Site %s does not fit on the host: %s" % (self.site, '; '.join(self.shortfalls))
+
+class DeploymentError(FuelServerError):
+    def __init__(self, env_id, message, failed_nodes=None):
+        self.env_id = env_id
+        self.message = message
+        self.failed_nodes = failed_nodes or []
+    def __str__(self):
+        return "Deployment of environment %s failed: %s" % (self.env_id, self.message)
+
+class WaitTimeoutError(FuelServerError):
+    def __init__(self, what, timeout):
+        self.what = what
+        self.timeout = timeout
+    def __str__(self):
+        return "Wait for %s timeout" % self.what
+
+class WaitCancelledError(FuelBenchError):
+    def __init__(self, what):
+        self.what = what
+    def __str__(self):
+        return "Wait for %s cancelled" % self.what
+
         
 __all__ = [
     'FuelBenchError',
@@ -28,4 +79,10 @@ __all__ = [
     'InvalidStateError',
     'FuelServerError',
     'CommandLineError',
+    'ProviderError',
+    'NailgunError',
+    'CapacityError',
+    'DeploymentError',
+    'WaitTimeoutError',
+    'WaitCancelledError',
 ]
\ No newline at end of file
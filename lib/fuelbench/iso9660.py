@@ -0,0 +1,172 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+"""Minimal read-only ISO9660/Joliet reader.
+
+Only what is needed to pull small files such as version.yaml out of an
+image without extracting it: volume descriptors, directory records and
+single-extent files.
+"""
+
+import os
+import mmap
+import struct
+
+SECTOR_SIZE = 2048
+FIRST_DESCRIPTOR = 16
+
+VD_PRIMARY = 1
+VD_SUPPLEMENTARY = 2
+VD_TERMINATOR = 255
+
+JOLIET_ESCAPES = ('%/@', '%/C', '%/E')
+
+FLAG_DIRECTORY = 0x02
+
+
+class IsoFormatError(Exception):
+	pass
+
+
+class IsoImage(object):
+
+	def __init__(self, path):
+		self.path = path
+		self._fp = open(path, 'rb')
+		try:
+			# an empty file cannot be mapped
+			self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+		except ValueError:
+			self._fp.close()
+			raise IsoFormatError('Empty image: {0}'.format(self.path))
+		except Exception:
+			self._fp.close()
+			raise
+
+		try:
+			self.block_size, self.root, self.joliet = self.__read_descriptors()
+		except Exception:
+			self.close()
+			raise
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def close(self):
+		self._map.close()
+		self._fp.close()
+
+	def __read_descriptors(self):
+		primary = None
+		joliet = None
+		sector = FIRST_DESCRIPTOR
+
+		while True:
+			offset = sector * SECTOR_SIZE
+			if offset + SECTOR_SIZE > len(self._map):
+				break
+
+			desc = self._map[offset:offset + SECTOR_SIZE]
+			vd_type = ord(desc[0])
+
+			if desc[1:6] != 'CD001':
+				raise IsoFormatError('Not an ISO9660 image: {0}'.format(self.path))
+
+			if vd_type == VD_TERMINATOR:
+				break
+			elif vd_type == VD_PRIMARY and primary is None:
+				primary = desc
+			elif vd_type == VD_SUPPLEMENTARY and desc[88:91] in JOLIET_ESCAPES:
+				joliet = desc
+
+			sector += 1
+
+		desc = joliet or primary
+		if desc is None:
+			raise IsoFormatError('No primary volume descriptor: {0}'.format(self.path))
+
+		block_size = struct.unpack('<H', desc[128:130])[0]
+		root = self.__parse_record(desc[156:190], joliet is not None)
+
+		return block_size, root, joliet is not None
+
+	def __parse_record(self, data, joliet):
+		name_len = ord(data[32])
+		name = data[33:33 + name_len]
+
+		if joliet and name not in ('\x00', '\x01'):
+			name = name.decode('utf-16-be')
+		else:
+			name = name.split(';')[0].rstrip('.')
+
+		return {'extent': struct.unpack('<I', data[2:6])[0],
+				'size': struct.unpack('<I', data[10:14])[0],
+				'flags': ord(data[25]),
+				'name': name}
+
+	def __list_dir(self, record):
+		start = record['extent'] * self.block_size
+		end = start + record['size']
+		offset = start
+
+		while offset < end:
+			rec_len = ord(self._map[offset])
+
+			if rec_len == 0:
+				# records never span sectors; skip the padding
+				offset = (offset // self.block_size + 1) * self.block_size
+				continue
+
+			entry = self.__parse_record(self._map[offset:offset + rec_len], self.joliet)
+			offset += rec_len
+
+			if entry['name'] in ('\x00', '\x01'):
+				continue
+
+			yield entry
+
+	def __lookup(self, path):
+		record = self.root
+
+		for part in [p for p in path.split('/') if p]:
+			if not record['flags'] & FLAG_DIRECTORY:
+				raise IOError('Not a directory: {0}'.format(path))
+
+			for entry in self.__list_dir(record):
+				if entry['name'].lower() == part.lower():
+					record = entry
+					break
+			else:
+				raise IOError('No such file in {0}: {1}'.format(self.path, path))
+
+		return record
+
+	def read_file(self, path):
+		record = self.__lookup(path)
+
+		if record['flags'] & FLAG_DIRECTORY:
+			raise IOError('Is a directory: {0}'.format(path))
+
+		start = record['extent'] * self.block_size
+		return self._map[start:start + record['size']]
+
+
+def read_file(iso_file, path):
+	with IsoImage(iso_file) as image:
+		return image.read_file(path)
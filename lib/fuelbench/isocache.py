@@ -0,0 +1,147 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+import os
+import json
+import hashlib
+import logging
+
+from fuelbench import utils
+from fuelbench.settings import *
+
+logger = logging.getLogger(__name__)
+
+DIGEST_INDEX = 'digests.json'
+
+
+def _file_id(path):
+	st = os.stat(path)
+	return '{0}:{1}:{2}:{3}'.format(os.path.realpath(path), st.st_size, int(st.st_mtime), st.st_ino)
+
+def file_digest(path, cache_dir=ISO_CACHE_DIR):
+	"""SHA-1 of a file, remembered by path, size, mtime and inode so a
+	multi-GB ISO is hashed only once."""
+	index_file = os.path.join(cache_dir, DIGEST_INDEX)
+	file_id = _file_id(path)
+
+	with utils.locked(index_file + '.lock'):
+		try:
+			with open(index_file, 'r') as fp:
+				index = json.load(fp)
+		except (IOError, ValueError):
+			index = dict()
+
+		if file_id in index:
+			return index[file_id]
+
+	sha1 = hashlib.sha1()
+	with open(path, 'rb') as fp:
+		for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+			sha1.update(chunk)
+	digest = sha1.hexdigest()
+
+	with utils.locked(index_file + '.lock'):
+		try:
+			with open(index_file, 'r') as fp:
+				index = json.load(fp)
+		except (IOError, ValueError):
+			index = dict()
+
+		index[file_id] = digest
+
+		tmp_file = index_file + '.tmp'
+		with open(tmp_file, 'w') as fp:
+			json.dump(index, fp)
+		os.rename(tmp_file, index_file)
+
+	return digest
+
+def cache_key(source, cache_dir=ISO_CACHE_DIR, **params):
+	sha1 = hashlib.sha1(file_digest(source, cache_dir))
+
+	for name in sorted(params.keys()):
+		sha1.update('\0{0}={1}'.format(name, params[name]))
+
+	return sha1.hexdigest()
+
+def evict(cache_dir=ISO_CACHE_DIR, max_size=ISO_CACHE_SIZE, keep=()):
+	"""Remove least recently used images until the cache fits max_size GB.
+	Images in keep, e.g. those attached to a domain, are never removed."""
+	keep = set(os.path.realpath(path) for path in keep)
+	entries = list()
+	total = 0
+
+	for name in os.listdir(cache_dir):
+		if not name.endswith('.iso'):
+			continue
+
+		path = os.path.join(cache_dir, name)
+		st = os.stat(path)
+		entries.append((st.st_mtime, st.st_size, path))
+		total += st.st_size
+
+	limit = max_size * 1024 ** 3
+
+	for mtime, size, path in sorted(entries):
+		if total <= limit:
+			break
+
+		if os.path.realpath(path) in keep:
+			continue
+
+		logger.info('Evict cached ISO %s', path)
+		try:
+			os.remove(path)
+			total -= size
+		except OSError as e:
+			logger.warn('Unable to evict %s: %s', path, e)
+
+def get_custom_iso_image(source, ipaddr, gateway, dns, netmask, hostname,
+						 cache_dir=ISO_CACHE_DIR, max_size=ISO_CACHE_SIZE, keep=()):
+	"""Return the path of a custom ISO for the given boot parameters,
+	remastering it only if it is not in the cache yet.
+
+	The returned image is owned by the cache and must not be deleted.
+	Images in keep are spared when the cache is trimmed.
+	"""
+	if not os.path.exists(cache_dir):
+		os.makedirs(cache_dir)
+
+	key = cache_key(source, cache_dir,
+					ipaddr=ipaddr, gateway=gateway, dns=dns,
+					netmask=netmask, hostname=hostname)
+	iso_file = os.path.join(cache_dir, key + '.iso')
+
+	with utils.locked(os.path.join(cache_dir, key + '.lock')):
+		if os.path.exists(iso_file):
+			logger.info('Custom ISO cache hit: %s', iso_file)
+			os.utime(iso_file, None)
+		else:
+			logger.info('Custom ISO cache miss: %s', iso_file)
+			tmp_file = os.path.join(cache_dir, key + '.tmp')
+			work_dir = os.path.join(cache_dir, key + '.work')
+
+			try:
+				utils.build_custom_iso_image(source, tmp_file, work_dir,
+											 ipaddr, gateway, dns, netmask, hostname)
+				os.rename(tmp_file, iso_file)
+			finally:
+				if os.path.exists(tmp_file):
+					os.remove(tmp_file)
+
+	evict(cache_dir, max_size, keep=list(keep) + [iso_file])
+
+	return iso_file
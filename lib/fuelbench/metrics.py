@@ -0,0 +1,284 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+"""Run metrics in the Prometheus text exposition format.
+
+Durations come from the trace spans, so anything traced is measured.
+The metrics of a run are written to a textfile for the node_exporter
+textfile collector and can also be served over HTTP while it runs.
+Every sample carries the common labels set with set_labels(), such as
+site, fuel_version and command. The textfiles of several processes,
+e.g. the workers of a batch run, can be served merged over HTTP.
+"""
+
+import os
+import time
+import threading
+import logging
+import BaseHTTPServer
+
+from fuelbench import trace
+
+logger = logging.getLogger(__name__)
+
+# seconds between textfile writes while a run serves its metrics live
+TEXTFILE_INTERVAL = 15
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+# span category -> (metric name, help)
+SPAN_METRICS = {
+	'phase': ('fuelbench_phase_duration_seconds', 'Duration of provisioning phases'),
+	'ssh': ('fuelbench_remote_task_duration_seconds', 'Round-trip time of remote tasks on the Fuel master'),
+	'libvirt': ('fuelbench_libvirt_call_duration_seconds', 'Duration of libvirt provider calls'),
+	'subprocess': ('fuelbench_subprocess_duration_seconds', 'Duration of external commands'),
+}
+
+_lock = threading.RLock()
+_labels = dict()
+_metrics = dict()
+
+
+def set_labels(**labels):
+	"""Set labels added to every sample, e.g. site or command."""
+	with _lock:
+		for key, value in labels.items():
+			if value is None:
+				_labels.pop(key, None)
+			else:
+				_labels[key] = str(value)
+
+def _escape(value):
+	return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels):
+	if not labels:
+		return ''
+	return '{' + ','.join('{0}="{1}"'.format(k, _escape(v)) for k, v in sorted(labels)) + '}'
+
+def _format_value(value):
+	if value == float('inf'):
+		return '+Inf'
+	return repr(float(value))
+
+
+class Counter(object):
+
+	type = 'counter'
+
+	def __init__(self, name, help):
+		self.name = name
+		self.help = help
+		self.values = dict()
+
+	def inc(self, amount=1, **labels):
+		key = tuple(sorted(labels.items()))
+		with _lock:
+			self.values[key] = self.values.get(key, 0) + amount
+
+	def samples(self, common):
+		for key, value in sorted(self.values.items()):
+			yield self.name, common + key, value
+
+
+class Histogram(object):
+
+	type = 'histogram'
+
+	def __init__(self, name, help, buckets=DURATION_BUCKETS):
+		self.name = name
+		self.help = help
+		self.buckets = tuple(buckets) + (float('inf'),)
+		self.values = dict()
+
+	def observe(self, value, **labels):
+		key = tuple(sorted(labels.items()))
+		with _lock:
+			counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+			for i, bound in enumerate(self.buckets):
+				if value <= bound:
+					counts[i] += 1
+			self.values[key] = (counts, total + value)
+
+	def samples(self, common):
+		for key, (counts, total) in sorted(self.values.items()):
+			labels = common + key
+			for bound, count in zip(self.buckets, counts):
+				yield self.name + '_bucket', labels + (('le', _format_value(bound)),), count
+			yield self.name + '_count', labels, counts[-1]
+			yield self.name + '_sum', labels, total
+
+
+def _get(cls, name, help, **kwargs):
+	with _lock:
+		metric = _metrics.get(name)
+		if metric is None:
+			metric = cls(name, help, **kwargs)
+			_metrics[name] = metric
+		return metric
+
+def counter(name, help):
+	return _get(Counter, name, help)
+
+def histogram(name, help, buckets=DURATION_BUCKETS):
+	return _get(Histogram, name, help, buckets=buckets)
+
+def count_poll(waiter):
+	"""Count one iteration of a polling loop."""
+	counter('fuelbench_poll_iterations_total',
+			'Iterations of polling loops').inc(waiter=waiter)
+
+def count_exit(program, returncode):
+	# not 'command', which is a common label
+	counter('fuelbench_subprocess_exit_total',
+			'Exit codes of external commands').inc(program=program, code=str(returncode))
+
+def _on_span(name, cat, duration, args):
+	if cat not in SPAN_METRICS:
+		return
+
+	metric_name, help = SPAN_METRICS[cat]
+	status = 'error' if 'error' in args else 'ok'
+	histogram(metric_name, help).observe(duration, name=name, status=status)
+
+trace.add_listener(_on_span)
+
+def render():
+	"""Return all metrics in the text exposition format. Samples that
+	repeat a common label are left out, since a single duplicate label
+	makes collectors reject the whole exposition."""
+	lines = list()
+
+	with _lock:
+		common = tuple(sorted(_labels.items()))
+		for name in sorted(_metrics.keys()):
+			metric = _metrics[name]
+			lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+			lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+			for sample, labels, value in metric.samples(common):
+				if len(set(key for key, _ in labels)) != len(labels):
+					logger.error('Sample %s repeats a common label: %s', sample, labels)
+					continue
+				lines.append('{0}{1} {2}'.format(sample, _format_labels(labels), _format_value(value)))
+
+	return '\n'.join(lines) + '\n'
+
+def write_textfile(path):
+	"""Write all metrics to path atomically, as the textfile collector
+	may read it at any time."""
+	directory = os.path.dirname(path)
+	if directory and not os.path.exists(directory):
+		os.makedirs(directory)
+
+	tmp_file = '{0}.{1}.tmp'.format(path, os.getpid())
+	with _lock:
+		with open(tmp_file, 'w') as fp:
+			fp.write(render())
+		os.rename(tmp_file, path)
+
+	return path
+
+
+def start_textfile_writer(path, interval=TEXTFILE_INTERVAL):
+	"""Rewrite the textfile every interval seconds from a daemon thread,
+	so that another process can serve the metrics while this one runs."""
+	def run():
+		while True:
+			try:
+				write_textfile(path)
+			except (IOError, OSError) as e:
+				logger.warn('Cannot write metrics to %s: %s', path, e)
+			time.sleep(interval)
+
+	thread = threading.Thread(target=run, name='metrics-textfile')
+	thread.daemon = True
+	thread.start()
+	return thread
+
+def merge(texts):
+	"""Merge expositions written by render() in several processes. Their
+	samples differ by the common labels, e.g. site, so only the HELP and
+	TYPE lines of each metric have to be deduplicated."""
+	families = dict()
+
+	for text in texts:
+		name = None
+		for line in text.splitlines():
+			if line.startswith('# HELP ') or line.startswith('# TYPE '):
+				name = line.split(' ', 3)[2]
+				family = families.setdefault(name, {'HELP': None, 'TYPE': None, 'samples': []})
+				family[line[2:6]] = line
+			elif line and name is not None:
+				families[name]['samples'].append(line)
+
+	lines = list()
+	for name in sorted(families.keys()):
+		family = families[name]
+		lines.extend([family['HELP'], family['TYPE']])
+		lines.extend(family['samples'])
+
+	return '\n'.join(lines) + '\n'
+
+def render_textfiles(paths):
+	"""Merge the textfiles in paths that exist."""
+	texts = list()
+	for path in paths:
+		try:
+			with open(path, 'r') as fp:
+				texts.append(fp.read())
+		except IOError:
+			continue
+
+	return merge(texts)
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		if self.path != '/metrics':
+			self.send_error(404)
+			return
+
+		sources = self.server.sources
+		if sources is None:
+			data = render()
+		else:
+			data = render_textfiles(sources())
+
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, format, *args):
+		logger.debug(format, *args)
+
+def start_http_server(port, addr='127.0.0.1', sources=None):
+	"""Serve /metrics from a daemon thread for the life of the process.
+
+	By default the metrics of this process are served. sources, if given,
+	returns the textfiles of other processes to serve merged instead.
+	"""
+	server = BaseHTTPServer.HTTPServer((addr, port), MetricsHandler)
+	server.sources = sources
+
+	thread = threading.Thread(target=server.serve_forever, name='metrics-http')
+	thread.daemon = True
+	thread.start()
+
+	logger.info('Serving metrics on http://%s:%d/metrics', addr, port)
+	return server
@@ -0,0 +1,279 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+"""Client for the Nailgun REST API of the Fuel master.
+
+Talks HTTP directly to the master instead of running the fuel CLI over SSH,
+so polling costs one request on a kept-alive connection.
+"""
+
+import json
+import socket
+import httplib
+import logging
+import threading
+import collections
+
+from fuelbench.error import *
+
+logger = logging.getLogger(__name__)
+
+Node = collections.namedtuple('Node', ['id', 'status', 'name', 'cluster', 'ip', 'mac',
+                                       'roles', 'pending_roles', 'online', 'group_id',
+                                       'progress', 'error_type'])
+
+Cluster = collections.namedtuple('Cluster', ['id', 'status', 'name', 'mode', 'release_id',
+                                             'changes', 'pending_release_id'])
+
+Task = collections.namedtuple('Task', ['id', 'uuid', 'name', 'status', 'progress',
+                                       'message', 'cluster'])
+
+
+def make_node(data):
+    return Node(id=data['id'],
+                status=data.get('status'),
+                name=data.get('name'),
+                cluster=data.get('cluster'),
+                ip=data.get('ip'),
+                mac=data.get('mac'),
+                roles=list(data.get('roles') or []),
+                pending_roles=list(data.get('pending_roles') or []),
+                online=data.get('online'),
+                group_id=data.get('group_id'),
+                progress=data.get('progress'),
+                error_type=data.get('error_type'))
+
+
+def make_cluster(data):
+    return Cluster(id=data['id'],
+                   status=data.get('status'),
+                   name=data.get('name'),
+                   mode=data.get('mode'),
+                   release_id=data.get('release_id'),
+                   changes=data.get('changes'),
+                   pending_release_id=data.get('pending_release_id'))
+
+
+def make_task(data):
+    return Task(id=data['id'],
+                uuid=data.get('uuid'),
+                name=data.get('name'),
+                status=data.get('status'),
+                progress=data.get('progress'),
+                message=data.get('message'),
+                cluster=data.get('cluster'))
+
+
+class NailgunClient(object):
+    """Thread-safe Nailgun client with a small pool of keep-alive
+    connections.
+
+    A Keystone token is requested on first use and renewed when Nailgun
+    answers 401. Masters without Keystone (Fuel < 6.1) are used without
+    a token.
+    """
+
+    def __init__(self, host, port=8000, keystone_port=5000,
+                 user='admin', password='admin', tenant='admin',
+                 timeout=30, pool_size=4):
+        self.host = host
+        self.port = port
+        self.keystone_port = keystone_port
+        self.user = user
+        self.password = password
+        self.tenant = tenant
+        self.timeout = timeout
+        self.pool_size = pool_size
+
+        self._lock = threading.Lock()
+        self._idle = list()
+        self._token = None
+        self._token_checked = False
+
+    def __acquire(self, port):
+        with self._lock:
+            for conn in self._idle:
+                if conn.port == port:
+                    self._idle.remove(conn)
+                    return conn
+
+        return httplib.HTTPConnection(self.host, port, timeout=self.timeout)
+
+    def __release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            del self._idle[:]
+
+    def __send(self, port, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        headers['Accept'] = 'application/json'
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+
+        # a kept-alive connection may have been closed by the server while
+        # idle; retry once on a fresh one
+        for attempt in range(2):
+            conn = self.__acquire(port)
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                if attempt == 0 and not isinstance(e, socket.timeout):
+                    logger.debug('Retry %s %s: %s', method, path, e)
+                    continue
+                raise NailgunError(method, path, reason=e)
+
+            if response.getheader('connection', '').lower() == 'close':
+                conn.close()
+            else:
+                self.__release(conn)
+
+            return response.status, response.reason, data
+
+    def __authenticate(self):
+        body = {'auth': {'tenantName': self.tenant,
+                         'passwordCredentials': {'username': self.user,
+                                                 'password': self.password}}}
+        try:
+            status, reason, data = self.__send(self.keystone_port, 'POST', '/v2.0/tokens', body)
+        except NailgunError as e:
+            logger.debug('Keystone unavailable on %s: %s', self.host, e)
+            return None
+
+        if status != 200:
+            raise NailgunError('POST', '/v2.0/tokens', status, reason)
+
+        return json.loads(data)['access']['token']['id']
+
+    def __get_token(self, renew=False):
+        with self._lock:
+            checked = self._token_checked and not renew
+            token = self._token
+
+        if checked:
+            return token
+
+        token = self.__authenticate()
+
+        with self._lock:
+            self._token = token
+            self._token_checked = True
+
+        return token
+
+    def request(self, method, path, body=None):
+        path = '/api' + path
+
+        token = self.__get_token()
+
+        for attempt in range(2):
+            headers = dict()
+            if token:
+                headers['X-Auth-Token'] = token
+
+            status, reason, data = self.__send(self.port, method, path, body, headers)
+
+            if status == 401 and attempt == 0:
+                token = self.__get_token(renew=True)
+                continue
+
+            break
+
+        if status >= 400:
+            raise NailgunError(method, path, status, reason)
+
+        if not data:
+            return None
+
+        return json.loads(data)
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def put(self, path, body):
+        return self.request('PUT', path, body)
+
+    def get_version(self):
+        return self.get('/version')
+
+    def get_nodes(self, cluster_id=None):
+        path = '/nodes'
+        if cluster_id is not None:
+            path += '?cluster_id={0}'.format(cluster_id)
+
+        return [make_node(item) for item in self.get(path)]
+
+    def get_node(self, node_id):
+        return make_node(self.get('/nodes/{0}'.format(node_id)))
+
+    def set_node_status(self, node_ids, status):
+        """Set the status of several nodes, e.g. to provisioned for nodes
+        whose disks were cloned instead of provisioned by Nailgun."""
+        return self.put('/nodes', [{'id': node_id, 'status': status} for node_id in node_ids])
+
+    def get_clusters(self):
+        return [make_cluster(item) for item in self.get('/clusters')]
+
+    def get_cluster(self, cluster_id):
+        return make_cluster(self.get('/clusters/{0}'.format(cluster_id)))
+
+    def get_tasks(self, cluster_id=None):
+        path = '/tasks'
+        if cluster_id is not None:
+            path += '?cluster_id={0}'.format(cluster_id)
+
+        return [make_task(item) for item in self.get(path)]
+
+    def get_task(self, task_id):
+        return make_task(self.get('/tasks/{0}'.format(task_id)))
+
+    def get_network_configuration(self, cluster_id, provider='neutron'):
+        return self.get('/clusters/{0}/network_configuration/{1}'.format(cluster_id, provider))
+
+    def put_network_configuration(self, cluster_id, data, provider='neutron'):
+        return self.put('/clusters/{0}/network_configuration/{1}'.format(cluster_id, provider), data)
+
+    def get_settings(self, cluster_id):
+        return self.get('/clusters/{0}/attributes'.format(cluster_id))
+
+    def put_settings(self, cluster_id, data):
+        return self.put('/clusters/{0}/attributes'.format(cluster_id), data)
+
+    def get_node_interfaces(self, node_id):
+        return self.get('/nodes/{0}/interfaces'.format(node_id))
+
+    def put_node_interfaces(self, node_id, data):
+        return self.put('/nodes/{0}/interfaces'.format(node_id), data)
+
+    def deploy_changes(self, cluster_id):
+        """Start provisioning and deployment of pending changes and return
+        the deploy task."""
+        return make_task(self.put('/clusters/{0}/changes'.format(cluster_id), {}))
+
+    def stop_deployment(self, cluster_id):
+        return make_task(self.put('/clusters/{0}/stop_deployment'.format(cluster_id), {}))
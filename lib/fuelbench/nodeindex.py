@@ -0,0 +1,182 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+"""Site-local index of slave VMs by MAC address.
+
+Slaves get MAC addresses derived from their site and node ID, so the
+node Nailgun discovers can be matched to the VM behind it, and to the
+role and size it was created for, without listing the host's domains.
+The index also allocates the node IDs. It is a JSON file in the site's
+work directory, updated under a file lock as slaves are created in
+parallel threads or processes.
+"""
+
+import os
+import json
+import logging
+from contextlib import contextmanager
+
+from fuelbench import utils
+
+logger = logging.getLogger(__name__)
+
+
+def make_mac(site, node_id, nic=0):
+	"""MAC of interface nic of slave node_id on site.
+
+	52 in the first octet marks a locally administered unicast address
+	like QEMU's own 52:54:00 prefix, which the master VMs keep. Site and
+	nic get an octet each and node_id two, so values that do not fit are
+	rejected rather than folded onto the MAC of another node.
+	"""
+	if not 1 <= site <= 0xff:
+		raise ValueError('Site out of range for a MAC: {0}'.format(site))
+	if not 0 <= nic <= 0xff:
+		raise ValueError('NIC out of range for a MAC: {0}'.format(nic))
+	if not 0 <= node_id <= 0xffff:
+		raise ValueError('Node ID out of range for a MAC: {0}'.format(node_id))
+
+	return '52:54:{0:02x}:{1:02x}:{2:02x}:{3:02x}'.format(site, nic, node_id >> 8, node_id & 0xff)
+
+
+class NodeIndex(object):
+	"""Slaves of a site by the MAC of their admin NIC, and the node IDs
+	handed out to them.
+
+	IDs are allocated under the file lock, so threads and processes
+	creating slaves of the same site never get the same one. IDs of
+	removed slaves are reused, lowest first.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+
+	def __load_state(self):
+		try:
+			with open(self.path, 'r') as fp:
+				state = json.load(fp)
+		except (IOError, ValueError):
+			state = dict()
+
+		state.setdefault('slaves', dict())
+		state.setdefault('next_id', None)
+		state.setdefault('free', list())
+		return state
+
+	def __save(self, state):
+		tmp_file = self.path + '.tmp'
+		with open(tmp_file, 'w') as fp:
+			json.dump(state, fp, indent=2, sort_keys=True)
+		os.rename(tmp_file, self.path)
+
+	@contextmanager
+	def __update(self):
+		directory = os.path.dirname(self.path)
+		if directory and not os.path.exists(directory):
+			os.makedirs(directory)
+
+		with utils.locked(self.path + '.lock'):
+			state = self.__load_state()
+			yield state
+			self.__save(state)
+
+	def load(self):
+		"""Return a dict mapping MAC to {'vm', 'node_id', 'role', 'cpu',
+		'ram', 'disk'}."""
+		return self.__load_state()['slaves']
+
+	def allocate(self, count=1, seed=None):
+		"""Reserve count node IDs and return them in ascending order.
+
+		The first allocation of a site starts after seed(), e.g. the
+		highest ID among slaves that predate the index.
+		"""
+		with self.__update() as state:
+			if state['next_id'] is None:
+				state['next_id'] = (seed() if seed is not None else 0) + 1
+
+			free = sorted(state['free'])
+			node_ids = free[:count]
+			state['free'] = free[count:]
+
+			while len(node_ids) < count:
+				node_ids.append(state['next_id'])
+				state['next_id'] += 1
+
+		return node_ids
+
+	def release(self, node_ids):
+		"""Return node IDs that ended up unused, e.g. after a failure."""
+		with self.__update() as state:
+			state['free'] = sorted(set(state['free']) | set(node_ids))
+
+	def add(self, mac, vm, node_id=None, role=None, cpu=None, ram=None, disk=None):
+		with self.__update() as state:
+			state['slaves'][mac.lower()] = {'vm': vm, 'node_id': node_id, 'role': role,
+											'cpu': cpu, 'ram': ram, 'disk': disk}
+
+	def remove(self, vm):
+		"""Drop the slave and make its node ID available again."""
+		with self.__update() as state:
+			slaves = state['slaves']
+			for mac, entry in slaves.items():
+				if entry['vm'] == vm:
+					del slaves[mac]
+					if entry.get('node_id') is not None:
+						state['free'] = sorted(set(state['free']) | set([entry['node_id']]))
+
+	def clear(self):
+		"""Forget all slaves and reclaim all node IDs."""
+		with self.__update() as state:
+			state['slaves'] = dict()
+			state['next_id'] = 1
+			state['free'] = list()
+
+	def lookup(self, mac):
+		return self.load().get(mac.lower())
+
+
+class NodeMatcher(object):
+	"""Matches discovered Nailgun nodes to indexed slaves, remembering
+	those already seen so each node is reported once."""
+
+	def __init__(self, entries):
+		self.entries = entries
+		self.matched = dict()
+
+	@property
+	def complete(self):
+		return len(self.matched) >= len(self.entries)
+
+	def match(self, nodes):
+		"""Return [(node, entry)] for the nodes not matched before.
+		Nodes of unknown VMs are skipped."""
+		found = list()
+
+		for node in nodes:
+			mac = (node['mac'] or '').lower()
+			if mac in self.matched:
+				continue
+
+			entry = self.entries.get(mac)
+			if entry is None:
+				logger.debug('Node %s with MAC %s is not in the node index', node['id'], mac)
+				continue
+
+			self.matched[mac] = node['id']
+			found.append((node, entry))
+
+		return found
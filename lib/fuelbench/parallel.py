@@ -0,0 +1,271 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+import time
+import threading
+import Queue
+import collections
+import logging
+from contextlib import contextmanager
+
+from fuelbench import trace
+
+logger = logging.getLogger(__name__)
+
+
+class TaskResult(object):
+
+	def __init__(self, item):
+		self.item = item
+		self.value = None
+		self.error = None
+		self.elapsed = 0.0
+
+	@property
+	def ok(self):
+		return self.error is None
+
+
+def run_parallel(func, items, workers=4, callback=None):
+	"""Run func(item) for every item on a bounded pool of threads.
+
+	Failures are recorded on the returned TaskResult list instead of
+	aborting the remaining items. Results keep the order of items.
+	"""
+	results = [TaskResult(item) for item in items]
+	pending = Queue.Queue()
+
+	for result in results:
+		pending.put(result)
+
+	def worker():
+		while True:
+			try:
+				result = pending.get_nowait()
+			except Queue.Empty:
+				return
+
+			start = time.time()
+			try:
+				result.value = func(result.item)
+			except Exception as e:
+				logger.exception('Task failed: %s', result.item)
+				result.error = e
+			result.elapsed = time.time() - start
+
+			if callback:
+				callback(result)
+
+	threads = list()
+	for i in range(max(1, min(workers, len(results)))):
+		thread = threading.Thread(target=worker)
+		thread.daemon = True
+		thread.start()
+		threads.append(thread)
+
+	# join with a timeout so that Ctrl-C still reaches the main thread
+	for thread in threads:
+		while thread.is_alive():
+			thread.join(0.5)
+
+	return results
+
+
+class AdmissionController(object):
+	"""Throttles PXE boots so the master's DHCP/TFTP service is not flooded.
+
+	At most `concurrency` boots are in flight at a time and consecutive
+	boots start at least `interval` seconds apart. A slot is held for
+	`window` seconds after the VM has been started, which covers the
+	DHCP lease and the bootstrap image download.
+	"""
+
+	def __init__(self, concurrency=0, interval=0, window=0):
+		self.concurrency = concurrency
+		self.interval = interval
+		self.window = window
+
+		if concurrency > 0:
+			self._slots = threading.BoundedSemaphore(concurrency)
+		else:
+			self._slots = None
+
+		self._lock = threading.Lock()
+		self._next_start = 0.0
+
+	def acquire(self):
+		if self._slots:
+			self._slots.acquire()
+
+		with self._lock:
+			now = time.time()
+			delay = self._next_start - now
+			self._next_start = max(now, self._next_start) + self.interval
+
+		if delay > 0:
+			time.sleep(delay)
+
+	def release(self):
+		if not self._slots:
+			return
+
+		if self.window > 0:
+			timer = threading.Timer(self.window, self._slots.release)
+			timer.daemon = True
+			timer.start()
+		else:
+			self._slots.release()
+
+	@contextmanager
+	def admit(self):
+		self.acquire()
+		try:
+			yield
+		finally:
+			self.release()
+
+
+class Phase(object):
+
+	def __init__(self, name, func, requires=()):
+		self.name = name
+		self.func = func
+		self.requires = tuple(requires)
+		self.value = None
+		self.error = None
+		self.start = None
+		self.end = None
+
+	@property
+	def elapsed(self):
+		if self.start is None or self.end is None:
+			return 0.0
+		return self.end - self.start
+
+
+class PhaseGraph(object):
+	"""Runs named phases as soon as the phases they require have finished.
+
+	Independent phases run concurrently, each on its own thread. If a
+	phase fails no new phase is started; the running ones are allowed to
+	finish and the first error is raised from run().
+	"""
+
+	def __init__(self, callback=None):
+		self.callback = callback
+		self.phases = collections.OrderedDict()
+		self.started = None
+		self._cond = threading.Condition()
+
+	def add(self, name, func, requires=()):
+		for dep in requires:
+			if dep not in self.phases:
+				raise ValueError('Unknown phase required by {0}: {1}'.format(name, dep))
+
+		self.phases[name] = Phase(name, func, requires)
+
+	def __run_phase(self, phase):
+		try:
+			with trace.span(phase.name):
+				phase.value = phase.func()
+		except Exception as e:
+			logger.exception('Phase %s failed', phase.name)
+			phase.error = e
+
+		with self._cond:
+			phase.end = time.time()
+			self._cond.notify_all()
+
+		if self.callback:
+			self.callback(phase)
+
+	def __succeeded(self, name):
+		phase = self.phases[name]
+		return phase.end is not None and phase.error is None
+
+	def run(self):
+		self.started = time.time()
+		threads = list()
+		waiting = list(self.phases.values())
+
+		while True:
+			with self._cond:
+				finished = [p for p in self.phases.values() if p.end is not None]
+				failed = [p for p in finished if p.error is not None]
+
+				if not failed:
+					for phase in list(waiting):
+						if all(self.__succeeded(dep) for dep in phase.requires):
+							waiting.remove(phase)
+							phase.start = time.time()
+
+							thread = threading.Thread(target=self.__run_phase, args=(phase,),
+													  name='phase-' + phase.name)
+							thread.daemon = True
+							thread.start()
+							threads.append(thread)
+
+				running = [p for p in self.phases.values() if p.start is not None and p.end is None]
+				if not running:
+					break
+
+				# wake up periodically so that Ctrl-C reaches the main thread
+				self._cond.wait(0.5)
+
+		for thread in threads:
+			thread.join()
+
+		for phase in self.phases.values():
+			if phase.error is not None:
+				raise phase.error
+
+		return dict((p.name, p.value) for p in self.phases.values())
+
+	def critical_path(self):
+		"""Phases on the longest dependency chain, in execution order.
+
+		Walks back from the last phase to finish, each time through the
+		requirement that finished last, i.e. the one the phase waited on.
+		"""
+		done = [p for p in self.phases.values() if p.end is not None]
+		if not done:
+			return list()
+
+		path = list()
+		phase = max(done, key=lambda p: p.end)
+
+		while phase is not None:
+			path.append(phase)
+			deps = [self.phases[dep] for dep in phase.requires if self.phases[dep].end is not None]
+			phase = max(deps, key=lambda p: p.end) if deps else None
+
+		path.reverse()
+		return path
+
+	def report(self):
+		lines = list()
+		total = 0.0
+
+		lines.append('{0:<24} {1:>9} {2:>9}'.format('Critical path', 'Start', 'Elapsed'))
+		for phase in self.critical_path():
+			lines.append('{0:<24} {1:>8.1f}s {2:>8.1f}s'.format(phase.name,
+																 phase.start - self.started,
+																 phase.elapsed))
+			total = phase.end - self.started
+
+		lines.append('{0:<24} {1:>9} {2:>8.1f}s'.format('Total', '', total))
+
+		return '\n'.join(lines)
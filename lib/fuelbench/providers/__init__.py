@@ -16,7 +16,8 @@
 #    Author: Joey Zhang <zhangzhuo4@lenovo.com>
 
 
-__all__ = ['KvmProvider']
+__all__ = ['KvmProvider', 'MultiHostProvider']
 
 from fuelbench.providers.kvm import KvmProvider
+from fuelbench.providers.multihost import MultiHostProvider
 
@@ -0,0 +1,192 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+import threading
+import logging
+import urlparse
+import libvirt
+from libvirt import libvirtError
+from contextlib import contextmanager
+
+from fuelbench.settings import *
+
+logger = logging.getLogger(__name__)
+
+_event_loop_lock = threading.Lock()
+_event_loop_thread = None
+
+_pools_lock = threading.Lock()
+_pools = dict()
+
+LOCAL_HOSTNAMES = (None, '', 'localhost', '127.0.0.1', '::1')
+
+
+def start_event_loop():
+    """Register the default libvirt event implementation and run it in a
+    daemon thread. Needed for keepalive, close callbacks and domain events,
+    and only takes effect for connections opened afterwards."""
+    global _event_loop_thread
+
+    with _event_loop_lock:
+        if _event_loop_thread is not None:
+            return
+
+        libvirt.virEventRegisterDefaultImpl()
+
+        def run():
+            while True:
+                libvirt.virEventRunDefaultImpl()
+
+        _event_loop_thread = threading.Thread(target=run, name='libvirt-event-loop')
+        _event_loop_thread.daemon = True
+        _event_loop_thread.start()
+
+
+def is_local_uri(uri):
+    """Whether uri reaches the hypervisor of this machine, e.g.
+    qemu:///system, rather than another host."""
+    return urlparse.urlsplit(uri).hostname in LOCAL_HOSTNAMES
+
+
+def get_pool(uri):
+    """Return the process-wide connection pool for uri."""
+    with _pools_lock:
+        pool = _pools.get(uri)
+        if pool is None:
+            pool = ConnectionPool(uri)
+            _pools[uri] = pool
+        return pool
+
+
+def set_pool(pool):
+    """Use pool for its URI from now on, e.g. one set up for a test."""
+    with _pools_lock:
+        _pools[pool.uri] = pool
+
+
+class ConnectionPool(object):
+    """Long-lived read-only and read-write connections to one libvirt URI.
+
+    A libvirt connection may be shared by several threads, so the pool keeps
+    a single connection per access mode. Dead connections are dropped and
+    transparently reopened on the next request. With shared, read-only
+    requests get the read-write connection too.
+    """
+
+    def __init__(self, uri,
+                 keepalive_interval=LIBVIRT_KEEPALIVE_INTERVAL,
+                 keepalive_count=LIBVIRT_KEEPALIVE_COUNT,
+                 shared=False):
+        self.uri = uri
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._conns = dict()
+
+    def __open(self, readonly):
+        logger.debug('Open %s connection to %s', 'read-only' if readonly else 'read-write', self.uri)
+
+        # the event implementation must exist before the connection opens
+        start_event_loop()
+
+        if readonly:
+            conn = libvirt.openReadOnly(self.uri)
+        else:
+            conn = libvirt.open(self.uri)
+
+        if self.keepalive_interval > 0:
+            try:
+                conn.setKeepAlive(self.keepalive_interval, self.keepalive_count)
+            except libvirtError as e:
+                # not supported by every driver, e.g. test:///
+                logger.debug('Keepalive disabled for %s: %s', self.uri, e)
+
+        try:
+            conn.registerCloseCallback(self.__on_close, readonly)
+        except libvirtError as e:
+            logger.debug('Close callback unavailable for %s: %s', self.uri, e)
+
+        return conn
+
+    def __on_close(self, conn, reason, readonly):
+        logger.warn('Connection to %s closed (reason %d)', self.uri, reason)
+        with self._lock:
+            if self._conns.get(readonly) is conn:
+                del self._conns[readonly]
+
+    def get(self, readonly=False):
+        if self.shared:
+            readonly = False
+
+        with self._lock:
+            conn = self._conns.get(readonly)
+
+            if conn is not None:
+                try:
+                    alive = conn.isAlive()
+                except libvirtError:
+                    alive = False
+
+                if not alive:
+                    logger.warn('Reconnecting to %s', self.uri)
+                    self.__discard(conn)
+                    conn = None
+
+            if conn is None:
+                conn = self.__open(readonly)
+                self._conns[readonly] = conn
+
+            return conn
+
+    def invalidate(self, conn):
+        with self._lock:
+            for key, value in self._conns.items():
+                if value is conn:
+                    del self._conns[key]
+                    self.__discard(conn)
+
+    def __discard(self, conn):
+        try:
+            conn.unregisterCloseCallback()
+        except libvirtError:
+            pass
+
+        try:
+            conn.close()
+        except libvirtError:
+            pass
+
+    @contextmanager
+    def connect(self, readonly=False):
+        conn = self.get(readonly)
+        try:
+            yield conn
+        except Exception:
+            try:
+                alive = conn.isAlive()
+            except libvirtError:
+                alive = False
+
+            if not alive:
+                self.invalidate(conn)
+            raise
+
+    def close(self):
+        with self._lock:
+            for conn in self._conns.values():
+                self.__discard(conn)
+            self._conns.clear()
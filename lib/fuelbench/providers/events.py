@@ -0,0 +1,145 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+import time
+import threading
+import collections
+import logging
+import libvirt
+from libvirt import libvirtError
+
+from fuelbench.providers import connection
+
+logger = logging.getLogger(__name__)
+
+EVENT_STARTED = 'started'
+EVENT_STOPPED = 'stopped'
+EVENT_CRASHED = 'crashed'
+EVENT_UNDEFINED = 'undefined'
+
+LIFECYCLE_EVENTS = {
+    libvirt.VIR_DOMAIN_EVENT_STARTED: EVENT_STARTED,
+    libvirt.VIR_DOMAIN_EVENT_STOPPED: EVENT_STOPPED,
+    libvirt.VIR_DOMAIN_EVENT_CRASHED: EVENT_CRASHED,
+    libvirt.VIR_DOMAIN_EVENT_UNDEFINED: EVENT_UNDEFINED,
+}
+
+# fall back to polling this often in case an event was lost on reconnect
+RECHECK_INTERVAL = 10
+
+_watchers_lock = threading.Lock()
+_watchers = dict()
+
+
+def get_watcher(uri):
+    """Return the process-wide domain event watcher for uri."""
+    with _watchers_lock:
+        watcher = _watchers.get(uri)
+        if watcher is None:
+            watcher = DomainEventWatcher(connection.get_pool(uri))
+            _watchers[uri] = watcher
+        return watcher
+
+
+class DomainEventWatcher(object):
+    """Dispatches libvirt lifecycle events to threads waiting on a domain.
+
+    One callback on the shared read-only connection serves every domain on
+    the host. Waiters pass a function returning the current state so that a
+    transition which happened before the wait started is not missed.
+    """
+
+    def __init__(self, pool, history=16):
+        self.pool = pool
+        self._cond = threading.Condition()
+        self._subscribe_lock = threading.Lock()
+        self._seq = 0
+        self._events = collections.defaultdict(lambda: collections.deque(maxlen=history))
+        self._conn = None
+        self._callback_id = None
+
+    def __on_event(self, conn, dom, event, detail, opaque):
+        name = dom.name()
+        event_name = LIFECYCLE_EVENTS.get(event)
+
+        if event_name is None:
+            return
+
+        logger.debug('Domain %s: %s (detail %d)', name, event_name, detail)
+
+        with self._cond:
+            self._seq += 1
+            self._events[name].append((self._seq, event_name))
+            self._cond.notify_all()
+
+    def __subscribe(self):
+        with self._subscribe_lock:
+            conn = self.pool.get(readonly=True)
+
+            if conn is self._conn:
+                return
+
+            # the pool opened conn with the event loop running, which
+            # delivery of the callback depends on
+            try:
+                self._callback_id = conn.domainEventRegisterAny(None,
+                                                                libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                                                                self.__on_event,
+                                                                None)
+            except libvirtError as e:
+                logger.warn('Domain events unavailable on %s, polling instead: %s', self.pool.uri, e)
+
+            # do not retry on every wait if the driver has no events
+            self._conn = conn
+
+    def wait(self, name, events, current=None, timeout=None):
+        """Block until domain name emits one of events.
+
+        Returns the matching event name, or None on timeout. If current is
+        given it is called first and on every recheck; a non-None result is
+        returned immediately.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+
+        with self._cond:
+            start_seq = self._seq
+
+        while True:
+            self.__subscribe()
+
+            # query the state without holding the lock the event thread needs
+            if current is not None:
+                state = current()
+                if state is not None:
+                    return state
+
+            with self._cond:
+                for seq, event_name in self._events[name]:
+                    if seq > start_seq and event_name in events:
+                        return event_name
+
+                if deadline is None:
+                    delay = RECHECK_INTERVAL
+                else:
+                    delay = min(RECHECK_INTERVAL, deadline - time.time())
+                    if delay <= 0:
+                        return None
+
+                self._cond.wait(delay)
+
+                for seq, event_name in self._events[name]:
+                    if seq > start_seq and event_name in events:
+                        return event_name
@@ -30,6 +30,11 @@ from xml.etree import ElementTree as ET
 
 from fuelbench import config_manager
 from fuelbench import utils
+from fuelbench import parallel
+from fuelbench import trace
+from fuelbench import metrics
+from fuelbench.providers import connection
+from fuelbench.providers import events
 from fuelbench.settings import *
 from fuelbench.error import *
 
@@ -50,13 +55,48 @@ ISO_NETWORK_XML = """\
 </network>
 """
 
+VOLUME_XML = """\
+<volume>
+  <name>${name}</name>
+  <capacity unit='G'>${capacity}</capacity>
+  <target>
+    <format type='qcow2'/>
+    <permissions>
+      <mode>${mode}</mode>
+    </permissions>
+  </target>
+</volume>
+"""
+
+OVERLAY_VOLUME_XML = """\
+<volume>
+  <name>${name}</name>
+  <capacity unit='G'>${capacity}</capacity>
+  <target>
+    <format type='qcow2'/>
+  </target>
+  <backingStore>
+    <path>${backing_path}</path>
+    <format type='qcow2'/>
+  </backingStore>
+</volume>
+"""
+
 logger = logging.getLogger(__name__)
 
 class KvmProvider(object):
     
     def __init__(self, uri='qemu:///system', config=config_manager.defaults()):
+        # ISO images, virt-customize and the masters' NAT networks are
+        # all used from this machine, so the hypervisor must be local
+        if not connection.is_local_uri(uri):
+            raise ProviderError('connect to', uri,
+                                'only local libvirt URIs are supported, e.g. qemu:///system')
+
         self.uri = uri
         self.config = config
+        self.pool = connection.get_pool(uri)
+        self.watcher = events.get_watcher(uri)
 
     def __list_site_domains(self, conn, site):
         prefix = 'site' + str(site) + '-'
@@ -80,85 +120,241 @@ class KvmProvider(object):
 
         return domains
         
+    def __list_domain_volumes(self, conn, dom):
+        """Storage volumes of the disks of dom. Disks outside any pool are
+        skipped with a warning, like virsh undefine --remove-all-storage
+        does, so they never prevent the domain from being undefined."""
+        volumes = list()
+        xml_root = ET.fromstring(dom.XMLDesc(0))
+
+        for disk in xml_root.findall("./devices/disk[@device='disk']"):
+            source = disk.find('source')
+            if source is None:
+                continue
+
+            path = source.get('file') or source.get('dev')
+            try:
+                if path:
+                    volumes.append(conn.storageVolLookupByPath(path))
+                elif source.get('pool') and source.get('volume'):
+                    path = '{0}/{1}'.format(source.get('pool'), source.get('volume'))
+                    pool = conn.storagePoolLookupByName(source.get('pool'))
+                    volumes.append(pool.storageVolLookupByName(source.get('volume')))
+            except libvirtError as e:
+                logger.warn('Disk %s of %s is not a storage volume and is kept: %s', path, dom.name(), e)
+
+        return volumes
+
     def __undefine_domain(self, name):
-        cmdline = 'virsh --connect {uri} undefine {domain} --managed-save --snapshots-metadata --remove-all-storage'.format(uri=self.uri, domain=name)
-        
-        retcode = subprocess.call(cmdline + '>>{0} 2>&1'.format(CONSOLE_LOG), shell=True)
-        
-        if retcode != 0:
-            raise RuntimeError('Command failed with exit code {0}'.format(retcode))
-    
+        """Undefine a domain with its managed save image, snapshot metadata
+        and disk volumes, the same as virsh undefine --managed-save
+        --snapshots-metadata --remove-all-storage. CD-ROM media is kept."""
+        logger.info('Undefine domain %s', name)
+
+        with self.pool.connect() as conn:
+            try:
+                dom = conn.lookupByName(name)
+            except libvirtError as e:
+                raise ProviderError('look up domain', name, e)
+
+            volumes = self.__list_domain_volumes(conn, dom)
+
+            flags = libvirt.VIR_DOMAIN_UNDEFINE_MANAGED_SAVE | \
+                    libvirt.VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA
+            try:
+                dom.undefineFlags(flags)
+            except libvirtError as e:
+                raise ProviderError('undefine domain', name, e)
+
+            for vol in volumes:
+                path = vol.path()
+                logger.info('Delete volume %s', path)
+                try:
+                    vol.delete(0)
+                except libvirtError as e:
+                    raise ProviderError('delete volume', path, e)
+
     def __delete_volume(self, name, pool):
-        cmdline = 'virsh --connect {uri} vol-delete {vol} --pool {pool}'.format(uri=self.uri, vol=name, pool=pool)
-        
-        retcode = subprocess.call(cmdline + '>>{0} 2>&1'.format(CONSOLE_LOG), shell=True)
-        
-        if retcode != 0:
-            raise RuntimeError('Command failed with exit code {0}'.format(retcode))
-        
+        logger.info('Delete volume %s from pool %s', name, pool)
+
+        with self.pool.connect() as conn:
+            try:
+                storage_pool = conn.storagePoolLookupByName(pool)
+                try:
+                    vol = storage_pool.storageVolLookupByName(name)
+                except libvirtError:
+                    # the file may have been created after the last refresh
+                    storage_pool.refresh(0)
+                    vol = storage_pool.storageVolLookupByName(name)
+                vol.delete(0)
+            except libvirtError as e:
+                raise ProviderError('delete volume', '{0}/{1}'.format(pool, name), e)
+
     def __snapshot_create_as(self, domain, name, desc=''):
-        cmdline = 'virsh --connect {uri} snapshot-create-as {domain} {name} --description "{desc}"'.format(uri=self.uri, 
-                                                                                                           domain=domain,
-                                                                                                           name=name,
-                                                                                                           desc=desc)
-        logger.info('Execute: %s', cmdline)
-        retcode = subprocess.call(cmdline + '>>{0} 2>&1'.format(CONSOLE_LOG), shell=True)
-        logger.info('Return code: %d', retcode)
-        
-        if retcode != 0:
-            raise CommandLineError(cmdline, retcode)
-        
+        logger.info('Create snapshot %s of %s', name, domain)
+
+        xml_root = ET.Element('domainsnapshot')
+        ET.SubElement(xml_root, 'name').text = name
+        ET.SubElement(xml_root, 'description').text = desc
+        xml_desc = ET.tostring(xml_root)
+
+        with self.pool.connect() as conn:
+            try:
+                dom = conn.lookupByName(domain)
+                dom.snapshotCreateXML(xml_desc, 0)
+            except libvirtError as e:
+                raise ProviderError('create snapshot', '{0}@{1}'.format(domain, name), e)
+
     def __snapshot_revert(self, domain, name):
-        cmdline = 'virsh --connect {uri} snapshot-revert {domain} {name}'.format(uri=self.uri, 
-                                                                                 domain=domain,
-                                                                                 name=name)
-        logger.info('Execute: %s', cmdline)
-        retcode = subprocess.call(cmdline + '>>{0} 2>&1'.format(CONSOLE_LOG), shell=True)
-        logger.info('Return code: %d', retcode)
-        
-        if retcode != 0:
-            raise CommandLineError(cmdline, retcode)
-        
-    def __keep_pxe_boot(self, vm_name):
-        conn = libvirt.open(self.uri)
-                
-        dom = conn.lookupByName(vm_name)
-        xml_root = ET.fromstring(dom.XMLDesc())
-        
+        logger.info('Revert %s to snapshot %s', domain, name)
+
+        with self.pool.connect() as conn:
+            try:
+                dom = conn.lookupByName(domain)
+                snapshot = dom.snapshotLookupByName(name, 0)
+                dom.revertToSnapshot(snapshot, 0)
+            except libvirtError as e:
+                raise ProviderError('revert snapshot', '{0}@{1}'.format(domain, name), e)
+
+    def __set_pxe_boot(self, xml_root):
         xml_os = xml_root.find('os')
         for item in xml_os.findall('boot'):
             xml_os.remove(item)
-        
+
         ET.SubElement(xml_os, 'boot', {'dev': 'network'})
         ET.SubElement(xml_os, 'boot', {'dev': 'hd'})
+
+    def __keep_pxe_boot(self, vm_name):
+        with self.pool.connect() as conn:
+            dom = conn.lookupByName(vm_name)
+            xml_root = ET.fromstring(dom.XMLDesc())
         
-        xml_desc = ET.tostring(xml_root)
-        conn.defineXML(xml_desc)
+            self.__set_pxe_boot(xml_root)
+        
+            xml_desc = ET.tostring(xml_root)
+            conn.defineXML(xml_desc)
+
+    def __define_vm_node(self, cmdline, vm_name, boot):
+        """Run virt-install with --print-xml and define the domain without
+        starting it. Storage is still created by virt-install."""
+        with open(CONSOLE_LOG, 'a') as log:
+            print(cmdline, file=log)
+            log.flush()
+
+            with trace.span('virt-install', cat='subprocess', vm=vm_name):
+                process = subprocess.Popen(cmdline, shell=True, stdout=subprocess.PIPE, stderr=log)
+                output = process.communicate()[0]
+
+        metrics.count_exit('virt-install', process.returncode)
+
+        if process.returncode != 0:
+            raise RuntimeError('Command failed with exit code {0}'.format(process.returncode))
+
+        # multi-step installs print one document per step; the last one is
+        # the configuration the domain keeps after installation
+        docs = [doc for doc in output.split('</domain>') if '<domain' in doc]
+        if not docs:
+            raise ProviderError('define', vm_name, 'virt-install printed no domain XML')
+
+        xml_root = ET.fromstring(docs[-1][docs[-1].index('<domain'):] + '</domain>')
+
+        if boot == 'pxe':
+            self.__set_pxe_boot(xml_root)
+
+        with self.pool.connect() as conn:
+            conn.defineXML(ET.tostring(xml_root))
         
-        conn.close()
+    def get_site_provider(self, site, reservations=None):
+        """The provider hosting site; see MultiHostProvider."""
+        return self
 
     def get_storage_pool_path(self):
         pool_name = self.config['storage_pool']
         
-        conn = libvirt.openReadOnly(self.uri)
-        
-        pool = conn.storagePoolLookupByName(pool_name)
-        pool_info_root = ET.fromstring(pool.XMLDesc())
-        
-        conn.close()
+        with self.pool.connect(readonly=True) as conn:
+            pool = conn.storagePoolLookupByName(pool_name)
+            pool_info_root = ET.fromstring(pool.XMLDesc())
         
         return pool_info_root.find("./target/path").text
 
+    @trace.traced(cat='libvirt')
     def get_vm_nodes(self, site):
-        conn = libvirt.openReadOnly(self.uri)
-
-        domains = self.__list_site_domains(conn, site)
-        name_list = [dom.name() for dom in domains]
-
-        conn.close()
+        with self.pool.connect(readonly=True) as conn:
+            domains = self.__list_site_domains(conn, site)
+            name_list = [dom.name() for dom in domains]
 
         return name_list
     
+    @trace.traced(cat='libvirt')
+    def get_host_capacity(self):
+        """Physical CPUs, RAM (MB) and storage pool size (GB) of the host."""
+        pool_name = self.config['storage_pool']
+
+        with self.pool.connect(readonly=True) as conn:
+            info = conn.getInfo()
+            pool = conn.storagePoolLookupByName(pool_name)
+            state, capacity, allocation, available = pool.info()
+
+        return {'vcpus': info[2],
+                'ram': info[1],
+                'disk': capacity / 1024.0 ** 3,
+                'disk_available': available / 1024.0 ** 3}
+
+    @trace.traced(cat='libvirt')
+    def get_site_allocations(self):
+        """vCPUs, RAM (MB), virtual disk size (GB) and slave count allocated
+        to the domains of every site, running or not."""
+        pattern = re.compile(r'^site(\d+)-(.+)$')
+        allocations = dict()
+
+        with self.pool.connect(readonly=True) as conn:
+            for dom in self.__list_all_domains(conn):
+                match = pattern.match(dom.name())
+                site = int(match.group(1))
+
+                try:
+                    state, max_mem, mem, vcpus, cpu_time = dom.info()
+                except libvirtError as e:
+                    # undefined since it was listed, e.g. by a site's teardown
+                    logger.debug('Skip domain %s: %s', dom.name(), e)
+                    continue
+
+                disk = 0
+                try:
+                    for vol in self.__list_domain_volumes(conn, dom):
+                        disk += vol.info()[1]
+                except (ProviderError, libvirtError) as e:
+                    logger.warn('Disk size of %s unknown: %s', dom.name(), e)
+
+                usage = allocations.setdefault(site, {'vcpus': 0, 'ram': 0, 'disk': 0, 'nodes': 0})
+                usage['vcpus'] += vcpus
+                usage['ram'] += max_mem / 1024
+                usage['disk'] += disk / 1024.0 ** 3
+                if match.group(2).startswith('node-'):
+                    usage['nodes'] += 1
+
+        return allocations
+
+    @trace.traced(cat='libvirt')
+    def get_attached_media(self):
+        """Paths of the CD-ROM images attached to any domain on the host."""
+        paths = set()
+
+        with self.pool.connect(readonly=True) as conn:
+            for dom in conn.listAllDomains(0):
+                try:
+                    xml_root = ET.fromstring(dom.XMLDesc(0))
+                except libvirtError as e:
+                    # undefined since it was listed, e.g. by a site's teardown
+                    logger.debug('Skip domain %s: %s', dom.name(), e)
+                    continue
+
+                for source in xml_root.findall("./devices/disk[@device='cdrom']/source"):
+                    if source.get('file'):
+                        paths.add(source.get('file'))
+
+        return paths
+
     def get_max_node_id(self, site):
         vm_nodes = self.get_vm_nodes(site)
         pattern = re.compile(r'^site(\d+)-node-(\d+)$')
@@ -174,74 +370,127 @@ class KvmProvider(object):
     
         return max_id
         
-        
-    def clean_vm_nodes(self, site):
-        conn = libvirt.open(self.uri)
+    def __teardown(self, target, domains=(), networks=()):
+        """Remove domains and networks concurrently.
 
-        domains = self.__list_site_domains(conn, site)
+        All domains are destroyed first, then undefined together with their
+        storage, then the networks are removed. A failed object is logged
+        and skipped by the later stages; the remaining ones still go ahead.
+        """
+        workers = self.config['teardown_workers']
 
-        for dom in domains:
+        def destroy_domain(dom):
             if dom.isActive():
                 dom.destroy()
-                
-            name = dom.name()            
-            self.__undefine_domain(name)
-            
-        conn.close()
-        
-    def clean_slave_nodes(self, site):
-        conn = libvirt.open(self.uri)
 
-        domains = self.__list_site_domains(conn, site)
+        def undefine_domain(dom):
+            self.__undefine_domain(dom.name())
 
-        for dom in domains:
-            name = dom.name()
-            if name.endswith('-master'):
-                continue
+        def remove_network(net):
+            if net.isActive():
+                net.destroy()
+            net.undefine()
+
+        def run_stage(stage, func, objects):
+            results = parallel.run_parallel(func, objects, workers=workers)
+
+            for result in results:
+                name = result.item.name()
+                if result.ok:
+                    logger.info('%s %s: %.2fs', stage, name, result.elapsed)
+                else:
+                    logger.error('%s %s failed after %.2fs: %s', stage, name, result.elapsed, result.error)
+
+            return results
+
+        report = list()
+
+        results = run_stage('destroy', destroy_domain, domains)
+        report.extend(results)
+
+        results = run_stage('undefine', undefine_domain, [r.item for r in results if r.ok])
+        report.extend(results)
+
+        report.extend(run_stage('remove', remove_network, networks))
+
+        failed = [r for r in report if not r.ok]
+        if failed:
+            raise ProviderError('clean', target,
+                                '{0} of {1} operations failed'.format(len(failed), len(report)))
+
+        return report
+
+    @trace.traced(cat='libvirt')
+    def clean_site(self, site):
+        with self.pool.connect() as conn:
+            domains = self.__list_site_domains(conn, site)
+            networks = self.__list_site_networks(conn, site)
+
+            return self.__teardown('site{0}'.format(site), domains, networks)
+
+    @trace.traced(cat='libvirt')
+    def clean_all_sites(self):
+        with self.pool.connect() as conn:
+            domains = self.__list_all_domains(conn)
+            networks = self.__list_all_networks(conn)
+
+            return self.__teardown('all sites', domains, networks)
+
+    @trace.traced(cat='libvirt')
+    def clean_vm_nodes(self, site):
+        with self.pool.connect() as conn:
+            domains = self.__list_site_domains(conn, site)
+
+            return self.__teardown('site{0}'.format(site), domains)
             
-            if dom.isActive():
-                dom.destroy()
-                
-            self.__undefine_domain(name)
+    @trace.traced(cat='libvirt')
+    def clean_slave_nodes(self, site):
+        with self.pool.connect() as conn:
+            domains = [dom for dom in self.__list_site_domains(conn, site)
+                       if not dom.name().endswith('-master')]
+
+            return self.__teardown('site{0}'.format(site), domains)
             
-        conn.close()    
-        
+    @trace.traced(cat='libvirt')
     def clean_all_vm_nodes(self):
-        conn = libvirt.open(self.uri)
-
-        domains = self.__list_all_domains(conn)
+        with self.pool.connect() as conn:
+            domains = self.__list_all_domains(conn)
 
-        for dom in domains:
-            if dom.isActive():
-                dom.destroy()
-                
-            name = dom.name()            
-            self.__undefine_domain(name)
+            return self.__teardown('all sites', domains)
             
-        conn.close()  
-
+    @trace.traced(cat='libvirt')
     def install_vm_node(self, site, name,
                         vcpus=1, ram=2048,
                         boot='cdrom', iso_image='',
                         disk_format='qcow2', disk_size=40, disk_io='threads',
                         networks=[],
+                        macs=None,
                         os_variant='centos6.5',
                         wait=0,
                         delete_media=False,
-                        persistent_boot=False):
+                        persistent_boot=False,
+                        disk_path=None,
+                        start=True):
 	
         vm_name = "site{0}-{1}".format(site, name)
 
         install_cmd = 'virt-install --connect {uri} --virt-type kvm --name {name} --vcpus {vcpus} --ram {ram}'.format(uri=self.uri, name=vm_name, vcpus=vcpus, ram=ram)
 		
-        pool_path = self.get_storage_pool_path()
-        disk_opt = '--disk path={pool_path}/{disk_name}.img,format={disk_format},size={disk_size},bus=virtio,cache=writeback,io={disk_io}'.format(pool_path=pool_path, disk_name=vm_name, disk_format=disk_format, disk_size=disk_size, disk_io=disk_io)
+        if disk_path:
+            # an existing volume, e.g. an overlay from create_overlay_volume()
+            disk_opt = '--disk path={disk_path},format={disk_format},bus=virtio,cache=writeback,io={disk_io}'.format(disk_path=disk_path, disk_format=disk_format, disk_io=disk_io)
+        else:
+            pool_path = self.get_storage_pool_path()
+            disk_opt = '--disk path={pool_path}/{disk_name}.img,format={disk_format},size={disk_size},bus=virtio,cache=writeback,io={disk_io}'.format(pool_path=pool_path, disk_name=vm_name, disk_format=disk_format, disk_size=disk_size, disk_io=disk_io)
 
+        # macs, if given, pins the MAC address of each network's NIC
         net_opt = ''
-        for net in networks:
+        for i, net in enumerate(networks):
             if len(net_opt) > 0:
                 net_opt += ' '
             net_opt += '--network network={network},model=virtio'.format(network=net)
+            if macs and i < len(macs):
+                net_opt += ',mac={0}'.format(macs[i])
 
         graphics_opt = '--graphics vnc --noautoconsole'
 
@@ -252,6 +501,11 @@ class KvmProvider(object):
                 raise ValueError('A valid ISO file is required')
         elif boot == 'pxe':
             boot_opt = '--pxe'
+        elif boot == 'import':
+            if disk_path:
+                boot_opt = '--import'
+            else:
+                raise ValueError('A disk image is required to import')
         else:
             raise NotImplementedError('Unsupported boot mode: ' + boot)
 
@@ -264,11 +518,17 @@ class KvmProvider(object):
                             graphics_opt, boot_opt, 
                             os_opt, misc_opt])
         
+        if not start:
+            self.__define_vm_node(cmdline + ' --print-xml', vm_name, boot)
+            return vm_name
+
         try:
             with open(CONSOLE_LOG, 'a') as log:
                 print(cmdline, file=log)            
                
-            retcode = subprocess.call(cmdline + '>>{0} 2>&1'.format(CONSOLE_LOG), shell=True)
+            with trace.span('virt-install', cat='subprocess', vm=vm_name):
+                retcode = subprocess.call(cmdline + '>>{0} 2>&1'.format(CONSOLE_LOG), shell=True)
+            metrics.count_exit('virt-install', retcode)
     
             if retcode != 0:
                 raise RuntimeError('Command failed with exit code {0}'.format(retcode))
@@ -283,49 +543,137 @@ class KvmProvider(object):
             if boot == 'pxe':
                 self.__keep_pxe_boot(vm_name)
             
-            time.sleep(1)            
+            self.wait_vm_node_event(site, name, [events.EVENT_STOPPED], timeout=30)
             self.start_vm_node(site, name)
         
         return vm_name
     
-    
+    @trace.traced(cat='libvirt')
+    def get_vm_disk_path(self, site, name):
+        vm_name = "site{0}-{1}".format(site, name)
+
+        with self.pool.connect(readonly=True) as conn:
+            dom = conn.lookupByName(vm_name)
+            xml_root = ET.fromstring(dom.XMLDesc(0))
+
+        source = xml_root.find("./devices/disk[@device='disk']/source")
+        if source is None:
+            raise ProviderError('find disk of', vm_name)
+
+        return source.get('file') or source.get('dev')
+
+    @trace.traced(cat='libvirt')
+    def get_vm_macs(self, site):
+        """Map the MAC addresses of the site's VMs to their node names."""
+        prefix = 'site{0}-'.format(site)
+        macs = dict()
+
+        with self.pool.connect(readonly=True) as conn:
+            for dom in self.__list_site_domains(conn, site):
+                name = dom.name()[len(prefix):]
+                xml_root = ET.fromstring(dom.XMLDesc(0))
+
+                for mac in xml_root.findall('./devices/interface/mac'):
+                    macs[mac.get('address').lower()] = name
+
+        return macs
+
+    def get_volume_path(self, name):
+        """Path of volume name in the storage pool, or None if missing."""
+        pool_name = self.config['storage_pool']
+
+        with self.pool.connect() as conn:
+            pool = conn.storagePoolLookupByName(pool_name)
+            pool.refresh(0)
+            try:
+                return pool.storageVolLookupByName(name).path()
+            except libvirtError:
+                return None
+
+    @trace.traced(cat='libvirt')
+    def create_volume_from(self, name, source_path, readonly=True):
+        """Copy source_path into a new standalone qcow2 volume."""
+        pool_name = self.config['storage_pool']
+        logger.info('Create volume %s from %s', name, source_path)
+
+        template = string.Template(VOLUME_XML)
+        xml = template.substitute(name=name, capacity=0,
+                                  mode='0444' if readonly else '0644')
+
+        with self.pool.connect() as conn:
+            try:
+                pool = conn.storagePoolLookupByName(pool_name)
+                source = conn.storageVolLookupByPath(source_path)
+                vol = pool.createXMLFrom(xml, source, 0)
+            except libvirtError as e:
+                raise ProviderError('create volume', name, e)
+
+            return vol.path()
+
+    @trace.traced(cat='libvirt')
+    def delete_volume(self, name):
+        self.__delete_volume(name, self.config['storage_pool'])
+
+    @trace.traced(cat='libvirt')
+    def create_overlay_volume(self, name, backing_path, size):
+        """Create a qcow2 volume of size GB on top of backing_path."""
+        pool_name = self.config['storage_pool']
+        logger.info('Create overlay volume %s on %s', name, backing_path)
+
+        template = string.Template(OVERLAY_VOLUME_XML)
+        xml = template.substitute(name=name, capacity=size,
+                                  backing_path=backing_path)
+
+        with self.pool.connect() as conn:
+            try:
+                pool = conn.storagePoolLookupByName(pool_name)
+                vol = pool.createXML(xml, 0)
+            except libvirtError as e:
+                raise ProviderError('create volume', name, e)
+
+            return vol.path()
+
+    @trace.traced(cat='libvirt')
     def start_vm_node(self, site, name):
-        conn = libvirt.open(self.uri)
+        with self.pool.connect() as conn:
+            vm_name = "site{0}-{1}".format(site, name)
         
-        vm_name = "site{0}-{1}".format(site, name)
+            dom = conn.lookupByName(vm_name)
+            ret = dom.create()
         
-        dom = conn.lookupByName(vm_name)
-        ret = dom.create()
+        return ret == 0
+    
+    @trace.traced(cat='libvirt')
+    def shutdown_vm_node(self, site, name):
+        with self.pool.connect() as conn:
+            vm_name = "site{0}-{1}".format(site, name)
         
-        conn.close()
+            dom = conn.lookupByName(vm_name)
+            ret = dom.shutdown()
         
         return ret == 0
     
-    
+    @trace.traced(cat='libvirt')
     def destroy_vm_node(self, site, name):
-        conn = libvirt.open(self.uri)
-        
-        vm_name = "site{0}-{1}".format(site, name)
+        with self.pool.connect() as conn:
+            vm_name = "site{0}-{1}".format(site, name)
         
-        dom = conn.lookupByName(vm_name)
-        ret = dom.destroy()
-        
-        conn.close()
+            dom = conn.lookupByName(vm_name)
+            ret = dom.destroy()
         
         return ret == 0
     
+    @trace.traced(cat='libvirt')
     def restart_vm_node(self, site, name):
-        conn = libvirt.open(self.uri)
-        
-        vm_name = "site{0}-{1}".format(site, name)
+        with self.pool.connect() as conn:
+            vm_name = "site{0}-{1}".format(site, name)
         
-        dom = conn.lookupByName(vm_name)
-        ret = dom.reset()
-        
-        conn.close()
+            dom = conn.lookupByName(vm_name)
+            ret = dom.reset()
         
         return ret == 0
     
+    @trace.traced(cat='libvirt')
     def delete_vm_node(self, site, name):
         
         vm_name = "site{0}-{1}".format(site, name)
@@ -333,17 +681,40 @@ class KvmProvider(object):
         self.__undefine_domain(vm_name)
     
     def check_vm_node_active(self, site, name):
-        conn = libvirt.openReadOnly(self.uri)
+        with self.pool.connect(readonly=True) as conn:
+            vm_name = "site{0}-{1}".format(site, name)
         
-        vm_name = "site{0}-{1}".format(site, name)
-        
-        dom = conn.lookupByName(vm_name)
-        is_active = dom.isActive()
-        
-        conn.close()
+            dom = conn.lookupByName(vm_name)
+            is_active = dom.isActive()
         
         return is_active
     
+    @trace.traced(cat='libvirt')
+    def wait_vm_node_event(self, site, name, wait_events, timeout=None):
+        """Wait until the VM is started, stopped or crashed.
+
+        wait_events is a list of events.EVENT_* names. Returns the event that
+        occurred, or None on timeout. Returns at once if the VM is already in
+        the requested state.
+        """
+        vm_name = "site{0}-{1}".format(site, name)
+
+        def current():
+            with self.pool.connect(readonly=True) as conn:
+                state = conn.lookupByName(vm_name).state()[0]
+
+            if state == libvirt.VIR_DOMAIN_CRASHED and events.EVENT_CRASHED in wait_events:
+                return events.EVENT_CRASHED
+            if state in (libvirt.VIR_DOMAIN_SHUTOFF, libvirt.VIR_DOMAIN_CRASHED):
+                if events.EVENT_STOPPED in wait_events:
+                    return events.EVENT_STOPPED
+            elif events.EVENT_STARTED in wait_events:
+                return events.EVENT_STARTED
+            return None
+
+        return self.watcher.wait(vm_name, wait_events, current=current, timeout=timeout)
+
+    @trace.traced(cat='libvirt')
     def create_vm_snapshot(self, site, name, snapshot, description=''):
         vm_name = "site{0}-{1}".format(site, name)
         success = False
@@ -351,12 +722,13 @@ class KvmProvider(object):
         try:
             self.__snapshot_create_as(vm_name, snapshot, description)
             success = True
-        except CommandError as e:
+        except ProviderError as e:
             logger.error(e)
             success = False
         
         return success
     
+    @trace.traced(cat='libvirt')
     def revert_vm_snapshot(self, site, name, snapshot):
         vm_name = "site{0}-{1}".format(site, name)
         success = False
@@ -364,7 +736,7 @@ class KvmProvider(object):
         try:
             self.__snapshot_revert(vm_name, snapshot)
             success = True
-        except CommandError as e:
+        except ProviderError as e:
             logger.error(e)
             success = False
         
@@ -416,58 +788,44 @@ class KvmProvider(object):
 
         return net
 
+    @trace.traced(cat='libvirt')
     def get_networks(self, site):
-        conn = libvirt.openReadOnly(self.uri)
-
-        networks = self.__list_site_networks(conn, site)
-        name_list = [net.name() for net in networks]
-
-        conn.close()
+        with self.pool.connect(readonly=True) as conn:
+            networks = self.__list_site_networks(conn, site)
+            name_list = [net.name() for net in networks]
 
         return name_list
 
+    @trace.traced(cat='libvirt')
     def clean_networks(self, site):
-        conn = libvirt.open(self.uri)
+        with self.pool.connect() as conn:
+            networks = self.__list_site_networks(conn, site)
 
-        networks = self.__list_site_networks(conn, site)
-
-        for net in networks:
-            if net.isActive():
-                net.destroy()
-
-            net.undefine()
+            return self.__teardown('site{0}'.format(site), networks=networks)
 
-        conn.close()
-        
+    @trace.traced(cat='libvirt')
     def clean_all_networks(self):
-        conn = libvirt.open(self.uri)
+        with self.pool.connect() as conn:
+            networks = self.__list_all_networks(conn)
 
-        networks = self.__list_all_networks(conn)
-
-        for net in networks:
-            if net.isActive():
-                net.destroy()
-
-            net.undefine()
-
-        conn.close()
+            return self.__teardown('all sites', networks=networks)
 
+    @trace.traced(cat='libvirt')
     def create_networks(self, site, networks):
-        conn = libvirt.open(self.uri)
-        name_list = list()
-
-        for idx, info in enumerate(networks, start=1):
-            name = 'site{0}net{1}'.format(site, idx)
-            if info['type'] == NETWORK_NAT:
-                ipaddr = info['gateway']
-                netmask = info['netmask']
-                self.__create_nat_network(conn, name, ipaddr, netmask)
-            elif info['type'] == NETWORK_ISOLATED:
-                self.__create_isolated_network(conn, name)
-            else:
-                raise NotImplementedError("Unsupported network type: '{0}'".format(info.type))
-
-            name_list.append(name)
+        with self.pool.connect() as conn:
+            name_list = list()
+
+            for idx, info in enumerate(networks, start=1):
+                name = 'site{0}net{1}'.format(site, idx)
+                if info['type'] == NETWORK_NAT:
+                    ipaddr = info['gateway']
+                    netmask = info['netmask']
+                    self.__create_nat_network(conn, name, ipaddr, netmask)
+                elif info['type'] == NETWORK_ISOLATED:
+                    self.__create_isolated_network(conn, name)
+                else:
+                    raise NotImplementedError("Unsupported network type: '{0}'".format(info.type))
+
+                name_list.append(name)
 
-        conn.close()
         return name_list
@@ -0,0 +1,190 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+import os
+import threading
+import logging
+
+from fuelbench import config_manager
+from fuelbench import capacity
+from fuelbench.providers.kvm import KvmProvider
+from fuelbench.settings import CAPACITY_RESERVATION_FILE
+
+logger = logging.getLogger(__name__)
+
+# methods taking the site as first argument, run on the host of the site
+SITE_METHODS = (
+    'get_max_node_id',
+    'clean_vm_nodes',
+    'clean_slave_nodes',
+    'clean_networks',
+    'install_vm_node',
+    'get_vm_disk_path',
+    'get_vm_macs',
+    'start_vm_node',
+    'shutdown_vm_node',
+    'destroy_vm_node',
+    'restart_vm_node',
+    'delete_vm_node',
+    'check_vm_node_active',
+    'wait_vm_node_event',
+    'create_vm_snapshot',
+    'revert_vm_snapshot',
+    'create_networks',
+)
+
+
+class MultiHostProvider(object):
+    """Spreads sites over several libvirt hosts.
+
+    Every URI must be local to this machine, e.g. qemu:///system and
+    qemu:///session or libvirtd instances on their own sockets; see
+    KvmProvider.
+
+    The networks of a site are local to one host, so a site always lives
+    on a single host: the one already holding its domains or networks,
+    the one another process has placed it on, or else the one with the
+    most free RAM and vCPUs after overcommit. Sites still being created
+    count with their capacity reservations, so processes creating sites
+    at the same time spread them over the hosts. Per-site calls go to
+    that host; listings are merged from all hosts.
+    """
+
+    def __init__(self, uris, config=config_manager.defaults(),
+                 reservation_file=CAPACITY_RESERVATION_FILE):
+        self.config = config
+        self.reservation_file = reservation_file
+        self.hosts = [KvmProvider(uri, config) for uri in uris]
+        self._lock = threading.Lock()
+        self._sites = dict()
+
+    def __find_site(self, site):
+        for host in self.hosts:
+            if host.get_vm_nodes(site) or host.get_networks(site):
+                return host
+
+        return None
+
+    def __reserved_host(self, site, reservations):
+        uri = reservations.get(site, {}).get('uri')
+        for host in self.hosts:
+            if host.uri == uri:
+                return host
+
+        return None
+
+    def __place_site(self, site, reservations):
+        free = list()
+        for index, host in enumerate(self.hosts):
+            left = capacity.free(host, site, self.config, reservations)
+            free.append(((left['ram'], left['vcpus']), index))
+
+        (ram, vcpus), index = max(free)
+        host = self.hosts[index]
+
+        logger.info('Place site %s on %s (%d MB RAM, %d vCPUs free)', site, host.uri, ram, vcpus)
+        return host
+
+    def __locate(self, site, reservations):
+        host = self.__find_site(site) or self.__reserved_host(site, reservations) or \
+               self.__place_site(site, reservations)
+
+        # record the host for the other processes working on the site
+        usage = reservations.get(site)
+        if usage is None:
+            usage = capacity.total([])
+            usage['pid'] = os.getpid()
+            reservations[site] = usage
+        usage['uri'] = host.uri
+
+        return host
+
+    def get_site_provider(self, site, reservations=None):
+        """The host of site. reservations, if given, are the capacity
+        reservations already loaded under their lock; otherwise the lock
+        is taken here, so placing a site never races another process."""
+        with self._lock:
+            host = self._sites.get(site)
+
+            if host is None:
+                if reservations is None:
+                    with capacity.reservations(self.reservation_file) as items:
+                        host = self.__locate(site, items)
+                else:
+                    host = self.__locate(site, reservations)
+                self._sites[site] = host
+
+            return host
+
+    def get_vm_nodes(self, site):
+        name_list = list()
+        for host in self.hosts:
+            name_list.extend(host.get_vm_nodes(site))
+        return name_list
+
+    def get_networks(self, site):
+        name_list = list()
+        for host in self.hosts:
+            name_list.extend(host.get_networks(site))
+        return name_list
+
+    def get_host_capacity(self):
+        total = {'vcpus': 0, 'ram': 0, 'disk': 0, 'disk_available': 0}
+        for host in self.hosts:
+            for key, value in host.get_host_capacity().items():
+                total[key] += value
+        return total
+
+    def get_site_allocations(self):
+        allocations = dict()
+        for host in self.hosts:
+            allocations.update(host.get_site_allocations())
+        return allocations
+
+    def get_attached_media(self):
+        paths = set()
+        for host in self.hosts:
+            paths.update(host.get_attached_media())
+        return paths
+
+    def clean_site(self, site):
+        for host in self.hosts:
+            if host.get_vm_nodes(site) or host.get_networks(site):
+                host.clean_site(site)
+
+    def clean_all_sites(self):
+        for host in self.hosts:
+            host.clean_all_sites()
+
+    def clean_all_vm_nodes(self):
+        for host in self.hosts:
+            host.clean_all_vm_nodes()
+
+    def clean_all_networks(self):
+        for host in self.hosts:
+            host.clean_all_networks()
+
+
+def _site_method(name):
+    def method(self, site, *args, **kwargs):
+        return getattr(self.get_site_provider(site), name)(site, *args, **kwargs)
+
+    method.__name__ = name
+    method.__doc__ = getattr(KvmProvider, name).__doc__
+    return method
+
+for _name in SITE_METHODS:
+    setattr(MultiHostProvider, _name, _site_method(_name))
@@ -24,12 +24,19 @@ import yaml
 from fabric.api import *
 
 from fuelbench import utils
+from fuelbench import trace
+from fuelbench import ssh
 from fuelbench.error import *
 
 
 logger = logging.getLogger(__name__)
 
+BOOTSTRAP_LOG = '/var/log/puppet/bootstrap_admin_node.log'
+BOOTSTRAP_COMPLETE = r'^Fuel.*complete.*'
+REIP_DONE = '/root/reip-fuel-master.done'
+
 @task
+@trace.traced(cat='ssh')
 def get_all_fuel_nodes():
     nodes = dict()
     
@@ -76,6 +83,7 @@ def get_all_fuel_nodes():
     return nodes.values()
 
 @task
+@trace.traced(cat='ssh')
 def create_fuel_env(name, release, mode, network):
     cmdline = "fuel env create --name '{name}' --rel {release} --mode {mode}".format(name=name,
                                                                                      release=release,
@@ -175,6 +183,7 @@ def setup_node_provisioning(cfg, admin_gw):
 
 
 @task
+@trace.traced(cat='ssh')
 def configure_fuel_env(id, workdir, public_vip, floating_ranges, public_cidr, public_gateway, public_ranges, upstream_dns):
     
     run("mkdir -p ~/fuelbench")
@@ -250,6 +259,7 @@ def configure_fuel_env(id, workdir, public_vip, floating_ranges, public_cidr, pu
         
     
 @task
+@trace.traced(cat='ssh')
 def get_all_fuel_env():
     env_list = dict()
     
@@ -290,6 +300,7 @@ def get_all_fuel_env():
     return env_list.values()
 
 @task
+@trace.traced(cat='ssh')
 def set_fuel_node_roles(env_id, node_ids, node_roles):
     cmdline = "fuel --env {end_id} node set --node {node_ids} --role {roles}".format(end_id=env_id,
                                                                                      node_ids=','.join(map(str, node_ids)),
@@ -300,85 +311,125 @@ def set_fuel_node_roles(env_id, node_ids, node_roles):
     logger.debug('Result: %s', result)
 
 
+def parse_node_network_paths(result):
+    paths = list()
+    path_found = False
+
+    for line in StringIO.StringIO(result).readlines():
+        if path_found:
+            if line.strip():
+                paths.append(line.strip())
+            continue
+
+        if re.search(r'^Node attributes for interfaces were written to', line):
+            path_found = True
+
+    return paths
+
+def parse_node_provisioning_dir(result):
+    for line in StringIO.StringIO(result).readlines():
+        match = re.search(r'^Default provisioning info .*downloaded to\s+(.+)', line)
+        if match:
+            return match.group(1).strip()
+
+    return None
+
 @task
-def configure_fuel_node(node_id, workdir, env_id, admin_gw):
-    
+@trace.traced(cat='ssh')
+def configure_fuel_nodes(node_ids, env_id, admin_gw):
+    """Configure interfaces and provisioning of many nodes at once.
+
+    Both configurations are downloaded for all nodes with one fuel call
+    each, fetched as a single tarball, rewritten in memory and sent back
+    the same way, so the number of round-trips does not depend on the
+    number of nodes.
+    """
+    node_list = ','.join(map(str, node_ids))
+
     run("mkdir -p ~/fuelbench")
-    
+
     with cd('~/fuelbench'):
-        # node network configuration
-        cmdline = "fuel node --node-id {node_id} --network --download".format(node_id=node_id)
-        logger.debug('Run: %s', cmdline)    
+        cmdline = "fuel node --node-id {node_ids} --network --download".format(node_ids=node_list)
+        logger.debug('Run: %s', cmdline)
         result = run(cmdline)
         logger.debug('Result: %s', result)
-        
-        buf = StringIO.StringIO(result)
-        path_found = False
-        
-        for line in buf.readlines():
-            if path_found:
-                remote_path = line.strip()
-            
-            if re.search(r'^Node attributes for interfaces were written to', line):
-                path_found = True
-                continue
-            
-        if not path_found:
-            raise RemoteTaskError('Node network configuration file not found')
 
-        filelist = get(remote_path, workdir)        
-        if len(filelist) != 1:
-            raise RemoteTaskError('Failed to get {0}'.format(remote_path))
-        
-        local_path = filelist[0]
-        network_cfg = utils.modify_yamlfile(local_path, setup_node_network)
-        logger.debug('Saving %s: ', local_path)
-        logger.debug(network_cfg)
-        
-        put(local_path, remote_path)
-        
-        cmdline = "fuel node --node-id {node_id} --network --upload".format(node_id=node_id)
-        logger.debug('Run: %s', cmdline)    
-        result = run(cmdline)
-        logger.debug('Result: %s', result)
-        
-        # node provisioning configuration
-        cmdline = "fuel --env {env_id} provisioning --default --node {node_id}".format(env_id=env_id,
-                                                                                       node_id=node_id)
-        logger.debug('Run: %s', cmdline)    
+        network_paths = parse_node_network_paths(result)
+        if len(network_paths) != len(node_ids):
+            raise RemoteTaskError('Node network configuration files not found')
+
+        cmdline = "fuel --env {env_id} provisioning --default --node {node_ids}".format(env_id=env_id,
+                                                                                        node_ids=node_list)
+        logger.debug('Run: %s', cmdline)
         result = run(cmdline)
         logger.debug('Result: %s', result)
-        
-        buf = StringIO.StringIO(result)
-        match = None
-        
-        for line in buf.readlines():
-            match = re.search(r'^Default provisioning info .*downloaded to\s+(.+)', line)
-            if match:
-                remote_dir = match.group(1).strip()
-                remote_path = os.path.join(remote_dir, 'node-{0}.yaml'.format(node_id))
-                break
-            
-        if not match:
+
+        remote_dir = parse_node_provisioning_dir(result)
+        if remote_dir is None:
             raise RemoteTaskError('Node provisioning configuration file not found')
 
-        filelist = get(remote_path, workdir)        
-        if len(filelist) != 1:
-            raise RemoteTaskError('Failed to get {0}'.format(remote_path))
-        
-        local_path = filelist[0]
-        network_cfg = utils.modify_yamlfile(local_path, setup_node_provisioning, admin_gw)
-        logger.debug('Saving %s: ', local_path)
-        logger.debug(network_cfg)
-        
-        put(local_path, remote_path)
-        
-        cmdline = "fuel --env {env_id} provisioning --upload".format(env_id=env_id)
-        logger.debug('Run: %s', cmdline)    
+        provisioning_paths = [os.path.join(remote_dir, 'node-{0}.yaml'.format(node_id))
+                              for node_id in node_ids]
+
+        # fabric expands ~ before it applies cd(), so get and put need
+        # the full path
+        bundle = '~/fuelbench/nodes-{0}.tar.gz'.format(env_id)
+        members = [path.lstrip('/') for path in network_paths + provisioning_paths]
+
+        cmdline = "tar -C / -czf {bundle} {members}".format(bundle=bundle, members=' '.join(members))
+        logger.debug('Run: %s', cmdline)
+        run(cmdline)
+
+        buf = StringIO.StringIO()
+        get(bundle, buf)
+
+        network_members = set(path.lstrip('/') for path in network_paths)
+        transforms = dict()
+        for name in members:
+            if name in network_members:
+                transforms[name] = (setup_node_network, ())
+            else:
+                transforms[name] = (setup_node_provisioning, (admin_gw,))
+
+        buf = utils.transform_yaml_tarball(buf, transforms)
+
+        put(buf, bundle)
+
+        cmdline = ("tar -C / -xzf {bundle}"
+                   " && fuel node --node-id {node_ids} --network --upload"
+                   " && fuel --env {env_id} provisioning --upload").format(bundle=bundle,
+                                                                           node_ids=node_list,
+                                                                           env_id=env_id)
+        logger.debug('Run: %s', cmdline)
         result = run(cmdline)
         logger.debug('Result: %s', result)
 
 @task
+@trace.traced(cat='ssh')
+def configure_fuel_node(node_id, env_id, admin_gw):
+    configure_fuel_nodes([node_id], env_id, admin_gw)
+
+@task
+@trace.traced(cat='ssh')
+def provision_fuel_nodes(env_id, node_ids):
+    cmdline = "fuel --env {env_id} node --provision --node {node_ids}".format(env_id=env_id,
+                                                                              node_ids=','.join(map(str, node_ids)))
+    logger.debug('Run: %s', cmdline)
+    
+    result = run(cmdline)
+    logger.debug('Result: %s', result)
+
+@task
+@trace.traced(cat='ssh')
+def deploy_fuel_nodes(env_id, node_ids):
+    cmdline = "fuel --env {env_id} node --deploy --node {node_ids}".format(env_id=env_id,
+                                                                           node_ids=','.join(map(str, node_ids)))
+    logger.debug('Run: %s', cmdline)
+    
+    run(cmdline)
+
+@task
+@trace.traced(cat='ssh')
 def fuel_deploy_changes(env_id):
     cmdline = "fuel --env {env_id} deploy-changes".format(env_id=env_id)
     logger.debug('Run: %s', cmdline)
@@ -386,6 +437,7 @@ def fuel_deploy_changes(env_id):
     run(cmdline)
    
 @task
+@trace.traced(cat='ssh')
 def get_fuel_version():
     cmdline = "awk -F': ' '/release/ {print $2}' /etc/fuel/version.yaml | sed -e 's/^[\"]*//' | sed -e 's/[\"]*$//'"
     logger.debug('Run: %s', cmdline)
@@ -399,8 +451,9 @@ def get_fuel_version():
     return line.strip()
     
 @task
+@trace.traced(cat='ssh')
 def check_vm_operational():
-    cmdline = "grep 'Fuel node deployment' /var/log/puppet/bootstrap_admin_node.log"
+    cmdline = "grep 'Fuel node deployment' {0}".format(BOOTSTRAP_LOG)
     
     logger.debug('Run: %s', cmdline)
     
@@ -410,12 +463,41 @@ def check_vm_operational():
     buf = StringIO.StringIO(result)
     
     for line in buf.readlines():
-        if re.search(r'^Fuel.*complete.*', line):
+        if re.search(BOOTSTRAP_COMPLETE, line):
             return True
     
     return False
 
 @task
+@trace.traced(cat='ssh')
+def watch_bootstrap_log(timeout=None, progress=None):
+    """Wait for the end of the master's bootstrap by following its log.
+
+    Returns True once the completion line is written, False on timeout or
+    when the connection drops.
+    """
+    logger.debug('Follow: %s', BOOTSTRAP_LOG)
+    
+    line = ssh.follow(BOOTSTRAP_LOG, BOOTSTRAP_COMPLETE, progress=progress, timeout=timeout)
+    logger.debug('Result: %s', line)
+    
+    return line is not None
+
+@task
+@trace.traced(cat='ssh')
+def get_master_reip_prefix():
+    """Admin prefix a cloned master has moved to, or None while its first
+    boot re-addressing, including Nailgun's admin network, is not done."""
+    cmdline = "cat {0} 2>/dev/null || true".format(REIP_DONE)
+    logger.debug('Run: %s', cmdline)
+    
+    result = run(cmdline)
+    logger.debug('Result: %s', result)
+    
+    return result.strip() or None
+
+@task
+@trace.traced(cat='ssh')
 def power_off():
     cmdline = "poweroff"
     logger.debug('Run: %s', cmdline)
@@ -423,6 +505,7 @@ def power_off():
     sudo(cmdline)
 
 @task
+@trace.traced(cat='ssh')
 def run_remote_script(local_script, args):
     
     filelist = put(local_script, '~/')       
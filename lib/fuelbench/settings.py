@@ -35,12 +35,20 @@ LOG_DIR = os.path.join(DATA_DIR, 'log')
 IMAGE_DIR = os.path.join(DATA_DIR, 'iso')
 TEMP_DIR = os.path.join(DATA_DIR, 'tmp')
 SITE_DIR = os.path.join(DATA_DIR, 'sites')
+TEMPLATE_DIR = os.path.join(DATA_DIR, 'templates')
+TRACE_DIR = os.path.join(DATA_DIR, 'traces')
+METRICS_DIR = os.path.join(DATA_DIR, 'metrics')
+CAPACITY_RESERVATION_FILE = os.path.join(DATA_DIR, 'capacity.json')
+ISO_CACHE_DIR = os.path.join(IMAGE_DIR, 'cache')
 
 MAKE_ISO_SCRIPT = os.path.join(SCRIPTS_DIR, 'make-custom-iso.sh')
+REMASTER_ISO_SCRIPT = os.path.join(SCRIPTS_DIR, 'remaster-iso.sh')
 WAIT_FOR_PRODUCT_SCRIPT = os.path.join(SCRIPTS_DIR, 'wait-for-product-vm.sh')
 RUN_REMOTE_SCRIPT = os.path.join(SCRIPTS_DIR, 'run-remote-script.sh')
 ENABLE_VM_NETWORK_SCRIPT = os.path.join(GUEST_DIR, 'enable-vm-outbound-network.sh')
 SETUP_FUEL_SCRIPT = os.path.join(GUEST_DIR, 'setup-fuel-master.sh')
+REIP_MASTER_SCRIPT = os.path.join(GUEST_DIR, 'reip-fuel-master.sh')
+REIDENTIFY_SLAVE_SCRIPT = os.path.join(GUEST_DIR, 'reidentify-fuel-slave.sh')
 
 CONFIG_FILE = os.path.join(CONF_DIR, 'fuelbench.yaml')
 CONSOLE_LOG = os.path.join(LOG_DIR, 'console.log')
@@ -51,6 +59,10 @@ FUEL_VERSION_FILE = 'version.yaml'
 MAX_SITE_ID = 99
 SITE_LIMIT = 10
 NODE_LIMIT = 10	
+CPU_OVERCOMMIT = 4.0
+RAM_OVERCOMMIT = 1.0
+DISK_OVERCOMMIT = 2.0
+HOST_RESERVED_RAM = 2048
 	
 NETWORK_NAT = 'nat'
 NETWORK_ISOLATED = 'isolated'
@@ -59,6 +71,25 @@ ADMIN_NETWORK_IP = '10.20.{0}.{1}'
 PUBLIC_NETWORK_IP = '172.16.{0}.{1}'
 
 VM_INSTALL_WAIT = 45
+ISO_CACHE_SIZE = 20
+TEARDOWN_WORKERS = 16
+# local hypervisors only: masters' ISOs and disks are accessed by path and
+# their admin networks are NAT networks on the hypervisor itself
+LIBVIRT_URIS = ['qemu:///system']
+LIBVIRT_KEEPALIVE_INTERVAL = 5
+LIBVIRT_KEEPALIVE_COUNT = 3
+SLAVE_CREATE_WORKERS = 8
+PXE_BOOT_CONCURRENCY = 4
+PXE_BOOT_INTERVAL = 5
+PXE_BOOT_WINDOW = 60
+SSH_KEEPALIVE = 15
+SSH_TIMEOUT = 10
+MASTER_SSH_ADDRESS = None
+FUEL_TRANSPORT = 'cli'
+NAILGUN_PORT = 8000
+KEYSTONE_PORT = 5000
+NAILGUN_TIMEOUT = 30
+METRICS_PORT = 0
 STORAGE_POOL = 'default'
 SEARCH_DOMAIN = 'lenovo.com'
 
@@ -66,10 +97,14 @@ MASTER_NAME = 'master'
 MASTER_HOSTNAME = 'fuel.localdomain'
 MASTER_USER = 'root'
 MASTER_PASS = 'r00tme'
+FUEL_USER = 'admin'
+FUEL_PASS = 'admin'
 MASTER_PROMPT = 'root@fuel ~]#'
 MASTER_CPU = 2
 MASTER_RAM = 4096
 MASTER_DISK = 80
+MASTER_TEMPLATE = 'fuel-master-{0}.qcow2'
+SLAVE_TEMPLATE = 'fuel-slave-{0}-{1}-{2}-site{3}.qcow2'
 
 DEFAULT_CONTROLLER = 1
 DEFAULT_COMPUTE = 2
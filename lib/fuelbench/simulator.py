@@ -0,0 +1,1116 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+"""Simulated Fuel master for load testing.
+
+FuelMasterSimulator serves SSH and SFTP on a local port and interprets
+the commands remote_tasks sends: the fuel CLI calls, tar, the bootstrap
+log check and the version lookup. Files live under a private root
+directory. Nodes are discovered at a configurable rate, and every
+operation can be given a latency and a failure rate, so discovery and
+configuration can be stressed with hundreds of nodes and no VMs.
+
+Point fuelbench at it with the master_ssh_address option, e.g.
+127.0.0.1:2222.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import time
+import shlex
+import shutil
+import random
+import socket
+import tarfile
+import argparse
+import tempfile
+import posixpath
+import threading
+import logging
+import yaml
+import paramiko
+
+from fuelbench.settings import *
+
+logger = logging.getLogger(__name__)
+
+HOME = '/root'
+BOOTSTRAP_LOG = '/var/log/puppet/bootstrap_admin_node.log'
+VERSION_FILE = '/etc/fuel/version.yaml'
+BOOTSTRAP_COMPLETE = 'Fuel node deployment complete!'
+
+# operations that can be given a latency or a failure rate; '*' is the
+# round-trip latency added to every command
+OPERATIONS = ('env-list', 'env-create', 'network-download', 'network-upload',
+              'settings-download', 'settings-upload', 'node-list', 'node-set',
+              'node-network-download', 'node-network-upload', 'provisioning-download',
+              'provisioning-upload', 'node-provision', 'node-deploy', 'deploy-changes',
+              'bootstrap-log', 'version', 'tar', 'script', 'poweroff')
+
+NODE_COLUMNS = ('id', 'status', 'name', 'cluster', 'ip', 'mac', 'roles',
+                'pending_roles', 'online', 'group_id')
+ENV_COLUMNS = ('id', 'status', 'name', 'mode', 'release_id', 'changes',
+               'pending_release_id')
+
+# status a node reaches after its last stage
+FINAL_STATUS = {'provisioning': 'provisioned',
+                'deploying': 'ready'}
+
+
+class CommandError(Exception):
+    """A simulated command failed with status and message."""
+
+    def __init__(self, message, status=1):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def format_table(columns, rows):
+    """Format rows like the fuel CLI, which remote_tasks parses."""
+    rows = [[str(value) for value in row] for row in rows]
+    widths = [max([len(column)] + [len(row[i]) for row in rows]) for i, column in enumerate(columns)]
+
+    lines = [' | '.join(column.ljust(width) for column, width in zip(columns, widths)),
+             '|'.join('-' * (width + 2) for width in widths)]
+    for row in rows:
+        lines.append(' | '.join(value.ljust(width) for value, width in zip(row, widths)))
+
+    return '\n'.join(lines) + '\n'
+
+
+def parse_ids(value):
+    return [int(id) for id in value.split(',') if id.strip()]
+
+
+class FuelMaster(object):
+    """State of the simulated master: nodes, environments and files.
+
+    Node states advance with time: discovery starts boot_time seconds
+    after start and runs at discovery_rate nodes per second (0 means all
+    at once). Provisioning and deployment take provision_time and
+    deploy_time, and each node fails a stage with node_error_rate.
+    latencies and failures map OPERATIONS to seconds and probabilities.
+    """
+
+    def __init__(self, root_dir, fuel_version='7.0', nodes=0, discovery_rate=0,
+                 boot_time=0, provision_time=5, deploy_time=10,
+                 latencies=None, failures=None, node_error_rate=0,
+                 admin_network_ip=ADMIN_NETWORK_IP, seed=None):
+        self.root_dir = root_dir
+        self.fuel_version = fuel_version
+        self.pool_size = nodes
+        self.discovery_rate = discovery_rate
+        self.boot_time = boot_time
+        self.provision_time = provision_time
+        self.deploy_time = deploy_time
+        self.latencies = dict(latencies or {})
+        self.failures = dict(failures or {})
+        self.node_error_rate = node_error_rate
+        self.admin_network_ip = admin_network_ip
+
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.ready_at = time.time() + boot_time
+        self.nodes = dict()
+        self.envs = dict()
+        self.transitions = dict()
+        self.discovered = 0
+        self.power_off_callbacks = list()
+
+        self.write_file(VERSION_FILE, 'VERSION:\n  release: "{0}"\n'.format(fuel_version))
+        self.write_file(BOOTSTRAP_LOG, 'Starting Fuel node deployment\n')
+
+        self.booted = threading.Event()
+        timer = threading.Timer(boot_time, self.__boot_complete)
+        timer.daemon = True
+        timer.start()
+
+    def __boot_complete(self):
+        with open(self.local_path(BOOTSTRAP_LOG), 'a') as fp:
+            fp.write(BOOTSTRAP_COMPLETE + '\n')
+        self.booted.set()
+
+    def local_path(self, path):
+        return os.path.join(self.root_dir, posixpath.normpath(path).lstrip('/'))
+
+    def write_file(self, path, data):
+        local_path = self.local_path(path)
+        directory = os.path.dirname(local_path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        with open(local_path, 'w') as fp:
+            fp.write(data)
+
+    def read_yaml(self, path):
+        try:
+            with open(self.local_path(path), 'r') as fp:
+                return yaml.safe_load(fp)
+        except IOError:
+            raise CommandError('File {0} not found'.format(path))
+        except yaml.YAMLError as e:
+            raise CommandError('Invalid YAML in {0}: {1}'.format(path, e))
+
+    def latency(self, op):
+        return self.latencies.get(op, 0)
+
+    def should_fail(self, op):
+        rate = self.failures.get(op, 0)
+        return rate > 0 and self.random.random() < rate
+
+    def add_node(self, mac=None):
+        """Make a node show up in discover state, e.g. when a VM boots."""
+        with self.lock:
+            id = len(self.nodes) + 1
+            if mac is None:
+                mac = '52:54:00:ff:{0:02x}:{1:02x}'.format((id >> 8) & 0xff, id & 0xff)
+
+            self.nodes[id] = {'id': id,
+                              'status': 'discover',
+                              'name': 'Untitled ({0})'.format(mac[-5:]),
+                              'cluster': None,
+                              'ip': self.admin_network_ip.format(0, 2 + id),
+                              'mac': mac,
+                              'roles': [],
+                              'pending_roles': [],
+                              'online': True,
+                              'group_id': None}
+            return self.nodes[id]
+
+    def advance(self):
+        """Apply discoveries and node transitions that are due."""
+        now = time.time()
+
+        with self.lock:
+            if now >= self.ready_at and self.discovered < self.pool_size:
+                if self.discovery_rate > 0:
+                    due = min(self.pool_size, int((now - self.ready_at) * self.discovery_rate) + 1)
+                else:
+                    due = self.pool_size
+
+                while self.discovered < due:
+                    self.add_node()
+                    self.discovered += 1
+
+            for id, steps in self.transitions.items():
+                while steps and steps[0][0] <= now:
+                    at, status = steps.pop(0)
+                    node = self.nodes[id]
+                    node['status'] = status
+                    if status == 'ready':
+                        node['roles'] = node['roles'] + node['pending_roles']
+                        node['pending_roles'] = []
+                if not steps:
+                    del self.transitions[id]
+
+    def schedule(self, nodes, stages):
+        """Move nodes through stages, a list of (status, seconds) run one
+        after the other; a failing stage leaves the node in error.
+        Returns the time the last node finishes."""
+        now = time.time()
+        finish = now
+
+        with self.lock:
+            for node in nodes:
+                at = now
+                steps = list()
+                for status, seconds in stages:
+                    steps.append((at, status))
+                    at += seconds
+                    if self.node_error_rate > 0 and self.random.random() < self.node_error_rate:
+                        steps.append((at, 'error'))
+                        break
+                else:
+                    steps.append((at, FINAL_STATUS[stages[-1][0]]))
+
+                self.transitions[node['id']] = steps
+                finish = max(finish, at)
+
+        return finish
+
+    def get_env(self, env_id):
+        if env_id not in self.envs:
+            raise CommandError('404 Client Error: Not Found (environment {0})'.format(env_id))
+        return self.envs[env_id]
+
+    def get_nodes(self, node_ids, env_id=None):
+        nodes = list()
+        for id in node_ids:
+            node = self.nodes.get(id)
+            if node is None:
+                raise CommandError('404 Client Error: Not Found (node {0})'.format(id))
+            if env_id is not None and node['cluster'] != env_id:
+                raise CommandError('Node {0} is not in environment {1}'.format(id, env_id))
+            nodes.append(node)
+        return nodes
+
+    def create_env(self, name, release_id, mode):
+        with self.lock:
+            id = len(self.envs) + 1
+            self.envs[id] = {'id': id,
+                             'status': 'new',
+                             'name': name,
+                             'mode': mode,
+                             'release_id': release_id,
+                             'changes': [],
+                             'pending_release_id': None}
+            return self.envs[id]
+
+    def power_off(self):
+        for callback in self.power_off_callbacks:
+            callback()
+
+
+class FuelShell(object):
+    """Runs one command line sent over SSH against a FuelMaster.
+
+    Only what remote_tasks uses is understood: && lists and | pipelines
+    of cd, mkdir, rm, echo, cat, grep, awk, sed, tail, tar, sh, poweroff
+    and fuel. Fabric's bash -c and sudo wrappers are unwrapped first.
+    With a channel, tail -F streams to it until the channel closes.
+    """
+
+    def __init__(self, master, channel=None):
+        self.master = master
+        self.channel = channel
+        self.cwd = HOME
+
+    def path(self, path):
+        if path == '~' or path.startswith('~/'):
+            path = HOME + path[1:]
+        return posixpath.normpath(posixpath.join(self.cwd, path))
+
+    def local(self, path):
+        return self.master.local_path(self.path(path))
+
+    def op(self, name):
+        """Apply the latency and failure injection of an operation."""
+        delay = self.master.latency(name)
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.master.should_fail(name):
+            raise CommandError('500 Server Error: Internal Server Error ({0} failure injected)'.format(name))
+
+    def run(self, command):
+        """Return (output, exit status) of command."""
+        delay = self.master.latency('*')
+        if delay > 0:
+            time.sleep(delay)
+
+        try:
+            tokens = self.unwrap(shlex.split(command))
+        except ValueError as e:
+            return 'bash: syntax error: {0}\n'.format(e), 2
+
+        output = ''
+        status = 0
+
+        for pipeline in self.split(tokens, '&&'):
+            result = ''
+            for args in self.split(pipeline, '|'):
+                try:
+                    result, status = self.call(args, result), 0
+                except CommandError as e:
+                    result, status = '{0}\n'.format(e), e.status
+            output += result
+            if status != 0:
+                break
+
+        return output, status
+
+    def unwrap(self, tokens):
+        while tokens:
+            if tokens[0] == 'sudo':
+                tokens = tokens[1:]
+                while tokens and tokens[0].startswith('-'):
+                    option = tokens.pop(0)
+                    if option in ('-p', '-u', '-g'):
+                        tokens.pop(0)
+            elif tokens[0] in ('/bin/bash', 'bash', '/bin/sh') and '-c' in tokens:
+                # fabric escapes these inside its double quotes
+                inner = tokens[tokens.index('-c') + 1]
+                tokens = shlex.split(inner.replace('\\$', '$').replace('\\`', '`'))
+            else:
+                break
+
+        return tokens
+
+    def split(self, tokens, separator):
+        parts = [[]]
+        for token in tokens:
+            if token == separator:
+                parts.append([])
+            else:
+                parts[-1].append(token)
+        return [part for part in parts if part]
+
+    def call(self, args, stdin):
+        name = args[0]
+        handler = getattr(self, 'do_' + name.replace('-', '_'), None)
+        if handler is None:
+            raise CommandError('bash: {0}: command not found'.format(name), 127)
+
+        self.master.advance()
+        return handler(args[1:], stdin)
+
+    def read_input(self, files, stdin):
+        if not files:
+            return stdin
+
+        data = ''
+        for name in files:
+            try:
+                with open(self.local(name), 'r') as fp:
+                    data += fp.read()
+            except IOError:
+                raise CommandError('{0}: No such file or directory'.format(name), 2)
+        return data
+
+    def do_cd(self, args, stdin):
+        path = self.path(args[0] if args else HOME)
+        if not os.path.isdir(self.master.local_path(path)):
+            raise CommandError('bash: cd: {0}: No such file or directory'.format(args[0]))
+        self.cwd = path
+        return ''
+
+    def do_mkdir(self, args, stdin):
+        for name in args:
+            if name.startswith('-'):
+                continue
+            local_path = self.local(name)
+            if not os.path.isdir(local_path):
+                os.makedirs(local_path)
+        return ''
+
+    def do_rm(self, args, stdin):
+        for name in args:
+            if name.startswith('-'):
+                continue
+            local_path = self.local(name)
+            if os.path.isdir(local_path):
+                shutil.rmtree(local_path)
+            elif os.path.exists(local_path):
+                os.remove(local_path)
+        return ''
+
+    def do_echo(self, args, stdin):
+        return ' '.join(self.path(arg) if arg.startswith('~') else arg for arg in args) + '\n'
+
+    def do_cat(self, args, stdin):
+        return self.read_input(args, stdin)
+
+    def do_grep(self, args, stdin):
+        args = [arg for arg in args if not arg.startswith('-')]
+        pattern, files = args[0], args[1:]
+
+        if files and self.path(files[0]) == BOOTSTRAP_LOG:
+            self.op('bootstrap-log')
+
+        lines = [line for line in self.read_input(files, stdin).splitlines(True) if re.search(pattern, line)]
+        if not lines:
+            raise CommandError('', 1)
+        return ''.join(lines)
+
+    def do_awk(self, args, stdin):
+        separator = None
+        while args and args[0].startswith('-F'):
+            option = args.pop(0)
+            separator = option[2:] or args.pop(0)
+
+        match = re.match(r'^\s*(?:/(.*)/)?\s*\{\s*print\s+\$(\d+)\s*\}\s*$', args[0])
+        if match is None:
+            raise CommandError('awk: unsupported program: {0}'.format(args[0]), 2)
+
+        pattern, field = match.group(1), int(match.group(2))
+        files = args[1:]
+
+        if files and self.path(files[0]) == VERSION_FILE:
+            self.op('version')
+
+        output = ''
+        for line in self.read_input(files, stdin).splitlines():
+            if pattern and not re.search(pattern, line):
+                continue
+            fields = line.split(separator) if separator else line.split()
+            if field == 0:
+                output += line + '\n'
+            else:
+                output += (fields[field - 1] if field <= len(fields) else '') + '\n'
+
+        return output
+
+    def do_sed(self, args, stdin):
+        expressions = list()
+        files = list()
+
+        while args:
+            arg = args.pop(0)
+            if arg == '-e':
+                expressions.append(args.pop(0))
+            elif not expressions:
+                expressions.append(arg)
+            else:
+                files.append(arg)
+
+        subs = list()
+        for expr in expressions:
+            if not expr.startswith('s') or len(expr) < 2:
+                raise CommandError('sed: unsupported expression: {0}'.format(expr), 2)
+            parts = expr[2:].split(expr[1])
+            if len(parts) != 3:
+                raise CommandError('sed: unterminated s command', 2)
+            pattern, replacement, flags = parts
+            subs.append((re.compile(pattern), replacement, 0 if 'g' in flags else 1))
+
+        output = ''
+        for line in self.read_input(files, stdin).splitlines():
+            for pattern, replacement, count in subs:
+                line = pattern.sub(lambda match: replacement, line, count)
+            output += line + '\n'
+
+        return output
+
+    def do_tar(self, args, stdin):
+        self.op('tar')
+
+        directory = self.cwd
+        mode = None
+        archive = None
+        members = list()
+
+        while args:
+            arg = args.pop(0)
+            if arg == '-C':
+                directory = self.path(args.pop(0))
+            elif arg.startswith('-'):
+                mode = 'w:gz' if 'c' in arg else 'r:gz'
+                if 'f' in arg:
+                    archive = self.local(args.pop(0))
+            else:
+                members.append(arg)
+
+        if mode is None or archive is None:
+            raise CommandError('tar: unsupported options', 2)
+
+        base = self.master.local_path(directory)
+
+        if mode == 'w:gz':
+            with tarfile.open(archive, mode) as tar:
+                for name in members:
+                    local_path = os.path.join(base, name)
+                    if not os.path.exists(local_path):
+                        raise CommandError('tar: {0}: Cannot stat: No such file or directory'.format(name), 2)
+                    tar.add(local_path, arcname=name)
+        else:
+            try:
+                with tarfile.open(archive, mode) as tar:
+                    for member in tar.getmembers():
+                        if member.name.startswith('/') or '..' in member.name.split('/'):
+                            raise CommandError('tar: unsafe member {0}'.format(member.name), 2)
+                    tar.extractall(base)
+            except (IOError, tarfile.TarError) as e:
+                raise CommandError('tar: {0}'.format(e), 2)
+
+        return ''
+
+    def do_tail(self, args, stdin):
+        follow = False
+        start = None
+        files = list()
+
+        while args:
+            arg = args.pop(0)
+            if arg in ('-F', '-f'):
+                follow = True
+            elif arg == '-n':
+                count = args.pop(0)
+                if not count.startswith('+'):
+                    raise CommandError('tail: only -n +N is supported', 2)
+                start = int(count[1:]) - 1
+            else:
+                files.append(arg)
+
+        if files and self.path(files[0]) == BOOTSTRAP_LOG:
+            self.op('bootstrap-log')
+
+        if not follow or self.channel is None:
+            return ''.join(self.read_input(files, stdin).splitlines(True)[start or 0:])
+
+        self.follow(self.local(files[0]), start or 0)
+        return ''
+
+    def follow(self, local_path, start):
+        """Send the file from line start on, then whatever is appended,
+        until the channel closes."""
+        offset = None
+
+        while not self.channel.closed:
+            if os.path.exists(local_path):
+                with open(local_path, 'r') as fp:
+                    if offset is None:
+                        data = ''.join(fp.readlines()[start:])
+                    else:
+                        fp.seek(offset)
+                        data = fp.read()
+                    offset = fp.tell()
+
+                if data:
+                    try:
+                        self.channel.sendall(data)
+                    except (socket.error, EOFError, paramiko.SSHException):
+                        return
+
+            time.sleep(0.1)
+
+    def do_sh(self, args, stdin):
+        self.op('script')
+
+        if not os.path.isfile(self.local(args[0])):
+            raise CommandError("sh: 0: Can't open {0}".format(args[0]), 2)
+        return ''
+
+    def do_poweroff(self, args, stdin):
+        self.op('poweroff')
+
+        # let the reply go out before the connections drop
+        timer = threading.Timer(0.5, self.master.power_off)
+        timer.daemon = True
+        timer.start()
+        return ''
+
+    def do_fuel(self, args, stdin):
+        if not self.master.booted.is_set():
+            raise CommandError('Could not connect to Nailgun: Connection refused')
+
+        words = list()
+        options = dict()
+        flags = set()
+        valued = ('--env', '--env-id', '--node', '--node-id', '--role', '--name',
+                  '--rel', '--release', '--mode', '--net', '--nst', '--dir')
+
+        while args:
+            arg = args.pop(0)
+            if arg in valued:
+                options[arg.lstrip('-').replace('-id', '')] = args.pop(0)
+            elif arg.startswith('--'):
+                flags.add(arg[2:])
+            else:
+                words.append(arg)
+
+        env_id = int(options['env']) if 'env' in options else None
+        node_ids = parse_ids(options['node']) if 'node' in options else None
+        master = self.master
+
+        with master.lock:
+            if 'deploy-changes' in words:
+                return self.fuel_deploy_changes(env_id)
+            elif 'env' in words and 'create' in words:
+                self.op('env-create')
+                env = master.create_env(options['name'], int(options.get('rel', options.get('release', 0))),
+                                        options.get('mode', 'ha_compact'))
+                return "Environment '{0}' with id={1}, mode={2} and network-mode={3} was created!\n".format(
+                    env['name'], env['id'], env['mode'], options.get('net', 'nova'))
+            elif 'env' in words:
+                self.op('env-list')
+                rows = [[env[column] for column in ENV_COLUMNS] for id, env in sorted(master.envs.items())]
+                return format_table(ENV_COLUMNS, rows)
+            elif 'provisioning' in words:
+                return self.fuel_provisioning(env_id, node_ids, flags)
+            elif 'network' in words and 'node' not in words:
+                return self.fuel_env_file('network', env_id, flags)
+            elif 'settings' in words:
+                return self.fuel_env_file('settings', env_id, flags)
+            elif 'node' in words:
+                return self.fuel_node(env_id, node_ids, words, options, flags)
+
+        raise CommandError('fuel: unsupported command: {0}'.format(' '.join(words)), 2)
+
+    def fuel_env_file(self, kind, env_id, flags):
+        env = self.master.get_env(env_id)
+        path = self.path('{0}_{1}.yaml'.format(kind, env_id))
+        title = 'Network' if kind == 'network' else 'Settings'
+
+        if 'download' in flags:
+            self.op(kind + '-download')
+            if kind == 'network':
+                data = {'public_vip': None,
+                        'networking_parameters': {'floating_ranges': [['172.16.0.130', '172.16.0.254']]},
+                        'networks': [{'name': name, 'cidr': None, 'gateway': None, 'ip_ranges': [], 'meta': {}}
+                                     for name in ('public', 'management', 'storage', 'fuelweb_admin')]}
+            else:
+                data = {'editable': {'common': {'libvirt_type': {'value': 'qemu'},
+                                                'debug': {'value': False}},
+                                     'external_dns': {'dns_list': {'value': '8.8.8.8'}}}}
+            self.master.write_file(path, yaml.safe_dump(data, default_flow_style=False))
+            return '{0} configuration for environment with id={1} downloaded to {2}\n'.format(title, env_id, path)
+
+        if 'upload' in flags:
+            self.op(kind + '-upload')
+            env[kind] = self.master.read_yaml(path)
+            return '{0} configuration uploaded.\n'.format(title)
+
+        raise CommandError('fuel: --download or --upload required', 2)
+
+    def fuel_provisioning(self, env_id, node_ids, flags):
+        env = self.master.get_env(env_id)
+        directory = self.path('provisioning_{0}'.format(env_id))
+
+        if 'default' in flags:
+            self.op('provisioning-download')
+            nodes = self.master.get_nodes(node_ids or [], env_id)
+            self.master.write_file(posixpath.join(directory, 'engine.yaml'),
+                                   yaml.safe_dump({'url': 'http://10.20.0.2:80/cobbler_api'}, default_flow_style=False))
+            for node in nodes:
+                data = {'uid': str(node['id']),
+                        'hostname': 'node-{0}'.format(node['id']),
+                        'ks_meta': {'gw': None, 'mco_enable': 1}}
+                self.master.write_file(posixpath.join(directory, 'node-{0}.yaml'.format(node['id'])),
+                                       yaml.safe_dump(data, default_flow_style=False))
+            return 'Default provisioning info for environment with id={0} downloaded to {1}\n'.format(env_id, directory)
+
+        if 'upload' in flags:
+            self.op('provisioning-upload')
+            local_dir = self.master.local_path(directory)
+            if not os.path.isdir(local_dir):
+                raise CommandError('Directory {0} not found'.format(directory))
+            env['provisioning'] = dict((name, self.master.read_yaml(posixpath.join(directory, name)))
+                                       for name in sorted(os.listdir(local_dir)))
+            return 'Provisioning info for environment with id={0} uploaded from {1}\n'.format(env_id, directory)
+
+        raise CommandError('fuel: --default or --upload required', 2)
+
+    def fuel_node(self, env_id, node_ids, words, options, flags):
+        master = self.master
+
+        if 'set' in words:
+            self.op('node-set')
+            master.get_env(env_id)
+            roles = [role for role in options.get('role', '').split(',') if role]
+            for node in master.get_nodes(node_ids):
+                if node['cluster'] not in (None, env_id):
+                    raise CommandError('Node {0} is already in environment {1}'.format(node['id'], node['cluster']))
+                node['cluster'] = env_id
+                node['group_id'] = env_id
+                node['pending_roles'] = roles
+            return 'Nodes {0} with roles {1} were added to environment {2}\n'.format(node_ids, roles, env_id)
+
+        if 'network' in flags:
+            nodes = master.get_nodes(node_ids)
+            paths = [self.path('node_{0}/interfaces.yaml'.format(node['id'])) for node in nodes]
+
+            if 'download' in flags:
+                self.op('node-network-download')
+                for node, path in zip(nodes, paths):
+                    data = [{'name': 'eth0', 'mac': node['mac'],
+                             'assigned_networks': [{'id': 1, 'name': 'fuelweb_admin'},
+                                                   {'id': 2, 'name': 'management'},
+                                                   {'id': 3, 'name': 'storage'}]},
+                            {'name': 'eth1', 'assigned_networks': [{'id': 4, 'name': 'public'}]},
+                            {'name': 'eth2', 'assigned_networks': [{'id': 5, 'name': 'private'}]}]
+                    master.write_file(path, yaml.safe_dump(data, default_flow_style=False))
+                return 'Node attributes for interfaces were written to:\n' + ''.join(path + '\n' for path in paths)
+
+            if 'upload' in flags:
+                self.op('node-network-upload')
+                for node, path in zip(nodes, paths):
+                    node['interfaces'] = master.read_yaml(path)
+                return 'Node attributes for interfaces were uploaded from:\n' + ''.join(path + '\n' for path in paths)
+
+        if 'provision' in flags:
+            self.op('node-provision')
+            nodes = master.get_nodes(node_ids, env_id)
+            master.schedule(nodes, [('provisioning', master.provision_time)])
+            return 'Started provisioning nodes {0}.\n'.format(node_ids)
+
+        if 'deploy' in flags:
+            self.op('node-deploy')
+            nodes = master.get_nodes(node_ids, env_id)
+            master.schedule(nodes, [('deploying', master.deploy_time)])
+            return 'Started deploying nodes {0}.\n'.format(node_ids)
+
+        self.op('node-list')
+        nodes = [node for id, node in sorted(master.nodes.items())
+                 if env_id is None or node['cluster'] == env_id]
+        rows = [[', '.join(node[column]) if isinstance(node[column], list) else node[column]
+                 for column in NODE_COLUMNS] for node in nodes]
+        return format_table(NODE_COLUMNS, rows)
+
+    def fuel_deploy_changes(self, env_id):
+        master = self.master
+        self.op('deploy-changes')
+
+        env = master.get_env(env_id)
+        nodes = [node for node in master.nodes.values()
+                 if node['cluster'] == env_id and node['status'] in ('discover', 'error', 'provisioned')]
+        if not nodes:
+            raise CommandError('400 Client Error: Bad Request (no changes to deploy)')
+
+        stages = [('deploying', master.deploy_time)]
+        if any(node['status'] != 'provisioned' for node in nodes):
+            stages.insert(0, ('provisioning', master.provision_time))
+
+        env['status'] = 'deployment'
+        finish = master.schedule(nodes, stages)
+
+        # the CLI follows the deployment task until it ends
+        master.lock.release()
+        try:
+            time.sleep(max(0, finish - time.time()))
+            master.advance()
+        finally:
+            master.lock.acquire()
+
+        failed = [node['id'] for node in nodes if node['status'] == 'error']
+        if failed:
+            env['status'] = 'error'
+            raise CommandError('Deployment has failed. Nodes {0} are in error state'.format(failed))
+
+        env['status'] = 'operational'
+        return 'Deployment of environment {0} is finished.\n'.format(env_id)
+
+
+class _ServerInterface(paramiko.ServerInterface):
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.requests = dict()
+        self.lock = threading.Lock()
+
+    def request(self, channel):
+        """The pending request of channel: an Event set once the client
+        has asked for a command or a subsystem, and the command."""
+        with self.lock:
+            return self.requests.setdefault(channel.get_id(), [threading.Event(), None])
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if username == self.simulator.user and password == self.simulator.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        # only record the command: paramiko sends the reply after this
+        # returns, and output or close sent before it fail exec_command
+        request = self.request(channel)
+        request[1] = command
+        request[0].set()
+        return True
+
+    def check_channel_subsystem_request(self, channel, name):
+        result = paramiko.ServerInterface.check_channel_subsystem_request(self, channel, name)
+        self.request(channel)[0].set()
+        return result
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+
+class _SFTPServer(paramiko.SFTPServerInterface):
+    """SFTP confined to the root directory of the simulated master."""
+
+    def __init__(self, server, *args, **kwargs):
+        paramiko.SFTPServerInterface.__init__(self, server, *args, **kwargs)
+        self.master = server.simulator.master
+
+    def canonicalize(self, path):
+        return posixpath.normpath(posixpath.join(HOME, path))
+
+    def __local(self, path):
+        return self.master.local_path(self.canonicalize(path))
+
+    def list_folder(self, path):
+        local_path = self.__local(path)
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local_path, name)), name)
+                    for name in os.listdir(local_path)]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.__local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        local_path = self.__local(path)
+        try:
+            fd = os.open(local_path, flags, getattr(attr, 'st_mode', None) or 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+
+        handle = _SFTPHandle(flags)
+        handle.filename = local_path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self.__local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self.__local(oldpath), self.__local(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self.__local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self.__local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def chattr(self, path, attr):
+        return paramiko.SFTP_OK
+
+
+class FuelMasterSimulator(object):
+    """SSH server in front of a FuelMaster. Use port 0 for any free port."""
+
+    def __init__(self, master, addr='127.0.0.1', port=0,
+                 user=MASTER_USER, password=MASTER_PASS, host_key=None):
+        self.master = master
+        self.user = user
+        self.password = password
+        self.host_key = host_key or paramiko.RSAKey.generate(2048)
+        self.commands = 0
+
+        self._lock = threading.Lock()
+        self._transports = list()
+        self._threads = list()
+        self._closed = False
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((addr, port))
+        self._sock.listen(100)
+        self._sock.settimeout(0.5)
+        self.addr, self.port = self._sock.getsockname()
+
+        master.power_off_callbacks.append(self.disconnect_all)
+
+        self._thread = threading.Thread(target=self.__serve, name='fuel-simulator')
+        self._thread.daemon = True
+        self._thread.start()
+
+        logger.info('Fuel master simulator listening on %s:%d', self.addr, self.port)
+
+    @property
+    def address(self):
+        """host:port, the value for the master_ssh_address option."""
+        return '{0}:{1}'.format(self.addr, self.port)
+
+    def __serve(self):
+        while not self._closed:
+            try:
+                conn, peer = self._sock.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+
+            thread = threading.Thread(target=self.__handshake, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+            with self._lock:
+                self._threads.append(thread)
+
+    def __handshake(self, conn):
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler('sftp', paramiko.SFTPServer, _SFTPServer)
+
+        with self._lock:
+            self._transports.append(transport)
+
+        interface = _ServerInterface(self)
+        try:
+            transport.start_server(server=interface)
+        except (paramiko.SSHException, EOFError, socket.error) as e:
+            logger.debug('SSH negotiation failed: %s', e)
+            return
+
+        while transport.is_active():
+            channel = transport.accept(0.2)
+            if channel is None:
+                continue
+
+            thread = threading.Thread(target=self.__run_channel, args=(interface, channel))
+            thread.daemon = True
+            thread.start()
+
+    def __run_channel(self, interface, channel):
+        event, _ = interface.request(channel)
+        while not event.wait(1):
+            if channel.closed:
+                return
+
+        # subsystem channels are served by their handler
+        command = interface.request(channel)[1]
+        if command is not None:
+            self.exec_command(channel, command)
+
+    def exec_command(self, channel, command):
+        with self._lock:
+            self.commands += 1
+
+        logger.debug('Run: %s', command)
+        try:
+            output, status = FuelShell(self.master, channel).run(command)
+        except Exception as e:
+            logger.exception('Command failed: %s', command)
+            output, status = '{0}\n'.format(e), 1
+
+        try:
+            channel.sendall(output)
+            channel.send_exit_status(status)
+            channel.close()
+        except (socket.error, EOFError, paramiko.SSHException) as e:
+            logger.debug('Lost channel: %s', e)
+
+    def disconnect_all(self):
+        with self._lock:
+            transports, self._transports = self._transports, list()
+
+        for transport in transports:
+            transport.close()
+
+    def close(self):
+        self._closed = True
+        self._sock.close()
+        self.disconnect_all()
+
+        self._thread.join()
+        for thread in self._threads:
+            thread.join(1)
+
+
+def parse_op_values(values):
+    """Parse OP=VALUE options into a dict of floats."""
+    result = dict()
+
+    for item in values or []:
+        op, sep, value = item.partition('=')
+        if not sep or (op != '*' and op not in OPERATIONS):
+            raise argparse.ArgumentTypeError('expected OP=VALUE with OP in: * {0}'.format(' '.join(OPERATIONS)))
+        result[op] = float(value)
+
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulated Fuel master reachable over SSH')
+    parser.add_argument('--addr', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--port', type=int, default=2222, help="SSH port to listen on")
+    parser.add_argument('--root', metavar='DIR', help="directory holding the master's files")
+    parser.add_argument('--fuel-version', default='7.0', choices=sorted(FUEL_META_INFO.keys()))
+    parser.add_argument('--nodes', metavar='NUM', type=int, default=0,
+                        help="number of nodes to discover")
+    parser.add_argument('--discovery-rate', metavar='NUM', type=float, default=0,
+                        help="nodes discovered per second, 0 for all at once")
+    parser.add_argument('--boot-time', metavar='SEC', type=float, default=0,
+                        help="seconds until the master reports deployment complete")
+    parser.add_argument('--provision-time', metavar='SEC', type=float, default=5)
+    parser.add_argument('--deploy-time', metavar='SEC', type=float, default=10)
+    parser.add_argument('--latency', metavar='OP=SEC', action='append',
+                        help="latency of an operation, or of every command with *")
+    parser.add_argument('--failure', metavar='OP=RATE', action='append',
+                        help="probability that an operation fails")
+    parser.add_argument('--node-error-rate', metavar='RATE', type=float, default=0,
+                        help="probability that a node fails a provisioning or deployment stage")
+    parser.add_argument('--seed', type=int, help="seed for failure injection")
+    parser.add_argument('--debug', action='store_true')
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        level=logging.DEBUG if args.debug else logging.INFO)
+
+    try:
+        latencies = parse_op_values(args.latency)
+        failures = parse_op_values(args.failure)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    root_dir = args.root or tempfile.mkdtemp(prefix='fuel-simulator.')
+
+    master = FuelMaster(root_dir, fuel_version=args.fuel_version,
+                        nodes=args.nodes, discovery_rate=args.discovery_rate,
+                        boot_time=args.boot_time, provision_time=args.provision_time,
+                        deploy_time=args.deploy_time, latencies=latencies, failures=failures,
+                        node_error_rate=args.node_error_rate, seed=args.seed)
+    simulator = FuelMasterSimulator(master, args.addr, args.port)
+
+    print('Fuel master simulator listening on {0} (files in {1})'.format(simulator.address, root_dir))
+    print("Set master_ssh_address: '{0}' to use it".format(simulator.address))
+    sys.stdout.flush()
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.close()
+
+
+if __name__ == '__main__':
+    main()
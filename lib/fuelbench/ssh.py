@@ -0,0 +1,156 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+import re
+import time
+import socket
+import threading
+import logging
+
+import paramiko
+
+from fabric.state import env, connections
+from fabric.network import normalize_to_string
+from fabric.context_managers import settings as fab_context
+from fabric.context_managers import hide
+
+from fuelbench.error import *
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+
+
+def is_connected(host_string):
+    key = normalize_to_string(host_string)
+
+    with _lock:
+        client = dict.get(connections, key)
+        if client is None:
+            return False
+
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+
+def drop_dead_connection(host_string):
+    """Forget the cached connection to host_string if its transport has
+    died, e.g. after the master rebooted, so Fabric opens a new one on the
+    next command instead of failing on the stale one."""
+    key = normalize_to_string(host_string)
+
+    with _lock:
+        client = dict.get(connections, key)
+        if client is None:
+            return
+
+        transport = client.get_transport()
+        if transport is not None and transport.is_active():
+            return
+
+        logger.info('Dropping dead SSH connection to %s', key)
+        try:
+            client.close()
+        except Exception:
+            pass
+        del connections[key]
+
+
+def disconnect(host_string):
+    key = normalize_to_string(host_string)
+
+    with _lock:
+        client = dict.get(connections, key)
+        if client is not None:
+            client.close()
+            del connections[key]
+
+
+def session(user, password, host, show_output=False, keepalive=0, timeout=10):
+    """Fabric settings for running remote_tasks on host.
+
+    Fabric caches one authenticated transport per host string and opens a
+    new channel on it for each command, so all tasks against the same
+    master share a single SSH session for the life of the process.
+    """
+    host_string = '{0}@{1}'.format(user, host)
+
+    drop_dead_connection(host_string)
+
+    if show_output:
+        hide_groups = ['warnings', 'running', 'user', 'exceptions', 'aborts']
+    else:
+        hide_groups = ['everything', 'aborts']
+
+    return fab_context(hide(*hide_groups),
+                       user=user,
+                       password=password,
+                       hosts=[host_string],
+                       disable_known_hosts=True,
+                       keepalive=keepalive,
+                       timeout=timeout,
+                       abort_exception=RemoteTaskError)
+
+
+def follow(path, pattern, progress=None, timeout=None):
+    """Follow path on the current Fabric host until a line matches pattern.
+
+    The file is streamed with tail -F over one channel of the cached
+    connection and matched line by line as it arrives, so the match is
+    seen as soon as it is written and the file is read only once.
+    progress(line) is called for every line. Returns the matching line,
+    or None on timeout or when the channel closes first, e.g. because
+    the host went down.
+    """
+    regex = re.compile(pattern)
+    deadline = None if timeout is None else time.time() + timeout
+
+    try:
+        transport = connections[env.host_string].get_transport()
+        channel = transport.open_session()
+        channel.settimeout(1.0)
+        channel.exec_command('tail -n +1 -F {0}'.format(path))
+    except (paramiko.SSHException, socket.error) as e:
+        raise RemoteTaskError('Failed to follow {0}: {1}'.format(path, e))
+
+    data = ''
+
+    try:
+        while deadline is None or time.time() < deadline:
+            try:
+                chunk = channel.recv(4096)
+            except socket.timeout:
+                continue
+
+            if not chunk:
+                logger.info('Stopped following %s: channel closed', path)
+                return None
+
+            lines = (data + chunk).split('\n')
+            data = lines.pop()
+
+            for line in lines:
+                if progress is not None:
+                    progress(line)
+                if regex.search(line):
+                    return line
+
+        return None
+    except (paramiko.SSHException, socket.error) as e:
+        logger.info('Stopped following %s: %s', path, e)
+        return None
+    finally:
+        channel.close()
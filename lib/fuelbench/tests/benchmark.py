@@ -0,0 +1,494 @@
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import resource
+import threading
+import collections
+import unittest
+
+try:
+    import libvirt
+except ImportError:
+    libvirt = None
+
+from fabric.api import env
+
+import fuelbench
+from fuelbench import FuelBench
+from fuelbench import config_manager
+from fuelbench import isocache
+from fuelbench import trace
+from fuelbench import utils
+from fuelbench.error import RemoteTaskError
+
+
+# Orchestration overhead of create, restore, deploy and clean, measured
+# against the libvirt test driver and an in-process Fuel master. A run fails
+# when a number grows past its tolerance over the stored baseline, or when
+# an operation has no baseline. Set FUELBENCH_UPDATE_BASELINE=1 to accept
+# the new numbers.
+#
+# The committed baselines hold the call counts only, since wall time and
+# memory depend on the machine. Point FUELBENCH_BASELINE at a file of your
+# own to record and check those as well.
+#
+# A baseline file names the libvirt it was recorded with. The committed
+# counts were recorded with an in-memory stand-in for the test driver, so
+# until they are regenerated against libvirt-python a mismatch skips the
+# benchmark with the numbers instead of failing it.
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     'benchmark-baseline.json')
+BASELINE_FILE = os.environ.get('FUELBENCH_BASELINE', DEFAULT_BASELINE_FILE)
+
+SITE = 1
+SIZES = (1, 10, 50, 200)
+FUEL_VERSION = '7.0'
+
+# metric -> (ratio, slack) over the baseline
+TOLERANCES = {
+    'seconds': (1.5, 1.0),
+    'rss_kb': (1.25, 10240),
+    'libvirt_calls': (1.0, 0),
+    'ssh_calls': (1.0, 0),
+}
+
+COUNT_METRICS = ('libvirt_calls', 'ssh_calls')
+
+RECORDED_WITH = '_recorded_with'
+STAND_IN = 'stand-in'
+
+DOMAIN_XML = """\
+<domain type='test'>
+  <name>{name}</name>
+  <memory unit='MiB'>{ram}</memory>
+  <vcpu>{vcpus}</vcpu>
+  <os>
+    <type arch='x86_64'>hvm</type>
+{boot}
+  </os>
+  <devices>
+{interfaces}
+  </devices>
+</domain>
+"""
+
+INTERFACE_XML = """\
+    <interface type='network'>
+      <mac address='{mac}'/>
+      <source network='{network}'/>
+      <model type='virtio'/>
+    </interface>
+"""
+
+
+def rss_kb():
+    with open('/proc/self/statm', 'r') as fp:
+        pages = int(fp.read().split()[1])
+    return pages * resource.getpagesize() / 1024
+
+
+def make_groups(size):
+    controllers = 1 if size < 10 else 3
+    storage = size // 10
+    return [('controller', controllers), ('compute', size - controllers - storage), ('cinder', storage)]
+
+
+def make_slaves(groups):
+    slaves = list()
+    for role, count in groups:
+        slaves.extend({'role': role, 'slave_cpu': 1, 'slave_ram': 1024, 'slave_disk': 10}
+                      for i in range(count))
+    return slaves
+
+
+if libvirt is not None:
+    from fuelbench.providers import KvmProvider
+
+    class BenchProvider(KvmProvider):
+        """KvmProvider that defines domains itself instead of running
+        virt-install, which cannot reach the in-process test driver.
+        Booting a slave makes the fake master discover it."""
+
+        def __init__(self, uri, config):
+            KvmProvider.__init__(self, uri, config)
+            self.master = None
+            self._lock = threading.Lock()
+            self._next_mac = 0
+            self.macs = dict()
+
+        def __new_mac(self):
+            with self._lock:
+                self._next_mac += 1
+                n = self._next_mac
+            return '52:54:00:{0:02x}:{1:02x}:{2:02x}'.format((n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff)
+
+        def __booted(self, site, name):
+            if self.master is not None and name != self.config['master_name']:
+                self.master.discover(self.macs['site{0}-{1}'.format(site, name)])
+
+        @trace.traced(cat='libvirt')
+        def install_vm_node(self, site, name, vcpus=1, ram=2048, boot='cdrom',
+                            networks=[], macs=None, start=True, **kwargs):
+            vm_name = 'site{0}-{1}'.format(site, name)
+
+            if not macs:
+                macs = [self.__new_mac() for net in networks]
+            self.macs[vm_name] = macs[0] if macs else None
+
+            if boot == 'pxe':
+                boot_xml = "    <boot dev='network'/>\n    <boot dev='hd'/>"
+            else:
+                boot_xml = "    <boot dev='hd'/>"
+
+            xml = DOMAIN_XML.format(name=vm_name, ram=ram, vcpus=vcpus, boot=boot_xml,
+                                    interfaces=''.join(INTERFACE_XML.format(mac=mac, network=net)
+                                                       for mac, net in zip(macs, networks)))
+
+            with self.pool.connect() as conn:
+                dom = conn.defineXML(xml)
+                if start:
+                    dom.create()
+
+            if start:
+                self.__booted(site, name)
+
+            return vm_name
+
+        def start_vm_node(self, site, name):
+            ret = KvmProvider.start_vm_node(self, site, name)
+            self.__booted(site, name)
+            return ret
+
+        def revert_vm_snapshot(self, site, name, snapshot):
+            ret = KvmProvider.revert_vm_snapshot(self, site, name, snapshot)
+            if self.master is not None and name == self.config['master_name']:
+                self.master.reset()
+            return ret
+
+
+class FakeFuelMaster(object):
+    """Answers the remote tasks FuelBench runs on the master, in process.
+
+    It replaces fabric's execute() in the fuelbench module, so nothing goes
+    over SSH, but each task still counts as one 'ssh' span. Nodes appear in
+    'discover' state as soon as their VM boots and deployments finish at
+    once.
+    """
+
+    def __init__(self, provider, site, config, version=FUEL_VERSION):
+        self.provider = provider
+        self.site = site
+        self.config = config
+        self.version = version
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.nodes = dict()
+            self.envs = dict()
+
+    def discover(self, mac):
+        with self.lock:
+            id = len(self.nodes) + 1
+            self.nodes[id] = {'id': id,
+                              'status': 'discover',
+                              'name': 'Untitled ({0})'.format(mac[-5:]),
+                              'cluster': None,
+                              'ip': self.config['admin_network_ip'].format(self.site, 2 + id),
+                              'mac': mac,
+                              'roles': [],
+                              'pending_roles': [],
+                              'online': True,
+                              'group_id': None}
+
+    def execute(self, task, *args, **kwargs):
+        name = getattr(task, 'name', task.__name__)
+        handler = getattr(self, 'do_' + name, None)
+        if handler is None:
+            raise RemoteTaskError('Unsupported task: {0}'.format(name))
+
+        with trace.span(name, cat='ssh'):
+            with self.lock:
+                result = handler(*args, **kwargs)
+
+        return dict((host, result) for host in env.hosts)
+
+    def __env_nodes(self, env_id, node_ids=None):
+        nodes = [node for node in self.nodes.values() if node['cluster'] == env_id]
+        if node_ids is not None:
+            nodes = [node for node in nodes if node['id'] in node_ids]
+            if len(nodes) != len(node_ids):
+                raise RemoteTaskError('Nodes {0} not in environment {1}'.format(node_ids, env_id))
+        return nodes
+
+    def __deploy(self, nodes, status):
+        for node in nodes:
+            node['status'] = status
+            if status == 'ready':
+                node['roles'] = node['roles'] + node['pending_roles']
+                node['pending_roles'] = []
+
+    def do_check_vm_operational(self):
+        return True
+
+    def do_watch_bootstrap_log(self, timeout=None, progress=None):
+        return True
+
+    def do_run_remote_script(self, local_script, args):
+        return None
+
+    def do_get_fuel_version(self):
+        return self.version
+
+    def do_power_off(self):
+        vm_name = 'site{0}-{1}'.format(self.site, self.config['master_name'])
+        with self.provider.pool.connect() as conn:
+            conn.lookupByName(vm_name).destroy()
+
+    def do_get_all_fuel_env(self):
+        return [dict(item) for item in self.envs.values()]
+
+    def do_create_fuel_env(self, name, release, mode, network):
+        id = len(self.envs) + 1
+        self.envs[id] = {'id': id,
+                         'status': 'new',
+                         'name': name,
+                         'mode': mode,
+                         'release_id': release,
+                         'changes': [],
+                         'pending_release_id': None}
+        return id
+
+    def do_configure_fuel_env(self, id, **kwargs):
+        if id not in self.envs:
+            raise RemoteTaskError('Environment {0} not found'.format(id))
+
+    def do_get_all_fuel_nodes(self):
+        return [dict(node) for id, node in sorted(self.nodes.items())]
+
+    def do_set_fuel_node_roles(self, env_id, node_ids, node_roles):
+        for id in node_ids:
+            node = self.nodes[id]
+            node['cluster'] = env_id
+            node['pending_roles'] = list(node_roles)
+
+    def do_configure_fuel_nodes(self, node_ids, env_id, admin_gw):
+        self.__env_nodes(env_id, node_ids)
+
+    def do_provision_fuel_nodes(self, env_id, node_ids):
+        self.__deploy(self.__env_nodes(env_id, node_ids), 'provisioned')
+
+    def do_deploy_fuel_nodes(self, env_id, node_ids):
+        self.__deploy(self.__env_nodes(env_id, node_ids), 'ready')
+
+    def do_fuel_deploy_changes(self, env_id):
+        self.__deploy(self.__env_nodes(env_id), 'ready')
+        self.envs[env_id]['status'] = 'operational'
+
+
+class CallCounter(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = collections.defaultdict(int)
+
+    def __call__(self, name, cat, seconds, args):
+        with self.lock:
+            self.counts[cat] += 1
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+
+def load_baseline():
+    try:
+        with open(BASELINE_FILE, 'r') as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return dict()
+
+
+def recorded_with():
+    get_version = getattr(libvirt, 'getVersion', None)
+    if get_version is None:
+        return STAND_IN + ' for test:///default'
+    return 'libvirt {0}'.format(get_version())
+
+
+def save_baseline(baseline):
+    directory = os.path.dirname(BASELINE_FILE)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    with open(BASELINE_FILE, 'w') as fp:
+        json.dump(baseline, fp, indent=2, sort_keys=True, separators=(',', ': '))
+        fp.write('\n')
+
+
+@unittest.skipIf(libvirt is None, 'libvirt is not installed')
+class OrchestrationBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+        self.config = config_manager.defaults()
+        self.config.update({'pxe_boot_concurrency': 0,
+                            'pxe_boot_interval': 0,
+                            'pxe_boot_window': 0})
+
+        self.provider = BenchProvider('test:///default', self.config)
+        self.master = FakeFuelMaster(self.provider, SITE, self.config)
+        self.provider.master = self.master
+
+        iso_path = os.path.join(self.work_dir, 'fuel.iso')
+        open(iso_path, 'w').close()
+
+        self.saved = (fuelbench.execute, isocache.get_custom_iso_image)
+        fuelbench.execute = self.master.execute
+        isocache.get_custom_iso_image = lambda *args, **kwargs: iso_path
+
+        self.counter = CallCounter()
+        trace.add_listener(self.counter)
+
+        self.devnull = open(os.devnull, 'w')
+        self.results = dict()
+
+    def tearDown(self):
+        trace.remove_listener(self.counter)
+        fuelbench.execute, isocache.get_custom_iso_image = self.saved
+
+        self.provider.clean_site(SITE)
+        self.devnull.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def measure(self, op, size, func):
+        self.counter.reset()
+        rss = rss_kb()
+        start = time.time()
+
+        stdout = sys.stdout
+        sys.stdout = self.devnull
+        try:
+            func()
+        finally:
+            sys.stdout = stdout
+
+        result = {'seconds': round(time.time() - start, 3),
+                  'libvirt_calls': self.counter.counts['libvirt'],
+                  'ssh_calls': self.counter.counts['ssh'],
+                  'rss_kb': max(0, rss_kb() - rss)}
+        self.results['{0}/{1}'.format(op, size)] = result
+
+        sys.stderr.write('\n{0:>8}/{1:<4} {2:8.2f}s {3:6d} libvirt {4:5d} ssh {5:+8d} KB'.format(
+            op, size, result['seconds'], result['libvirt_calls'], result['ssh_calls'], result['rss_kb']))
+
+    def add_nodes(self, runner, groups):
+        node_groups = runner.discover_slaves(timeout=60)
+        self.assertEqual(dict((role, count) for role, count in groups if count),
+                         dict((role, len(ids)) for role, ids in node_groups.items()))
+
+        node_ids = [id for ids in node_groups.values() for id in ids]
+
+        runner.deploy_changes()
+        runner.wait_for_fuel_nodes(node_ids, 'ready')
+
+    def check_baseline(self):
+        update = os.environ.get('FUELBENCH_UPDATE_BASELINE')
+        if BASELINE_FILE == DEFAULT_BASELINE_FILE:
+            recorded = COUNT_METRICS
+        else:
+            recorded = sorted(TOLERANCES)
+
+        regressions = list()
+
+        with utils.locked(os.path.join(tempfile.gettempdir(), 'fuelbench-benchmark-baseline.lock')):
+            baseline = load_baseline()
+            provisional = baseline.get(RECORDED_WITH, '').startswith(STAND_IN)
+
+            for key, result in sorted(self.results.items()):
+                if update:
+                    baseline[key] = dict((metric, result[metric]) for metric in recorded)
+                    continue
+
+                expected = baseline.get(key)
+                if expected is None:
+                    regressions.append('{0}: no baseline in {1}'.format(key, BASELINE_FILE))
+                    continue
+
+                for metric in sorted(expected):
+                    ratio, slack = TOLERANCES[metric]
+                    limit = expected[metric] * ratio + slack
+                    if result[metric] > limit:
+                        regressions.append('{0} {1}: {2} > {3} (baseline {4})'.format(key, metric, result[metric],
+                                                                                      limit, expected[metric]))
+
+            if update:
+                baseline[RECORDED_WITH] = recorded_with()
+                save_baseline(baseline)
+
+        if regressions and provisional:
+            self.skipTest('baselines in {0} were recorded with a stand-in for libvirt, regenerate them '
+                          'with FUELBENCH_UPDATE_BASELINE=1:\n{1}'.format(BASELINE_FILE, '\n'.join(regressions)))
+        self.assertEqual([], regressions, '\n'.join(regressions))
+
+    def run_site(self, size):
+        groups = make_groups(size)
+        slaves = make_slaves(groups)
+
+        runner = FuelBench(SITE, self.provider, self.config)
+        runner.local_workdir = os.path.join(self.work_dir, str(SITE))
+        runner.iso_fuel_version = FUEL_VERSION
+        runner.check_master()
+
+        def create():
+            runner.create_master(slaves=slaves, release='ubuntu',
+                                 disable_public=False, disable_snapshot=False)
+            runner.wait_for_fuel_server()
+            runner.create_fuel_env(release='ubuntu')
+            runner.start_slaves()
+            self.add_nodes(runner, groups)
+
+        def restore():
+            runner.clean_slaves()
+            runner.restore_master()
+
+        def deploy():
+            runner.create_fuel_env(release='ubuntu')
+            runner.create_slaves(slaves)
+            self.add_nodes(runner, groups)
+
+        self.measure('create', size, create)
+        self.assertEqual(size, len(runner.get_slave_nodes()))
+
+        self.measure('restore', size, restore)
+        self.assertEqual([], runner.get_slave_nodes())
+
+        self.measure('deploy', size, deploy)
+        self.assertEqual(size, len(runner.get_slave_nodes()))
+
+        self.measure('clean', size, runner.clean)
+        self.assertEqual([], runner.get_vm_nodes())
+
+        self.check_baseline()
+
+    def test_site_1_node(self):
+        self.run_site(SIZES[0])
+
+    def test_site_10_nodes(self):
+        self.run_site(SIZES[1])
+
+    def test_site_50_nodes(self):
+        self.run_site(SIZES[2])
+
+    def test_site_200_nodes(self):
+        self.run_site(SIZES[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
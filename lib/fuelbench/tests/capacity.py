@@ -0,0 +1,142 @@
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+from fuelbench import capacity
+from fuelbench import config_manager
+from fuelbench.error import CapacityError
+
+
+class FakeHost(object):
+
+    def __init__(self, vcpus=16, ram=65536, disk=1000, allocations=None, uri='test:///default'):
+        self.uri = uri
+        self.host = {'vcpus': vcpus, 'ram': ram, 'disk': disk, 'disk_available': disk}
+        self.allocations = allocations or dict()
+
+    def get_site_provider(self, site, reservations=None):
+        return self
+
+    def get_host_capacity(self):
+        return self.host
+
+    def get_site_allocations(self):
+        return self.allocations
+
+
+def make_vms(count, vcpus=2, ram=4096, disk=50, master=True):
+    vms = [{'vcpus': vcpus, 'ram': ram, 'disk': disk, 'slave': True} for i in range(count)]
+    if master:
+        vms.append({'vcpus': 2, 'ram': 4096, 'disk': 100, 'slave': False})
+    return vms
+
+
+def dead_pid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+class CapacityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.reservation_file = os.path.join(self.work_dir, 'capacity.json')
+
+        self.config = config_manager.defaults()
+        self.config.update({'cpu_overcommit': 1.0,
+                            'ram_overcommit': 1.0,
+                            'disk_overcommit': 1.0,
+                            'host_reserved_ram': 0,
+                            'site_limit': 4,
+                            'node_limit': 10})
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def check(self, host, site, planned, **kwargs):
+        return capacity.check(host, site, planned, self.config,
+                              reservation_file=self.reservation_file, **kwargs)
+
+    def reserve(self, site, pid, uri='test:///default', **usage):
+        with open(self.reservation_file, 'w') as fp:
+            json.dump({str(site): dict(usage, pid=pid, uri=uri)}, fp)
+
+    def test_admitted_plan_is_reserved(self):
+        plan = self.check(FakeHost(), 1, make_vms(3))
+
+        self.assertEqual((plan['vcpus'], plan['ram'], plan['disk'], plan['nodes']), (8, 16384, 250, 3))
+        with open(self.reservation_file) as fp:
+            reservation = json.load(fp)['1']
+        self.assertEqual(reservation['pid'], os.getpid())
+        self.assertEqual(reservation['uri'], 'test:///default')
+
+    def test_shortfall(self):
+        try:
+            self.check(FakeHost(ram=16384), 1, make_vms(4))
+        except CapacityError as e:
+            self.assertEqual(e.site, 1)
+            self.assertEqual(len(e.shortfalls), 1)
+            self.assertTrue(e.shortfalls[0].startswith('ram: need 20480 MB, 16384 MB left'))
+        else:
+            self.fail('CapacityError not raised')
+
+    def test_overcommit(self):
+        host = FakeHost(vcpus=4)
+        self.assertRaises(CapacityError, self.check, host, 1, make_vms(3))
+
+        self.config['cpu_overcommit'] = 2.0
+        self.check(host, 1, make_vms(3))
+
+    def test_other_sites_count(self):
+        allocations = {2: {'vcpus': 10, 'ram': 8192, 'disk': 100, 'nodes': 4}}
+        host = FakeHost(allocations=allocations)
+
+        self.assertRaises(CapacityError, self.check, host, 1, make_vms(3))
+        self.check(host, 1, make_vms(2))
+
+    def test_replace_site(self):
+        allocations = {1: {'vcpus': 8, 'ram': 16384, 'disk': 250, 'nodes': 3}}
+        host = FakeHost(vcpus=12, allocations=allocations)
+
+        self.assertRaises(CapacityError, self.check, host, 1, make_vms(3))
+        self.check(host, 1, make_vms(3), replace_site=True)
+
+    def test_reservations_of_live_processes_count(self):
+        # site 2 is still being created by another process
+        self.reserve(2, os.getppid(), vcpus=10, ram=8192, disk=100, nodes=4)
+        self.assertRaises(CapacityError, self.check, FakeHost(), 1, make_vms(3))
+
+        self.reserve(2, dead_pid(), vcpus=10, ram=8192, disk=100, nodes=4)
+        self.check(FakeHost(), 1, make_vms(3))
+
+    def test_reservations_on_other_hosts_do_not_count(self):
+        self.reserve(2, os.getppid(), uri='qemu+ssh://other/system', vcpus=10, ram=8192, disk=100, nodes=4)
+        self.check(FakeHost(), 1, make_vms(3))
+
+        self.config['site_limit'] = 1
+        self.check(FakeHost(), 1, make_vms(3))
+
+    def test_free(self):
+        self.reserve(2, os.getppid(), vcpus=10, ram=8192, disk=100, nodes=4)
+        with capacity.reservations(self.reservation_file) as items:
+            left = capacity.free(FakeHost(), 1, self.config, items)
+
+        self.assertEqual(left, {'vcpus': 6, 'ram': 65536 - 8192, 'disk': 900})
+
+    def test_site_and_node_limits(self):
+        allocations = dict((site, capacity.total([])) for site in (2, 3, 4, 5))
+        host = FakeHost(vcpus=64, allocations=allocations)
+
+        self.assertRaises(CapacityError, self.check, host, 1, make_vms(1))
+        self.check(host, 5, make_vms(1))
+
+        self.assertRaises(CapacityError, self.check, FakeHost(vcpus=64), 1, make_vms(11, ram=1024))
+        self.check(FakeHost(vcpus=64), 1, make_vms(10, ram=1024))
+
+
+if __name__ == '__main__':
+    unittest.main()
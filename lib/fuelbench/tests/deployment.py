@@ -0,0 +1,118 @@
+import unittest
+
+from fuelbench.nailgun import Node, Task
+from fuelbench.deployment import Deployment, wait_all
+from fuelbench.error import DeploymentError
+
+
+def make_node(id, status, progress=0):
+    return Node(id=id, status=status, name='node-{0}'.format(id), cluster=1, ip=None,
+                mac=None, roles=[], pending_roles=['controller'], online=True,
+                group_id=1, progress=progress, error_type='deploy' if status == 'error' else None)
+
+
+class ScriptedClient(object):
+    """Replays a list of (task status, node statuses) polls."""
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.step = None
+        self.stopped = False
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def deploy_changes(self, cluster_id):
+        return Task(id=7, uuid='uuid', name='deploy', status='running', progress=0,
+                    message=None, cluster=cluster_id)
+
+    def stop_deployment(self, cluster_id):
+        self.stopped = True
+
+    def get_task(self, task_id):
+        if len(self.steps) > 1:
+            self.step = self.steps.pop(0)
+        else:
+            self.step = self.steps[0]
+        status = self.step[0]
+        return Task(id=task_id, uuid='uuid', name='deploy', status=status, progress=0,
+                    message='failed' if status == 'error' else None, cluster=1)
+
+    def get_nodes(self, cluster_id=None):
+        return [make_node(id, status, progress) for id, (status, progress) in enumerate(self.step[1], 1)]
+
+
+class DeploymentTest(unittest.TestCase):
+
+    def start(self, steps, **kwargs):
+        deployment = Deployment(ScriptedClient(steps), 1,
+                                ScriptedClient(steps).deploy_changes(1), **kwargs)
+        deployment._waiter.backoff.initial = 0.01
+        deployment._waiter.backoff.maximum = 0.01
+        deployment.follow()
+        return deployment
+
+    def test_progress_and_success(self):
+        seen = list()
+        deployment = self.start([('running', [('provisioning', 10), ('provisioning', 0)]),
+                                 ('running', [('provisioning', 10), ('provisioning', 0)]),
+                                 ('running', [('deploying', 50), ('deploying', 40)]),
+                                 ('ready', [('ready', 100), ('ready', 100)])],
+                                progress=lambda d, node: seen.append((node.id, node.status)))
+
+        self.assertTrue(deployment.wait(5))
+        self.assertTrue(deployment.ok)
+        self.assertEqual(seen, [(1, 'provisioning'), (2, 'provisioning'),
+                                (1, 'deploying'), (2, 'deploying'),
+                                (1, 'ready'), (2, 'ready')])
+        self.assertTrue(deployment.client.closed)
+
+    def test_abort_on_node_error(self):
+        deployment = self.start([('running', [('provisioning', 10), ('provisioning', 10)]),
+                                 ('running', [('error', 10), ('provisioning', 20)]),
+                                 ('running', [('error', 10), ('provisioning', 30)])])
+
+        with self.assertRaises(DeploymentError) as cm:
+            deployment.wait(5)
+
+        self.assertEqual(cm.exception.failed_nodes, [1])
+        self.assertTrue(deployment.client.stopped)
+
+    def test_flag_node_error(self):
+        deployment = self.start([('running', [('error', 10), ('deploying', 20)]),
+                                 ('error', [('error', 10), ('ready', 100)])],
+                                abort_on_error=False)
+
+        self.assertRaises(DeploymentError, deployment.wait, 5)
+        self.assertEqual(deployment.failed_nodes, [1])
+        self.assertFalse(deployment.client.stopped)
+
+    def test_flag_later_node_errors(self):
+        deployment = self.start([('running', [('error', 10), ('deploying', 20)]),
+                                 ('running', [('error', 10), ('deploying', 50)]),
+                                 ('running', [('error', 10), ('error', 50)]),
+                                 ('error', [('error', 10), ('error', 50)])],
+                                abort_on_error=False)
+
+        with self.assertRaises(DeploymentError) as cm:
+            deployment.wait(5)
+
+        self.assertEqual(deployment.failed_nodes, [1, 2])
+        self.assertEqual(cm.exception.failed_nodes, [1, 2])
+
+    def test_wait_all(self):
+        good = self.start([('ready', [('ready', 100)])])
+        bad = self.start([('error', [('error', 0)])], abort_on_error=False)
+
+        self.assertEqual(wait_all([good, bad], timeout=5), [bad])
+
+    def test_wait_all_without_timeout(self):
+        good = self.start([('running', [('deploying', 50)]),
+                           ('ready', [('ready', 100)])])
+
+        self.assertEqual(wait_all([good]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import time
+import threading
+import unittest
+
+try:
+    import libvirt
+except ImportError:
+    libvirt = None
+
+if libvirt is not None:
+    from fuelbench.providers import connection
+    from fuelbench.providers import events
+
+
+@unittest.skipIf(libvirt is None, 'libvirt is not installed')
+class DomainEventWatcherTest(unittest.TestCase):
+
+    URI = 'test:///default'
+
+    def setUp(self):
+        # a recheck would hide an event that never arrives
+        self.recheck_interval = events.RECHECK_INTERVAL
+        events.RECHECK_INTERVAL = 60
+
+        self.pool = connection.get_pool(self.URI)
+        self.watcher = events.get_watcher(self.URI)
+
+    def tearDown(self):
+        events.RECHECK_INTERVAL = self.recheck_interval
+
+        with self.pool.connect() as conn:
+            dom = conn.lookupByName('test')
+            if not dom.isActive():
+                dom.create()
+
+    def test_stopped_event(self):
+        with self.pool.connect() as conn:
+            dom = conn.lookupByName('test')
+
+        timer = threading.Timer(0.5, dom.destroy)
+        timer.start()
+
+        start = time.time()
+        event = self.watcher.wait('test', [events.EVENT_STOPPED], timeout=10)
+        timer.join()
+
+        self.assertEqual(events.EVENT_STOPPED, event)
+        self.assertLess(time.time() - start, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from fuelbench import utils
+from fuelbench import iso9660
+from fuelbench.iso9660 import IsoImage, IsoFormatError, SECTOR_SIZE
+
+VERSION_YAML = 'VERSION:\n  release: "7.0"\n'
+
+
+def both_endian(fmt, value):
+    return struct.pack('<' + fmt, value) + struct.pack('>' + fmt, value)
+
+
+def dir_record(extent, size, flags, name):
+    pad = '\x00' if len(name) % 2 == 0 else ''
+    rec_len = 33 + len(name) + len(pad)
+    return ''.join([chr(rec_len), '\x00',
+                    both_endian('I', extent), both_endian('I', size),
+                    '\x00' * 7, chr(flags), '\x00\x00',
+                    both_endian('H', 1), chr(len(name)), name, pad])
+
+
+class ImageBuilder(object):
+    """Lays out a tree of {name: data or subtree} as an ISO9660 image,
+    with Joliet names if joliet is set."""
+
+    def __init__(self, joliet=False):
+        self.joliet = joliet
+        self.sectors = dict()
+        self.next_sector = 20
+
+    def alloc(self, data):
+        extent = self.next_sector
+        count = max(1, (len(data) + SECTOR_SIZE - 1) // SECTOR_SIZE)
+        for i in range(count):
+            self.sectors[extent + i] = data[i * SECTOR_SIZE:(i + 1) * SECTOR_SIZE]
+        self.next_sector += count
+        return extent
+
+    def encode(self, name, directory, joliet):
+        if joliet:
+            return name.decode('ascii').encode('utf-16-be')
+        return name.upper() if directory else name.upper() + ';1'
+
+    def build_dir(self, tree, joliet):
+        records = [dir_record(0, 0, iso9660.FLAG_DIRECTORY, '\x00'),
+                   dir_record(0, 0, iso9660.FLAG_DIRECTORY, '\x01')]
+
+        for name, value in sorted(tree.items()):
+            if isinstance(value, dict):
+                extent, size = self.build_dir(value, joliet)
+                records.append(dir_record(extent, size, iso9660.FLAG_DIRECTORY,
+                                          self.encode(name, True, joliet)))
+            else:
+                records.append(dir_record(self.alloc(value), len(value), 0,
+                                          self.encode(name, False, joliet)))
+
+        # records never span sectors
+        data = ''
+        for record in records:
+            used = len(data) % SECTOR_SIZE
+            if used + len(record) > SECTOR_SIZE:
+                data += '\x00' * (SECTOR_SIZE - used)
+            data += record
+        data += '\x00' * (-len(data) % SECTOR_SIZE)
+
+        return self.alloc(data), len(data)
+
+    def descriptor(self, vd_type, root=None, escape=''):
+        desc = bytearray(SECTOR_SIZE)
+        desc[0] = vd_type
+        desc[1:7] = 'CD001\x01'
+        desc[88:88 + len(escape)] = escape
+        desc[128:132] = both_endian('H', SECTOR_SIZE)
+        if root is not None:
+            desc[156:190] = dir_record(root[0], root[1], iso9660.FLAG_DIRECTORY, '\x00')
+        return str(desc)
+
+    def write(self, path, tree):
+        self.sectors[16] = self.descriptor(iso9660.VD_PRIMARY, self.build_dir(tree, False))
+        if self.joliet:
+            self.sectors[17] = self.descriptor(iso9660.VD_SUPPLEMENTARY, self.build_dir(tree, True), '%/E')
+        else:
+            # not Joliet, so the reader keeps the primary names
+            self.sectors[17] = self.descriptor(iso9660.VD_SUPPLEMENTARY)
+        self.sectors[18] = self.descriptor(iso9660.VD_TERMINATOR)
+
+        with open(path, 'wb') as fp:
+            for sector in range(self.next_sector):
+                data = self.sectors.get(sector, '')
+                fp.write(data + '\x00' * (SECTOR_SIZE - len(data)))
+
+        return path
+
+
+class IsoImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.tree = {'version.yaml': VERSION_YAML,
+                     'isolinux': {'isolinux.cfg': 'default vesamenu.c32\n' * 200}}
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_image(self, tree=None, joliet=False):
+        path = os.path.join(self.work_dir, 'fuel.iso')
+        return ImageBuilder(joliet).write(path, tree or self.tree)
+
+    def test_read_primary_names(self):
+        iso_file = self.make_image()
+
+        with IsoImage(iso_file) as image:
+            self.assertFalse(image.joliet)
+            self.assertEqual(image.read_file('version.yaml'), VERSION_YAML)
+            self.assertEqual(image.read_file('/isolinux/isolinux.cfg'), self.tree['isolinux']['isolinux.cfg'])
+
+    def test_read_joliet_names(self):
+        self.tree['Fuel-Release-Notes.txt'] = 'notes'
+        iso_file = self.make_image(joliet=True)
+
+        with IsoImage(iso_file) as image:
+            self.assertTrue(image.joliet)
+            self.assertEqual(image.read_file('Fuel-Release-Notes.txt'), 'notes')
+            self.assertEqual(iso9660.read_file(iso_file, 'version.yaml'), VERSION_YAML)
+
+    def test_directory_spanning_sectors(self):
+        tree = dict(('file-{0:03d}.txt'.format(i), str(i)) for i in range(100))
+        iso_file = self.make_image(tree)
+
+        self.assertEqual(iso9660.read_file(iso_file, 'file-099.txt'), '99')
+
+    def test_missing_file(self):
+        iso_file = self.make_image()
+
+        self.assertRaises(IOError, iso9660.read_file, iso_file, 'missing.yaml')
+        self.assertRaises(IOError, iso9660.read_file, iso_file, 'isolinux')
+        self.assertRaises(IOError, iso9660.read_file, iso_file, 'version.yaml/release')
+
+    def test_not_an_iso(self):
+        path = os.path.join(self.work_dir, 'disk.img')
+        with open(path, 'wb') as fp:
+            fp.write('\x00' * SECTOR_SIZE * 20)
+
+        self.assertRaises(IsoFormatError, IsoImage, path)
+
+    def test_empty_file(self):
+        path = os.path.join(self.work_dir, 'empty.iso')
+        open(path, 'wb').close()
+
+        self.assertRaises(IsoFormatError, IsoImage, path)
+        self.assertRaises(IsoFormatError, iso9660.read_file, path, 'version.yaml')
+
+    def test_fuel_version_is_memoized(self):
+        iso_file = self.make_image()
+        reads = list()
+
+        def read_file(iso_file, path):
+            reads.append(path)
+            return read_file.orig(iso_file, path)
+
+        read_file.orig = iso9660.read_file
+        iso9660.read_file = read_file
+        try:
+            self.assertEqual(utils.retrieve_iso_version(iso_file), '7.0')
+            self.assertEqual(utils.retrieve_iso_version(iso_file), '7.0')
+            self.assertEqual(len(reads), 1)
+
+            # a rebuilt image is read again
+            self.tree['version.yaml'] = VERSION_YAML.replace('7.0', '10.0')
+            os.unlink(iso_file)
+            self.make_image()
+            os.utime(iso_file, (0, 0))
+            self.assertEqual(utils.retrieve_iso_version(iso_file), '10.0')
+            self.assertEqual(len(reads), 2)
+        finally:
+            iso9660.read_file = read_file.orig
+
+
+if __name__ == '__main__':
+    unittest.main()
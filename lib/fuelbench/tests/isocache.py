@@ -0,0 +1,72 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from fuelbench import utils
+from fuelbench import isocache
+
+
+class IsoCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.cache_dir, 'fuel.img')
+        with open(self.source, 'w') as fp:
+            fp.write('source')
+
+        self.builds = list()
+        self.build_custom_iso_image = utils.build_custom_iso_image
+        utils.build_custom_iso_image = self.fake_build
+
+    def tearDown(self):
+        utils.build_custom_iso_image = self.build_custom_iso_image
+        shutil.rmtree(self.cache_dir)
+
+    def fake_build(self, source, target, work_dir, ipaddr, gateway, dns, netmask, hostname):
+        self.builds.append(ipaddr)
+        with open(target, 'w') as fp:
+            fp.write('x' * 1024)
+
+    def make_iso(self, name, age):
+        path = os.path.join(self.cache_dir, name + '.iso')
+        with open(path, 'w') as fp:
+            fp.write('x' * 1024)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def get(self, ipaddr, **kwargs):
+        return isocache.get_custom_iso_image(self.source, ipaddr, '10.20.1.1', '10.20.1.1',
+                                             '255.255.255.0', 'fuel', cache_dir=self.cache_dir,
+                                             **kwargs)
+
+    def test_cache_hit(self):
+        first = self.get('10.20.1.2')
+        self.assertEqual(first, self.get('10.20.1.2'))
+        self.assertNotEqual(first, self.get('10.20.2.2'))
+        self.assertEqual(self.builds, ['10.20.1.2', '10.20.2.2'])
+
+    def test_evict_least_recently_used(self):
+        old = self.make_iso('old', 30)
+        new = self.make_iso('new', 10)
+
+        isocache.evict(self.cache_dir, max_size=1536.0 / 1024 ** 3)
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_evict_keeps_attached_media(self):
+        attached = self.make_iso('attached', 30)
+        old = self.make_iso('old', 20)
+
+        iso_file = self.get('10.20.1.2', max_size=2048.0 / 1024 ** 3, keep=[attached])
+
+        self.assertTrue(os.path.exists(attached))
+        self.assertTrue(os.path.exists(iso_file))
+        self.assertFalse(os.path.exists(old))
+
+
+if __name__ == '__main__':
+    unittest.main()
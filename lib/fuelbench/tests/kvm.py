@@ -0,0 +1,96 @@
+import unittest
+from contextlib import contextmanager
+
+try:
+    import libvirt
+except ImportError:
+    libvirt = None
+
+from fuelbench import config_manager
+
+if libvirt is not None:
+    from fuelbench.providers import KvmProvider
+
+DOMAIN_XML = """\
+<domain type='test'>
+  <name>{name}</name>
+  <memory unit='MiB'>512</memory>
+  <vcpu>1</vcpu>
+  <os>
+    <type arch='x86_64'>hvm</type>
+  </os>
+  <devices>
+    <disk type='file' device='cdrom'>
+      <source file='{iso}'/>
+      <target dev='hdc' bus='ide'/>
+      <readonly/>
+    </disk>
+  </devices>
+</domain>
+"""
+
+
+class VanishingPool(object):
+    """Connects like a ConnectionPool, but undefines the domains in
+    vanish right after they have been listed, like a teardown running
+    at the same time."""
+
+    def __init__(self, pool, vanish):
+        self.pool = pool
+        self.vanish = vanish
+
+    @contextmanager
+    def connect(self, readonly=False):
+        with self.pool.connect() as conn:
+            yield VanishingConnection(conn, self.vanish)
+
+
+class VanishingConnection(object):
+
+    def __init__(self, conn, vanish):
+        self.conn = conn
+        self.vanish = vanish
+
+    def listAllDomains(self, flags=0):
+        domains = self.conn.listAllDomains(flags)
+        for dom in domains:
+            if dom.name() in self.vanish:
+                dom.undefine()
+        return domains
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+@unittest.skipIf(libvirt is None, 'libvirt is not installed')
+class KvmProviderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.provider = KvmProvider('test:///default', config_manager.defaults())
+
+        with self.provider.pool.connect() as conn:
+            for site in (91, 92):
+                conn.defineXML(DOMAIN_XML.format(name='site{0}-master'.format(site),
+                                                 iso='/var/lib/fuelbench/site{0}.iso'.format(site)))
+
+    def tearDown(self):
+        with self.provider.pool.connect() as conn:
+            for dom in conn.listAllDomains(0):
+                if dom.name().startswith('site9'):
+                    dom.undefine()
+
+    def test_attached_media_skips_vanished_domains(self):
+        self.provider.pool = VanishingPool(self.provider.pool, ['site91-master'])
+
+        self.assertEqual(set(['/var/lib/fuelbench/site92.iso']), self.provider.get_attached_media())
+
+    def test_allocations_skip_vanished_domains(self):
+        self.provider.pool = VanishingPool(self.provider.pool, ['site91-master'])
+
+        allocations = self.provider.get_site_allocations()
+        self.assertNotIn(91, allocations)
+        self.assertEqual(1, allocations[92]['vcpus'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+import urllib2
+
+from fuelbench import metrics
+
+
+class RenderTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics._metrics.clear()
+        metrics._labels.clear()
+
+    def tearDown(self):
+        metrics._metrics.clear()
+        metrics._labels.clear()
+
+    def test_counter_with_common_labels(self):
+        metrics.set_labels(site=1, command='create')
+        metrics.count_poll('fuel_nodes')
+        metrics.count_poll('fuel_nodes')
+
+        self.assertEqual(metrics.render(),
+                         '# HELP fuelbench_poll_iterations_total Iterations of polling loops\n'
+                         '# TYPE fuelbench_poll_iterations_total counter\n'
+                         'fuelbench_poll_iterations_total{command="create",site="1",waiter="fuel_nodes"} 2.0\n')
+
+    def test_exit_codes_do_not_repeat_command(self):
+        metrics.set_labels(site=1, command='create')
+        metrics.count_exit('virt-install', 0)
+
+        self.assertIn('fuelbench_subprocess_exit_total'
+                      '{code="0",command="create",program="virt-install",site="1"} 1.0\n',
+                      metrics.render())
+
+    def test_histogram(self):
+        metrics.histogram('duration_seconds', 'Duration', buckets=(1, 10)).observe(5, name='x')
+
+        lines = metrics.render().splitlines()
+        self.assertEqual(lines[2:], ['duration_seconds_bucket{le="1.0",name="x"} 0.0',
+                                     'duration_seconds_bucket{le="10.0",name="x"} 1.0',
+                                     'duration_seconds_bucket{le="+Inf",name="x"} 1.0',
+                                     'duration_seconds_count{name="x"} 1.0',
+                                     'duration_seconds_sum{name="x"} 5.0'])
+
+    def test_duplicate_label_is_not_emitted(self):
+        metrics.set_labels(command='create')
+        metrics.counter('things_total', 'Things').inc(command='virt-install')
+        metrics.counter('things_total', 'Things').inc(kind='other')
+
+        output = metrics.render()
+        self.assertNotIn('virt-install', output)
+        self.assertIn('things_total{command="create",kind="other"} 1.0\n', output)
+
+    def test_escaping(self):
+        metrics.set_labels(site='a"b\\c\nd')
+        metrics.count_poll('w')
+
+        self.assertIn('{site="a\\"b\\\\c\\nd",waiter="w"}', metrics.render())
+
+    def test_merge_workers(self):
+        texts = list()
+        for site in (1, 2):
+            metrics._metrics.clear()
+            metrics.set_labels(site=site, command='create')
+            metrics.count_poll('fuel_nodes')
+            metrics.count_exit('virt-install', 0)
+            texts.append(metrics.render())
+
+        lines = metrics.merge(texts).splitlines()
+        self.assertEqual(lines[:4], ['# HELP fuelbench_poll_iterations_total Iterations of polling loops',
+                                     '# TYPE fuelbench_poll_iterations_total counter',
+                                     'fuelbench_poll_iterations_total{command="create",site="1",waiter="fuel_nodes"} 1.0',
+                                     'fuelbench_poll_iterations_total{command="create",site="2",waiter="fuel_nodes"} 1.0'])
+        self.assertEqual(len([line for line in lines if line.startswith('# TYPE ')]), 2)
+
+
+class ServeTextfilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.server = None
+        metrics._metrics.clear()
+        metrics._labels.clear()
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        metrics._metrics.clear()
+        metrics._labels.clear()
+        shutil.rmtree(self.work_dir)
+
+    def test_serve_worker_textfiles(self):
+        paths = [os.path.join(self.work_dir, 'fuelbench-create-site{0}.prom'.format(site)) for site in (1, 2)]
+
+        metrics.set_labels(site=1, command='create')
+        metrics.count_poll('fuel_nodes')
+        metrics.write_textfile(paths[0])
+
+        # the parent of a batch records nothing itself
+        metrics._metrics.clear()
+        self.server = metrics.start_http_server(0, sources=lambda: paths)
+
+        data = urllib2.urlopen('http://127.0.0.1:{0}/metrics'.format(self.server.server_port)).read()
+        self.assertIn('fuelbench_poll_iterations_total{command="create",site="1",waiter="fuel_nodes"} 1.0\n', data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import libvirt
+except ImportError:
+    libvirt = None
+
+from fuelbench import capacity
+from fuelbench import config_manager
+from fuelbench.settings import NETWORK_NAT, NETWORK_ISOLATED
+
+
+HOST_XML = """\
+<node>
+  <cpu>
+    <mhz>2000</mhz>
+    <model>x86_64</model>
+    <nodes>1</nodes>
+    <sockets>1</sockets>
+    <cores>{cores}</cores>
+    <threads>1</threads>
+  </cpu>
+  <memory>{memory}</memory>
+  <pool type='dir'>
+    <name>default</name>
+    <target>
+      <path>/var/lib/libvirt/images</path>
+    </target>
+  </pool>
+</node>
+"""
+
+NETWORKS = [{'type': NETWORK_NAT, 'gateway': '10.20.1.1', 'netmask': '255.255.255.0'},
+            {'type': NETWORK_ISOLATED}]
+
+
+@unittest.skipIf(libvirt is None, 'libvirt is not installed')
+class MultiHostProviderTest(unittest.TestCase):
+
+    def setUp(self):
+        from fuelbench.providers import MultiHostProvider
+        from fuelbench.providers import connection
+
+        self.work_dir = tempfile.mkdtemp()
+        self.uris = list()
+        self.pools = list()
+
+        # the second host has twice the memory of the first
+        for name, cores, memory in (('small', 4, 8 * 1024 ** 2), ('large', 8, 16 * 1024 ** 2)):
+            path = os.path.join(self.work_dir, name + '.xml')
+            with open(path, 'w') as fp:
+                fp.write(HOST_XML.format(cores=cores, memory=memory))
+            self.uris.append('test://' + path)
+
+            # every connection to a test driver file gets a private copy of
+            # the host, so read-only calls must use the read-write one
+            self.pools.append(connection.ConnectionPool(self.uris[-1], shared=True))
+            connection.set_pool(self.pools[-1])
+
+        self.reservation_file = os.path.join(self.work_dir, 'capacity.json')
+        self.provider = self.make_provider()
+
+    def make_provider(self):
+        # a provider of its own stands for another fuelbench process
+        from fuelbench.providers import MultiHostProvider
+
+        return MultiHostProvider(self.uris, config_manager.defaults(),
+                                 reservation_file=self.reservation_file)
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_place_site_on_largest_host(self):
+        host = self.provider.get_site_provider(1)
+        self.assertEqual(self.uris[1], host.uri)
+
+    def test_site_stays_on_its_host(self):
+        host = self.provider.get_site_provider(1)
+        host.create_networks(1, NETWORKS)
+
+        self.assertEqual(['site1net1', 'site1net2'], sorted(self.provider.get_networks(1)))
+        self.assertEqual([], self.provider.hosts[0].get_networks(1))
+
+        self.provider.create_networks(1, [])
+        self.assertTrue(self.provider.get_site_provider(1) is host)
+
+    def test_placement_is_shared(self):
+        self.assertEqual(self.uris[1], self.provider.get_site_provider(1).uri)
+
+        # site 2 now fills the large host, but site 1 stays where it was placed
+        planned = [{'vcpus': 4, 'ram': 12 * 1024, 'disk': 100}]
+        capacity.check(self.provider, 2, planned, self.provider.config,
+                       reservation_file=self.reservation_file)
+
+        self.assertEqual(self.uris[1], self.make_provider().get_site_provider(1).uri)
+
+    def test_reservations_spread_sites(self):
+        # site 1 is being created on the large host and holds most of it
+        planned = [{'vcpus': 4, 'ram': 12 * 1024, 'disk': 100}]
+        plan = capacity.check(self.provider, 1, planned, self.provider.config,
+                              reservation_file=self.reservation_file)
+        self.assertEqual(self.uris[1], plan['uri'])
+
+        host = self.make_provider().get_site_provider(2)
+        self.assertEqual(self.uris[0], host.uri)
+
+    def test_remote_uri_is_rejected(self):
+        from fuelbench.providers import MultiHostProvider
+        from fuelbench.error import ProviderError
+
+        self.assertRaises(ProviderError, MultiHostProvider,
+                          [self.uris[0], 'qemu+ssh://other/system'], config_manager.defaults())
+
+    def test_clean_site(self):
+        self.provider.create_networks(2, NETWORKS)
+        self.provider.clean_site(2)
+
+        self.assertEqual([], self.provider.get_networks(2))
+
+    def test_host_capacity_is_aggregated(self):
+        total = self.provider.get_host_capacity()
+
+        self.assertEqual(12, total['vcpus'])
+        self.assertEqual(24 * 1024, total['ram'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+
+import json
+import threading
+import unittest
+import BaseHTTPServer
+
+from fuelbench.nailgun import NailgunClient
+from fuelbench.error import NailgunError
+
+
+NODES = [{'id': 1, 'status': 'discover', 'name': 'Untitled (aa:01)', 'cluster': None,
+          'ip': '10.20.1.3', 'mac': '52:54:00:aa:00:01', 'roles': [], 'pending_roles': [],
+          'online': True, 'group_id': None, 'progress': 0, 'error_type': None},
+         {'id': 2, 'status': 'ready', 'name': 'node-2', 'cluster': 1,
+          'ip': '10.20.1.4', 'mac': '52:54:00:aa:00:02', 'roles': ['controller'],
+          'pending_roles': [], 'online': True, 'group_id': 1, 'progress': 100,
+          'error_type': None}]
+
+CLUSTERS = [{'id': 1, 'status': 'operational', 'name': 'site1', 'mode': 'ha_compact',
+             'release_id': 2, 'changes': [], 'pending_release_id': None}]
+
+
+class StubNailgun(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def __reply(self, status, body=None):
+        data = json.dumps(body) if body is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length', 0))
+        self.rfile.read(length)
+
+        if self.path == '/v2.0/tokens':
+            self.server.tokens += 1
+            token = 'token-{0}'.format(self.server.tokens)
+            self.server.valid_token = token
+            self.__reply(200, {'access': {'token': {'id': token}}})
+        else:
+            self.__reply(404)
+
+    def do_GET(self):
+        if self.headers.getheader('x-auth-token') != self.server.valid_token:
+            self.__reply(401)
+        elif self.path == '/api/nodes':
+            self.__reply(200, NODES)
+        elif self.path == '/api/nodes?cluster_id=1':
+            self.__reply(200, [n for n in NODES if n['cluster'] == 1])
+        elif self.path == '/api/clusters':
+            self.__reply(200, CLUSTERS)
+        elif self.path == '/api/version':
+            self.__reply(200, {'release': '7.0'})
+        else:
+            self.__reply(404)
+
+    def do_PUT(self):
+        length = int(self.headers.getheader('content-length', 0))
+        body = json.loads(self.rfile.read(length))
+
+        if self.headers.getheader('x-auth-token') != self.server.valid_token:
+            self.__reply(401)
+        elif self.path == '/api/nodes':
+            self.server.updates.extend(body)
+            self.__reply(200, body)
+        else:
+            self.__reply(404)
+
+
+class NailgunClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StubNailgun)
+        self.server.connections = 0
+        self.server.tokens = 0
+        self.server.valid_token = None
+        self.server.updates = list()
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        port = self.server.server_address[1]
+        self.client = NailgunClient('127.0.0.1', port=port, keystone_port=port, timeout=5)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_nodes(self):
+        nodes = self.client.get_nodes()
+
+        self.assertEqual([1, 2], [node.id for node in nodes])
+        self.assertEqual('discover', nodes[0].status)
+        self.assertEqual(['controller'], nodes[1].roles)
+
+        nodes = self.client.get_nodes(cluster_id=1)
+        self.assertEqual([2], [node.id for node in nodes])
+
+    def test_get_clusters(self):
+        clusters = self.client.get_clusters()
+
+        self.assertEqual(1, len(clusters))
+        self.assertEqual('ha_compact', clusters[0].mode)
+        self.assertEqual(2, clusters[0].release_id)
+
+    def test_connection_reused(self):
+        for i in range(10):
+            self.client.get_nodes()
+            self.client.get_version()
+
+        # one for keystone and one for nailgun, on the same port here
+        self.assertTrue(self.server.connections <= 2)
+        self.assertEqual(1, self.server.tokens)
+
+    def test_token_renewed(self):
+        self.client.get_version()
+        self.server.valid_token = 'expired'
+
+        self.assertEqual('7.0', self.client.get_version()['release'])
+        self.assertEqual(2, self.server.tokens)
+
+    def test_set_node_status(self):
+        self.client.set_node_status([1, 3], 'provisioned')
+
+        self.assertEqual([{'id': 1, 'status': 'provisioned'}, {'id': 3, 'status': 'provisioned'}],
+                         self.server.updates)
+
+    def test_not_found(self):
+        self.assertRaises(NailgunError, self.client.get_node, 99)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+try:
+    import libvirt
+except ImportError:
+    libvirt = None
+
+from fuelbench import config_manager
+from fuelbench.nodeindex import NodeIndex, NodeMatcher, make_mac
+
+
+def allocate_many(path, count, queue):
+    index = NodeIndex(path)
+    queue.put([index.allocate()[0] for i in range(count)])
+
+
+class NodeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.index = NodeIndex(os.path.join(self.work_dir, 'site1', 'nodes.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_make_mac(self):
+        self.assertEqual(make_mac(1, 2), '52:54:01:00:00:02')
+        self.assertEqual(make_mac(12, 300, nic=2), '52:54:0c:02:01:2c')
+
+    def test_make_mac_out_of_range(self):
+        self.assertEqual(make_mac(255, 65535, nic=255), '52:54:ff:ff:ff:ff')
+
+        self.assertRaises(ValueError, make_mac, 0, 1)
+        self.assertRaises(ValueError, make_mac, 256, 1)
+        self.assertRaises(ValueError, make_mac, 1, 65536)
+        self.assertRaises(ValueError, make_mac, 1, 1, nic=256)
+
+    def test_add_and_remove(self):
+        self.index.add(make_mac(1, 1), 'node-1', role='controller', cpu=2, ram=4096, disk=50)
+        self.index.add(make_mac(1, 2).upper(), 'node-2', role='compute', cpu=1, ram=2048, disk=20)
+
+        self.assertEqual(self.index.lookup('52:54:01:00:00:02')['role'], 'compute')
+        self.assertEqual(self.index.lookup(make_mac(1, 1))['ram'], 4096)
+
+        self.index.remove('node-1')
+        self.assertEqual(list(self.index.load().keys()), [make_mac(1, 2)])
+
+        self.index.clear()
+        self.assertEqual(self.index.load(), {})
+
+    def test_allocate_starts_after_seed(self):
+        self.assertEqual(self.index.allocate(3, seed=lambda: 4), [5, 6, 7])
+        self.assertEqual(self.index.allocate(seed=lambda: 100), [8])
+
+    def test_allocate_reuses_reclaimed_ids(self):
+        for node_id in self.index.allocate(3):
+            self.index.add(make_mac(1, node_id), 'node-{0}'.format(node_id), node_id=node_id)
+
+        self.index.remove('node-2')
+        self.index.release([3])
+        self.assertEqual(self.index.allocate(3), [2, 3, 4])
+
+        self.index.clear()
+        self.assertEqual(self.index.allocate(2), [1, 2])
+
+    def test_allocate_across_processes(self):
+        self.index.allocate(seed=lambda: 0)
+        queue = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=allocate_many, args=(self.index.path, 20, queue))
+                   for i in range(4)]
+
+        for worker in workers:
+            worker.start()
+        node_ids = sum([queue.get(timeout=30) for worker in workers], [])
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(sorted(node_ids), range(2, 82))
+
+    def test_matcher_is_incremental(self):
+        self.index.add(make_mac(1, 1), 'node-1', role='controller')
+        self.index.add(make_mac(1, 2), 'node-2', role='compute')
+        matcher = NodeMatcher(self.index.load())
+
+        found = matcher.match([{'id': 7, 'mac': make_mac(1, 2).upper()},
+                               {'id': 8, 'mac': '52:54:00:aa:bb:cc'}])
+        self.assertEqual([(node['id'], entry['vm']) for node, entry in found], [(7, 'node-2')])
+        self.assertFalse(matcher.complete)
+
+        found = matcher.match([{'id': 7, 'mac': make_mac(1, 2)},
+                               {'id': 9, 'mac': make_mac(1, 1)}])
+        self.assertEqual([(node['id'], entry['role']) for node, entry in found], [(9, 'controller')])
+        self.assertTrue(matcher.complete)
+
+
+class FlakyProvider(object):
+    """Defines slaves in memory; installing a node in fail raises after
+    the domain has been defined, like a failed virt-install."""
+
+    def __init__(self, fail):
+        self.fail = fail
+        self.domains = set()
+
+    def get_site_provider(self, site):
+        return self
+
+    def get_max_node_id(self, site):
+        return 0
+
+    def get_networks(self, site):
+        return ['site{0}net1'.format(site), 'site{0}net2'.format(site)]
+
+    def get_vm_nodes(self, site):
+        return ['site{0}-{1}'.format(site, name) for name in sorted(self.domains)]
+
+    def get_volume_path(self, name):
+        return None
+
+    def install_vm_node(self, site, name, *args, **kwargs):
+        self.domains.add(name)
+        if name in self.fail:
+            raise RuntimeError('Command failed with exit code 1')
+        return 'site{0}-{1}'.format(site, name)
+
+    def check_vm_node_active(self, site, name):
+        return False
+
+    def delete_vm_node(self, site, name):
+        self.domains.discard(name)
+
+
+@unittest.skipIf(libvirt is None, 'libvirt is not installed')
+class CreateSlavesTest(unittest.TestCase):
+
+    def setUp(self):
+        from fuelbench import FuelBench
+
+        self.work_dir = tempfile.mkdtemp()
+        self.provider = FlakyProvider(fail=['node-2'])
+
+        self.runner = FuelBench(1, self.provider, config_manager.defaults())
+        self.runner.local_workdir = self.work_dir
+        self.runner.iso_fuel_version = '7.0'
+        self.runner.current_release = 'ubuntu'
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_failed_slaves_are_released(self):
+        from fuelbench.error import FuelBenchError
+
+        slaves = [{'role': role, 'slave_cpu': 1, 'slave_ram': 2048, 'slave_disk': 20}
+                  for role in ('controller', 'compute', 'compute')]
+        self.assertRaises(FuelBenchError, self.runner.create_slaves, slaves, start=False)
+
+        self.assertEqual(['node-1', 'node-3'], sorted(self.provider.domains))
+        self.assertEqual(['node-1', 'node-3'],
+                         sorted(entry['vm'] for entry in self.runner.node_index.load().values()))
+        self.assertEqual([2, 4], self.runner.allocate_node_ids(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
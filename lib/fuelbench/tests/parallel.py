@@ -0,0 +1,175 @@
+import time
+import threading
+import unittest
+
+from fuelbench.parallel import run_parallel, AdmissionController, PhaseGraph
+
+
+class RunParallelTest(unittest.TestCase):
+
+    def test_results_keep_item_order(self):
+        def func(item):
+            time.sleep(0.01 * (5 - item))
+            return item * 2
+
+        results = run_parallel(func, range(5), workers=3)
+
+        self.assertEqual([r.item for r in results], range(5))
+        self.assertEqual([r.value for r in results], [0, 2, 4, 6, 8])
+        self.assertTrue(all(r.ok for r in results))
+
+    def test_failures_do_not_stop_other_items(self):
+        def func(item):
+            if item == 2:
+                raise ValueError(item)
+            return item
+
+        done = list()
+        results = run_parallel(func, range(4), workers=2, callback=done.append)
+
+        self.assertEqual([r.ok for r in results], [True, True, False, True])
+        self.assertIsInstance(results[2].error, ValueError)
+        self.assertEqual([r.value for r in results if r.ok], [0, 1, 3])
+        self.assertEqual(sorted(r.item for r in done), range(4))
+
+    def test_workers_bound_concurrency(self):
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def func(item):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+
+        run_parallel(func, range(10), workers=3)
+        self.assertEqual(running[1], 3)
+
+    def test_no_items(self):
+        self.assertEqual(run_parallel(lambda item: item, []), [])
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+    def boot_all(self, controller, count, hold=0.0):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0, 'starts': []}
+
+        def boot(item):
+            with controller.admit():
+                with lock:
+                    state['starts'].append(time.time())
+                    state['running'] += 1
+                    state['peak'] = max(state['peak'], state['running'])
+                time.sleep(hold)
+                with lock:
+                    state['running'] -= 1
+
+        run_parallel(boot, range(count), workers=count)
+        state['starts'].sort()
+        return state
+
+    def test_unlimited(self):
+        state = self.boot_all(AdmissionController(), 6, hold=0.05)
+        self.assertEqual(state['peak'], 6)
+
+    def test_concurrency(self):
+        state = self.boot_all(AdmissionController(concurrency=2), 6, hold=0.05)
+        self.assertEqual(state['peak'], 2)
+
+    def test_interval_spaces_starts(self):
+        state = self.boot_all(AdmissionController(interval=0.05), 4)
+
+        gaps = [b - a for a, b in zip(state['starts'], state['starts'][1:])]
+        self.assertEqual(len(gaps), 3)
+        for gap in gaps:
+            self.assertGreaterEqual(gap, 0.04)
+
+    def test_window_delays_release(self):
+        controller = AdmissionController(concurrency=1, window=0.2)
+
+        with controller.admit():
+            pass
+        start = time.time()
+        with controller.admit():
+            waited = time.time() - start
+
+        self.assertGreaterEqual(waited, 0.15)
+
+    def test_window_holds_slot_after_boot(self):
+        state = self.boot_all(AdmissionController(concurrency=2, window=0.1), 4)
+
+        # the third boot waits for the first slot's window to expire
+        self.assertGreaterEqual(state['starts'][2] - state['starts'][0], 0.08)
+
+
+class PhaseGraphTest(unittest.TestCase):
+
+    def test_phases_wait_for_requirements(self):
+        order = list()
+        lock = threading.Lock()
+
+        def phase(name, delay=0.0):
+            def func():
+                time.sleep(delay)
+                with lock:
+                    order.append(name)
+                return name
+            return func
+
+        graph = PhaseGraph()
+        graph.add('networks', phase('networks', 0.05))
+        graph.add('iso', phase('iso', 0.01))
+        graph.add('install', phase('install'), requires=['networks', 'iso'])
+        graph.add('snapshot', phase('snapshot'), requires=['install'])
+
+        values = graph.run()
+
+        self.assertEqual(order, ['iso', 'networks', 'install', 'snapshot'])
+        self.assertEqual(values['install'], 'install')
+        self.assertEqual([p.name for p in graph.critical_path()], ['networks', 'install', 'snapshot'])
+        self.assertIn('Critical path', graph.report())
+
+    def test_independent_phases_run_concurrently(self):
+        barrier = threading.Event()
+
+        graph = PhaseGraph()
+        graph.add('first', lambda: barrier.wait(5))
+        graph.add('second', barrier.set)
+
+        start = time.time()
+        graph.run()
+        self.assertLess(time.time() - start, 1)
+
+    def test_failure_stops_dependent_phases(self):
+        ran = list()
+
+        def fail():
+            raise ValueError('no ISO')
+
+        def slow():
+            time.sleep(0.05)
+            ran.append('networks')
+
+        graph = PhaseGraph()
+        graph.add('iso', fail)
+        graph.add('networks', slow)
+        graph.add('install', lambda: ran.append('install'), requires=['iso'])
+        graph.add('snapshot', lambda: ran.append('snapshot'), requires=['networks'])
+
+        self.assertRaises(ValueError, graph.run)
+
+        # the running phase finishes, nothing new starts after the failure
+        self.assertEqual(ran, ['networks'])
+        self.assertIsNone(graph.phases['install'].start)
+        self.assertIsNone(graph.phases['snapshot'].start)
+
+    def test_unknown_requirement(self):
+        graph = PhaseGraph()
+        self.assertRaises(ValueError, graph.add, 'install', lambda: None, requires=['networks'])
+
+
+if __name__ == '__main__':
+    unittest.main()
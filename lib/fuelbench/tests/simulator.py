@@ -0,0 +1,93 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+from fabric.api import execute
+
+from fuelbench import ssh
+from fuelbench import remote_tasks
+from fuelbench.error import RemoteTaskError
+
+if paramiko is not None:
+    from fuelbench.simulator import FuelMaster, FuelMasterSimulator
+
+
+@unittest.skipIf(paramiko is None, 'paramiko is not installed')
+class FuelMasterSimulatorTest(unittest.TestCase):
+
+    def start(self, **kwargs):
+        self.root_dir = tempfile.mkdtemp()
+        self.master = FuelMaster(self.root_dir, **kwargs)
+        self.simulator = FuelMasterSimulator(self.master, port=0)
+        self.host_string = 'root@{0}'.format(self.simulator.address)
+
+    def tearDown(self):
+        ssh.disconnect(self.host_string)
+        self.simulator.close()
+        shutil.rmtree(self.root_dir)
+
+    def run_task(self, task, *args):
+        with ssh.session('root', 'r00tme', self.simulator.address, timeout=5):
+            return execute(task, *args)[self.host_string]
+
+    def test_version_and_bootstrap_log(self):
+        self.start(fuel_version='6.1')
+        self.master.booted.wait(5)
+
+        self.assertEqual(self.run_task(remote_tasks.get_fuel_version), '6.1')
+        self.assertTrue(self.run_task(remote_tasks.check_vm_operational))
+
+    def test_watch_bootstrap_log(self):
+        self.start(boot_time=2)
+        lines = list()
+
+        self.assertFalse(self.run_task(remote_tasks.watch_bootstrap_log, 0.5))
+
+        self.assertTrue(self.run_task(remote_tasks.watch_bootstrap_log, 10, lines.append))
+        self.assertLess(time.time() - self.master.ready_at, 1.5)
+        self.assertEqual(lines, ['Starting Fuel node deployment', 'Fuel node deployment complete!'])
+
+    def test_discovery_rate(self):
+        self.start(nodes=4, discovery_rate=2)
+        self.master.booted.wait(5)
+
+        self.assertLess(len(self.run_task(remote_tasks.get_all_fuel_nodes)), 4)
+        time.sleep(2)
+        nodes = self.run_task(remote_tasks.get_all_fuel_nodes)
+        self.assertEqual(sorted(node['id'] for node in nodes), [1, 2, 3, 4])
+        self.assertTrue(all(node['status'] == 'discover' for node in nodes))
+
+    def test_configure_and_deploy(self):
+        self.start(nodes=3, provision_time=0.1, deploy_time=0.1)
+        self.master.booted.wait(5)
+
+        env_id = self.run_task(remote_tasks.create_fuel_env, 'site1', 2, 'ha_compact', 'neutron-vlan')
+        self.run_task(remote_tasks.set_fuel_node_roles, env_id, [1, 2, 3], ['controller'])
+        self.run_task(remote_tasks.configure_fuel_nodes, [1, 2, 3], env_id, '10.20.1.2')
+        self.run_task(remote_tasks.fuel_deploy_changes, env_id)
+
+        nodes = self.run_task(remote_tasks.get_all_fuel_nodes)
+        self.assertEqual([node['status'] for node in nodes], ['ready'] * 3)
+        self.assertEqual(self.master.nodes[1]['interfaces'][0]['name'], 'eth0')
+        self.assertIn('node-1.yaml', self.master.envs[env_id]['provisioning'])
+
+    def test_failure_injection(self):
+        self.start(failures={'env-list': 1.0}, latencies={'node-list': 0.2})
+        self.master.booted.wait(5)
+
+        start = time.time()
+        self.run_task(remote_tasks.get_all_fuel_nodes)
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+        self.assertRaises(RemoteTaskError, self.run_task, remote_tasks.get_all_fuel_env)
+
+
+if __name__ == '__main__':
+    unittest.main()
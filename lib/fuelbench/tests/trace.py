@@ -0,0 +1,113 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+from fuelbench import trace
+
+
+class TraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.work_dir, 'traces', 'site1.json')
+        self.spans = list()
+        trace.add_listener(self.on_span)
+
+    def tearDown(self):
+        trace.remove_listener(self.on_span)
+        trace._path = None
+        del trace._events[:]
+        trace._threads.clear()
+        shutil.rmtree(self.work_dir)
+
+    def on_span(self, name, cat, seconds, args):
+        self.spans.append((name, cat, args))
+
+    def load(self):
+        self.assertEqual(trace.save(), self.path)
+        with open(self.path) as fp:
+            return json.load(fp)['traceEvents']
+
+    def test_disabled(self):
+        with trace.span('install', cat='libvirt'):
+            pass
+        trace.instant('booted')
+
+        self.assertFalse(trace.is_enabled())
+        self.assertIsNone(trace.save())
+        self.assertEqual(self.spans, [('install', 'libvirt', {})])
+
+    def test_nested_spans(self):
+        trace.enable(self.path)
+
+        with trace.span('create_master'):
+            with trace.span('virt-install', cat='subprocess', vm='site1-master'):
+                pass
+            trace.instant('master_up')
+
+        events = self.load()
+        spans = [e for e in events if e['ph'] == 'X']
+
+        self.assertEqual([e['name'] for e in spans], ['virt-install', 'create_master'])
+        inner, outer = spans
+        self.assertEqual(inner['args'], {'vm': 'site1-master'})
+        self.assertGreaterEqual(inner['ts'], outer['ts'])
+        self.assertLessEqual(inner['ts'] + inner['dur'], outer['ts'] + outer['dur'])
+        self.assertEqual([e['name'] for e in events if e['ph'] == 'i'], ['master_up'])
+
+    def test_errors_are_recorded(self):
+        trace.enable(self.path)
+
+        def fail():
+            with trace.span('deploy'):
+                raise ValueError('node-3 failed')
+
+        self.assertRaises(ValueError, fail)
+
+        self.assertEqual(self.load()[0]['args'], {'error': 'node-3 failed'})
+        self.assertEqual(self.spans, [('deploy', 'phase', {'error': 'node-3 failed'})])
+
+    def test_traced(self):
+        @trace.traced(cat='libvirt')
+        def start_vm_node(site, name):
+            return name
+
+        self.assertEqual(start_vm_node(1, 'node-1'), 'node-1')
+        self.assertEqual(start_vm_node.__name__, 'start_vm_node')
+        self.assertEqual(self.spans, [('start_vm_node', 'libvirt', {})])
+
+    def test_failing_listener(self):
+        def listener(name, cat, seconds, args):
+            raise RuntimeError('listener')
+
+        trace.add_listener(listener)
+        try:
+            with trace.span('install'):
+                pass
+        finally:
+            trace.remove_listener(listener)
+
+        self.assertEqual(len(self.spans), 1)
+
+    def test_thread_names(self):
+        trace.enable(self.path)
+
+        def run():
+            with trace.span('boot'):
+                pass
+
+        thread = threading.Thread(target=run, name='boot-node-1')
+        thread.start()
+        thread.join()
+
+        events = self.load()
+        boot = [e for e in events if e['name'] == 'boot'][0]
+        names = dict((e['tid'], e['args']['name']) for e in events if e['ph'] == 'M')
+        self.assertEqual(names[boot['tid']], 'boot-node-1')
+
+
+if __name__ == '__main__':
+    unittest.main()
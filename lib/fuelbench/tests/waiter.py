@@ -0,0 +1,88 @@
+import time
+import threading
+import unittest
+
+from fuelbench.waiter import Backoff, Waiter
+from fuelbench.error import WaitTimeoutError, WaitCancelledError
+
+
+class FixedRandom(object):
+
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+class BackoffTest(unittest.TestCase):
+
+    def test_grows_to_maximum(self):
+        backoff = Backoff(initial=1, maximum=5, factor=2, jitter=0)
+        self.assertEqual([backoff.next() for i in range(5)], [1, 2, 4, 5, 5])
+
+        backoff.reset()
+        self.assertEqual(backoff.next(), 1)
+
+    def test_jitter_shortens_delay(self):
+        backoff = Backoff(initial=4, maximum=4, jitter=0.5, random=FixedRandom(1.0))
+        self.assertEqual(backoff.next(), 2)
+
+
+class WaiterTest(unittest.TestCase):
+
+    def test_wait_returns_accepted_value(self):
+        values = iter([0, 0, 3])
+        seen = list()
+
+        waiter = Waiter('test', initial=0.01, maximum=0.01, progress=seen.append)
+        self.assertEqual(waiter.wait(lambda: next(values)), 3)
+        self.assertEqual(seen, [0, 0, 3])
+        self.assertEqual(waiter.attempts, 3)
+
+    def test_change_resets_backoff(self):
+        values = iter([1, 1, 1, 2, 3])
+
+        waiter = Waiter('test', initial=0.01, maximum=10, jitter=0)
+        waiter.wait(lambda: next(values), until=lambda value: value == 3)
+        self.assertEqual(waiter.backoff.delay, 0.02)
+
+    def test_timeout(self):
+        waiter = Waiter('test', 'nothing', timeout=0.1, initial=0.02)
+        with self.assertRaises(WaitTimeoutError) as cm:
+            waiter.wait(lambda: False)
+
+        self.assertEqual(str(cm.exception), 'Wait for nothing timeout')
+        self.assertLess(waiter.elapsed, 1)
+
+    def test_cancel(self):
+        waiter = Waiter('test', initial=10)
+        threading.Timer(0.1, waiter.cancel).start()
+
+        start = time.time()
+        self.assertRaises(WaitCancelledError, waiter.wait, lambda: False)
+        self.assertLess(time.time() - start, 5)
+
+    def test_wait_all_polls_pending_only(self):
+        calls = {'a': 0, 'b': 0}
+
+        def check(key, ready_after):
+            def func():
+                calls[key] += 1
+                return calls[key] >= ready_after
+            return func
+
+        waiter = Waiter('test', initial=0.01, maximum=0.01)
+        results = waiter.wait_all({'a': check('a', 1), 'b': check('b', 3)})
+
+        self.assertEqual(results, {'a': True, 'b': True})
+        self.assertEqual(calls, {'a': 1, 'b': 3})
+
+    def test_wait_any(self):
+        waiter = Waiter('test', initial=0.01)
+        results = waiter.wait_any({'a': lambda: False, 'b': lambda: 'up'})
+        self.assertEqual(results, {'b': 'up'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+"""Timing spans in the Chrome trace event format.
+
+Spans are recorded only after enable() and written by save() as a JSON
+file that chrome://tracing, Perfetto and speedscope can open. Nested
+spans on the same thread show up stacked.
+"""
+
+import os
+import json
+import time
+import threading
+import functools
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_events = list()
+_threads = dict()
+_listeners = list()
+_path = None
+
+
+def enable(path):
+	"""Start recording spans of this process, to be saved to path."""
+	global _path
+
+	with _lock:
+		_path = path
+		del _events[:]
+		_threads.clear()
+
+def add_listener(func):
+	"""Call func(name, cat, seconds, args) at the end of every span, even
+	when recording is not enabled."""
+	_listeners.append(func)
+
+def remove_listener(func):
+	if func in _listeners:
+		_listeners.remove(func)
+
+def is_enabled():
+	return _path is not None
+
+def _now():
+	return int(time.time() * 1000000)
+
+def _add(event):
+	thread = threading.current_thread()
+	event['pid'] = os.getpid()
+	event['tid'] = thread.ident
+
+	with _lock:
+		if _path is None:
+			return
+
+		_events.append(event)
+
+		if thread.ident not in _threads:
+			_threads[thread.ident] = thread.name
+
+@contextmanager
+def span(name, cat='phase', **args):
+	if _path is None and not _listeners:
+		yield
+		return
+
+	start = _now()
+	try:
+		yield
+	except BaseException as e:
+		args['error'] = str(e) or e.__class__.__name__
+		raise
+	finally:
+		duration = _now() - start
+
+		for listener in _listeners:
+			try:
+				listener(name, cat, duration / 1000000.0, args)
+			except Exception:
+				logger.exception('Span listener failed')
+
+		if _path is not None:
+			_add({'name': name, 'cat': cat, 'ph': 'X',
+				  'ts': start, 'dur': duration, 'args': args})
+
+def traced(name=None, cat='phase'):
+	"""Decorator recording each call of a function as a span."""
+	def decorator(func):
+		span_name = name or func.__name__
+
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			with span(span_name, cat):
+				return func(*args, **kwargs)
+
+		return wrapper
+
+	return decorator
+
+def instant(name, cat='phase', **args):
+	if _path is not None:
+		_add({'name': name, 'cat': cat, 'ph': 'i', 's': 't', 'ts': _now(), 'args': args})
+
+def save():
+	"""Write the recorded spans to the file given to enable()."""
+	with _lock:
+		if _path is None:
+			return None
+
+		pid = os.getpid()
+		events = list(_events)
+		for tid, thread_name in _threads.items():
+			events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+						   'args': {'name': thread_name}})
+
+		path = _path
+
+	directory = os.path.dirname(path)
+	if directory and not os.path.exists(directory):
+		os.makedirs(directory)
+
+	with open(path, 'w') as fp:
+		json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+
+	logger.info('Trace saved to %s', path)
+	return path
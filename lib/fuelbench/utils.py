@@ -20,48 +20,121 @@ from __future__ import print_function
 
 import sys
 import os
+import shutil
 import tempfile
+import threading
+import logging
 import subprocess
+import fcntl
+import tarfile
+import StringIO
+from contextlib import closing, contextmanager
+from distutils.spawn import find_executable
 import netifaces
 import yaml
 
+from fuelbench import iso9660
+from fuelbench import trace
+from fuelbench import metrics
 from fuelbench.settings import *
 
-def make_custom_iso_image(source, site, data_dir,
-						  ipaddr, gateway, dns, netmask, hostname):
-	iso_name = 'site{0}-custom'.format(site)
-	image_dir = os.path.join(data_dir, iso_name)
-	iso_file = tempfile.mkstemp(suffix='.iso', prefix=iso_name + '.')[1]
+logger = logging.getLogger(__name__)
 
-	cmdline = ' '.join([MAKE_ISO_SCRIPT,
-						source, iso_file, image_dir,
+@contextmanager
+def locked(path):
+	"""Hold an exclusive flock on path, shared with other processes."""
+	with open(path, 'a') as fp:
+		fcntl.flock(fp, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(fp, fcntl.LOCK_UN)
+
+def build_custom_iso_image(source, iso_file, work_dir,
+						   ipaddr, gateway, dns, netmask, hostname):
+	# xorriso patches isolinux.cfg into a copy of the source image, which
+	# avoids extracting and rewriting the whole tree
+	if find_executable('xorriso'):
+		script = REMASTER_ISO_SCRIPT
+	else:
+		script = MAKE_ISO_SCRIPT
+
+	cmdline = ' '.join([script,
+						source, iso_file, work_dir,
 						ipaddr, gateway, dns, netmask, hostname])
 
-	retcode = subprocess.call('bash -xe ' + cmdline + ">>{0} 2>&1".format(CONSOLE_LOG), shell=True)
+	with trace.span(os.path.basename(script), cat='subprocess'):
+		retcode = subprocess.call('bash -xe ' + cmdline + ">>{0} 2>&1".format(CONSOLE_LOG), shell=True)
+	metrics.count_exit(os.path.basename(script), retcode)
 
 	if retcode != 0:
 		raise RuntimeError('Script failed with exit code {0}'.format(retcode))
 
 	return iso_file
 
-def retrieve_iso_version(iso_file):
+_iso_version_lock = threading.Lock()
+_iso_version_cache = dict()
 
-	version_file = os.path.join(TEMP_DIR, FUEL_VERSION_FILE)
-	cmdline = 'bsdtar -xf {0} -C {1} {2}'.format(iso_file, TEMP_DIR, FUEL_VERSION_FILE)
+def _extract_iso_version_file(iso_file):
+	temp_dir = tempfile.mkdtemp(dir=TEMP_DIR)
+	version_file = os.path.join(temp_dir, FUEL_VERSION_FILE)
 	
-	retcode = subprocess.call(cmdline + ">>{0} 2>&1".format(CONSOLE_LOG), shell=True)
-
-	if retcode != 0:
-		raise RuntimeError('Script failed with exit code {0}'.format(retcode))
+	try:
+		cmdline = 'bsdtar -xf {0} -C {1} {2}'.format(iso_file, temp_dir, FUEL_VERSION_FILE)
+		
+		with trace.span('bsdtar', cat='subprocess'):
+			retcode = subprocess.call(cmdline + ">>{0} 2>&1".format(CONSOLE_LOG), shell=True)
+		metrics.count_exit('bsdtar', retcode)
+		
+		if retcode != 0:
+			raise RuntimeError('Script failed with exit code {0}'.format(retcode))
+		
+		with open(version_file) as fp:
+			return fp.read()
+	finally:
+		shutil.rmtree(temp_dir, ignore_errors=True)
 
-	version_config=yaml.load(open(version_file))
+def retrieve_iso_version(iso_file):
+	st = os.stat(iso_file)
+	key = (os.path.realpath(iso_file), st.st_size, st.st_mtime, st.st_ino)
+	
+	with _iso_version_lock:
+		if key in _iso_version_cache:
+			return _iso_version_cache[key]
+	
+	try:
+		data = iso9660.read_file(iso_file, FUEL_VERSION_FILE)
+	except (IOError, iso9660.IsoFormatError) as e:
+		# e.g. images without Joliet names; let bsdtar deal with them
+		logger.debug('Fallback to bsdtar for %s: %s', iso_file, e)
+		data = _extract_iso_version_file(iso_file)
+	
+	version_config = yaml.safe_load(data)
 	version = version_config['VERSION']['release']
-
-	if os.path.exists(version_file):
-		os.remove(version_file)
+	
+	with _iso_version_lock:
+		_iso_version_cache[key] = version
 	
 	return version
 
+def add_firstboot_script(image, script, *args):
+	"""Make image run script with args once on its next boot."""
+	remote_path = '/root/' + os.path.basename(script)
+	cmdline = "virt-customize -a {image} --upload {script}:{remote_path} --firstboot-command 'sh {remote_path} {args}'".format(image=image,
+																																script=script,
+																																remote_path=remote_path,
+																																args=' '.join(map(str, args)))
+	
+	with open(CONSOLE_LOG, 'a') as log:
+		print(cmdline, file=log)
+	
+	with trace.span('virt-customize', cat='subprocess', image=os.path.basename(image)):
+		retcode = subprocess.call(cmdline + ">>{0} 2>&1".format(CONSOLE_LOG), shell=True)
+	metrics.count_exit('virt-customize', retcode)
+	
+	if retcode != 0:
+		raise RuntimeError('Command failed with exit code {0}'.format(retcode))
+
 def get_primary_addr():
 	devices = netifaces.interfaces()
 	primary = None
@@ -131,12 +204,65 @@ def parse_list(str):
 	
 	return result
 
+def parse_site_list(str):
+	"""Parse site ids like '1-8,12' into a sorted list without duplicates."""
+	sites = set()
+	
+	for value in parse_list(str):
+		if '-' in value:
+			first, last = value.split('-', 1)
+			first, last = int(first), int(last)
+			if first > last:
+				raise ValueError('Invalid site range: {0}'.format(value))
+			sites.update(range(first, last + 1))
+		else:
+			sites.add(int(value))
+	
+	if not sites:
+		raise ValueError('No site id in: {0}'.format(str))
+	
+	return sorted(sites)
+	
 def parse_eval(str):
 	if not str:
 		return None
 	else:
 		return eval(str)
 	
+class PrefixedStream(object):
+	"""File-like wrapper writing each complete line to stream with a prefix,
+	so that the output of concurrent sites stays readable."""
+	
+	def __init__(self, stream, prefix):
+		self.stream = stream
+		self.prefix = prefix
+		self._buffer = ''
+		self._lock = threading.Lock()
+	
+	def write(self, data):
+		with self._lock:
+			self._buffer += data
+			
+			while '\n' in self._buffer:
+				line, self._buffer = self._buffer.split('\n', 1)
+				self.stream.write(self.prefix + line + '\n')
+			
+			self.stream.flush()
+	
+	def flush(self):
+		# partial lines such as 'Cleaning up... ' wait for their result
+		pass
+	
+	def close(self):
+		with self._lock:
+			if self._buffer:
+				self.stream.write(self.prefix + self._buffer + '\n')
+				self._buffer = ''
+			self.stream.flush()
+	
+	def __getattr__(self, name):
+		return getattr(self.stream, name)
+	
 def modify_yamlfile(file, callable, *args, **kwargs):
 	with open(file, 'r') as fp:
 		yaml_data = yaml.load(fp)
@@ -148,4 +274,31 @@ def modify_yamlfile(file, callable, *args, **kwargs):
 	
 	return yaml_data
 	
+def transform_yaml_tarball(fileobj, transforms):
+	"""Rewrite YAML members of a gzipped tarball in memory.
+	
+	transforms maps a member name to a (callable, args) pair applied like
+	modify_yamlfile. Returns a new tarball as a StringIO."""
+	fileobj.seek(0)
+	output = StringIO.StringIO()
+	
+	with closing(tarfile.open(fileobj=fileobj, mode='r:gz')) as source:
+		with closing(tarfile.open(fileobj=output, mode='w:gz')) as target:
+			for member in source.getmembers():
+				data = source.extractfile(member).read() if member.isfile() else None
+				
+				if member.name in transforms:
+					callable, args = transforms[member.name]
+					yaml_data = yaml.load(data)
+					callable(yaml_data, *args)
+					data = yaml.dump(yaml_data, default_flow_style=False)
+					logger.debug('Saving %s: ', member.name)
+					logger.debug(yaml_data)
+					member.size = len(data)
+				
+				target.addfile(member, StringIO.StringIO(data) if data is not None else None)
+	
+	output.seek(0)
+	return output
+	
 	
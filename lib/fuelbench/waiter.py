@@ -0,0 +1,187 @@
+#    Copyright 2015 Lenovo, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+#    Author: Joey Zhang <zhangzhuo4@lenovo.com>
+
+"""Polling with exponential backoff, jitter, deadlines and cancellation.
+
+A Waiter calls a check function until its result is accepted. Between
+polls it sleeps for a delay that starts at initial, grows by factor up
+to maximum and is shortened at random by up to jitter of itself, so
+that sites polling at the same time drift apart. The delay drops back
+to initial whenever the result changes: something is moving, and the
+next change is likely to come soon.
+"""
+
+import time
+import random
+import threading
+import logging
+
+from fuelbench import metrics
+from fuelbench.error import WaitTimeoutError, WaitCancelledError
+
+logger = logging.getLogger(__name__)
+
+_UNSET = object()
+
+
+class Backoff(object):
+
+	def __init__(self, initial=1, maximum=30, factor=2, jitter=0.5, random=random):
+		self.initial = initial
+		self.maximum = maximum
+		self.factor = factor
+		self.jitter = jitter
+		self._random = random
+		self.reset()
+
+	def reset(self):
+		self.delay = self.initial
+
+	def next(self):
+		"""Return the next delay, jittered, and grow the base delay."""
+		delay = self.delay
+		self.delay = min(self.maximum, self.delay * self.factor)
+		return delay * (1 - self.jitter * self._random.random())
+
+
+class Waiter(object):
+	"""Poll until a condition holds, a deadline passes or cancel() is called.
+
+	name labels the poll counter in the metrics and what completes the
+	messages of the timeout and cancellation errors ("Wait for <what>
+	timeout"). progress, if given, is called with the result of every
+	poll. A timeout of None waits forever.
+	"""
+
+	def __init__(self, name, what=None, timeout=None, initial=1, maximum=30,
+				 factor=2, jitter=0.5, progress=None, cancel_event=None):
+		self.name = name
+		self.what = what or name
+		self.timeout = timeout
+		self.backoff = Backoff(initial, maximum, factor, jitter)
+		self.progress = progress
+		self.cancel_event = cancel_event or threading.Event()
+
+		self.attempts = 0
+		self.start = None
+
+	def cancel(self):
+		"""Make the wait raise WaitCancelledError, from any thread."""
+		self.cancel_event.set()
+
+	@property
+	def elapsed(self):
+		if self.start is None:
+			return 0.0
+		return time.time() - self.start
+
+	def remaining(self):
+		if self.timeout is None:
+			return None
+		return max(0.0, self.timeout - self.elapsed)
+
+	def __poll(self, check):
+		if self.cancel_event.is_set():
+			raise WaitCancelledError(self.what)
+
+		self.attempts += 1
+		metrics.count_poll(self.name)
+		return check()
+
+	def __sleep(self, changed):
+		if changed:
+			self.backoff.reset()
+
+		delay = self.backoff.next()
+		remaining = self.remaining()
+
+		if remaining is not None:
+			if remaining <= 0:
+				raise WaitTimeoutError(self.what, self.timeout)
+			delay = min(delay, remaining)
+
+		logger.debug('%s: poll %d, next in %.1fs', self.name, self.attempts, delay)
+
+		if self.cancel_event.wait(delay):
+			raise WaitCancelledError(self.what)
+
+	def wait(self, check, until=bool):
+		"""Call check() until until(result) is true and return the result.
+
+		Exceptions raised by check end the wait.
+		"""
+		self.attempts = 0
+		self.start = time.time()
+		self.backoff.reset()
+		last = _UNSET
+
+		while True:
+			value = self.__poll(check)
+
+			if self.progress is not None:
+				self.progress(value)
+
+			if until(value):
+				return value
+
+			self.__sleep(last is not _UNSET and value != last)
+			last = value
+
+	def wait_all(self, checks, until=bool, count=None):
+		"""Poll several conditions together until count of them (all by
+		default) hold.
+
+		checks maps keys to check functions. Accepted conditions are not
+		polled again. Returns a dict of the accepted results; progress
+		gets a dict of the latest result of every condition.
+		"""
+		if count is None:
+			count = len(checks)
+
+		self.attempts = 0
+		self.start = time.time()
+		self.backoff.reset()
+
+		pending = dict(checks)
+		latest = dict()
+		results = dict()
+
+		while True:
+			changed = False
+
+			for key, check in pending.items():
+				value = self.__poll(check)
+
+				if key in latest and value != latest[key]:
+					changed = True
+				latest[key] = value
+
+				if until(value):
+					results[key] = value
+					del pending[key]
+					changed = True
+
+			if self.progress is not None:
+				self.progress(dict(latest))
+
+			if len(results) >= count:
+				return results
+
+			self.__sleep(changed)
+
+	def wait_any(self, checks, until=bool):
+		"""Like wait_all() but return as soon as one condition holds."""
+		return self.wait_all(checks, until=until, count=1)